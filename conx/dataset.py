@@ -23,15 +23,425 @@ manipulating a set of inputs/targets.
 """
 
 import numpy as np
-import copy, numbers, inspect, sys
+import copy, numbers, inspect, sys, os, glob, weakref, json, re
+import concurrent.futures
+import PIL.Image
 from IPython.display import display
 import types
+import h5py
+import scipy.sparse
+
+from keras.utils import Sequence
 
 from .utils import *
 import conx.datasets
 
 py_slice = slice
 
+## Number of bytes to move at a time when working on memmap banks:
+MEMMAP_CHUNK_BYTES = 64 * 1024 * 1024
+## Approximate size of an HDF5 chunk, in bytes:
+HDF5_CHUNK_BYTES = 1024 * 1024
+## Version of the Dataset.save() file layout:
+HDF5_FORMAT_VERSION = 1
+
+def _chunk_rows(array):
+    """
+    Number of rows of array that fit in MEMMAP_CHUNK_BYTES (once
+    densified, for a sparse bank).
+    """
+    row_bytes = max(int(np.prod(array.shape[1:])) * array.dtype.itemsize, 1)
+    return max(MEMMAP_CHUNK_BYTES // row_bytes, 1)
+
+def _bank_dtype(values, declared=None):
+    """
+    The dtype to keep a bank in: the declared one (eg, an input layer's
+    dtype), if any. Otherwise, integer arrays keep their type (int64 is
+    narrowed to int32, if the values fit), and everything else, like
+    lists of numbers, is float32.
+    """
+    if declared is not None:
+        return np.dtype(declared)
+    if isinstance(values, np.ndarray) or scipy.sparse.issparse(values):
+        dtype = values.dtype
+        if dtype.kind in "iu" and dtype.itemsize > 4:
+            info = np.iinfo("int32")
+            if np.prod(values.shape) == 0 or info.min <= values.min() and values.max() <= info.max:
+                return np.dtype("int32")
+        if dtype.kind in "iu":
+            return dtype
+    return np.dtype("float32")
+
+def _num_rows(bank):
+    """
+    Number of rows of a bank; len() is not defined for sparse banks.
+    """
+    return bank.shape[0]
+
+def _any_sparse(banks):
+    """
+    Is any of the banks (a list, or None) a scipy.sparse matrix?
+    """
+    return banks is not None and any(scipy.sparse.issparse(bank) for bank in banks)
+
+def _called_on_class(self):
+    """
+    Was a Dataset method that can be called on the class, like
+    Dataset.get("mnist"), called on it? If so, self is really the
+    method's first argument.
+    """
+    return not isinstance(self, Dataset)
+
+def _take(bank, rows):
+    """
+    Get the rows of a bank (an index, slice, or array of indices) as
+    a numpy array. Sparse (scipy.sparse) banks are densified, just
+    for these rows.
+    """
+    if scipy.sparse.issparse(bank):
+        if isinstance(rows, numbers.Integral):
+            return bank[rows].toarray()[0]
+        return bank[rows].toarray()
+    return bank[rows]
+
+def _memmap_copy(array, filename, rows=None):
+    """
+    Copy array (optionally just the given rows, in that order) into a
+    new .npy file, chunk by chunk, and return it opened as an np.memmap.
+    """
+    shape = array.shape if rows is None else (len(rows),) + array.shape[1:]
+    out = np.lib.format.open_memmap(filename, mode="w+", dtype=array.dtype,
+                                    shape=shape)
+    step = _chunk_rows(array)
+    for i in range(0, len(out), step):
+        if rows is None:
+            out[i:i + step] = array[i:i + step]
+        else:
+            ## read the source rows in file order, then put them in place:
+            indices = rows[i:i + step]
+            order = np.argsort(indices)
+            chunk = out[i:i + step]
+            chunk[order] = array[indices[order]]
+    out.flush()
+    return out
+
+def _hdf5_create_bank(group, name, bank, dtype=None):
+    """
+    Create an empty, resizable, chunked and compressed HDF5 dataset
+    for a bank, in group. Give dtype if the rows will be stored in a
+    different type than the bank's (eg, decoded labels).
+    """
+    dtype = np.dtype(dtype) if dtype is not None else bank.dtype
+    row_bytes = max(int(np.prod(bank.shape[1:])) * dtype.itemsize, 1)
+    chunk_rows = max(min(HDF5_CHUNK_BYTES // row_bytes, _num_rows(bank)), 1)
+    if dtype.kind in "US":
+        dtype = h5py.special_dtype(vlen=str)
+    return group.create_dataset(name, shape=(0,) + bank.shape[1:],
+                                maxshape=(None,) + bank.shape[1:],
+                                dtype=dtype, chunks=(chunk_rows,) + bank.shape[1:],
+                                compression="gzip", shuffle=True)
+
+def _hdf5_read_bank(data, start, stop):
+    """
+    Read rows start:stop of an HDF5 dataset into a numpy array.
+    Strings come back as str, whichever h5py version wrote them.
+    """
+    array = data[start:stop]
+    if h5py.check_dtype(vlen=data.dtype) is str or array.dtype.kind == "O":
+        array = np.array([x.decode("utf-8") if isinstance(x, bytes) else x
+                          for x in array], dtype=str)
+    return array
+
+def _encode_labels(labels):
+    """
+    Convert an array of labels into (integer codes, vocabulary), such
+    that vocabulary[codes] gives the labels back.
+    """
+    vocab, codes = np.unique(np.asarray(labels, dtype=str), return_inverse=True)
+    return codes.astype("int32").reshape(-1), vocab
+
+def _onehot_matrix(values, width):
+    """
+    onehot() of each of the integers in values, as rows of a matrix.
+    """
+    return np.eye(width, dtype="uint8")[np.asarray(values, dtype=int)]
+
+def _binary_matrix(values, width):
+    """
+    binary() of each of the integers in values, as rows of a matrix.
+    """
+    bits = np.arange(width - 1, -1, -1)
+    return ((np.asarray(values, dtype=int)[:, np.newaxis] >> bits) & 1).astype("uint8")
+
+def _bank_stats(array, rows=None):
+    """
+    Statistics of all of the values in array (or just in the given
+    rows): number of values, min, max, mean, and the sum of squared
+    differences from the mean (for the variance). Computed a chunk at
+    a time, so that memmap banks are never read into memory at once.
+    """
+    if scipy.sparse.issparse(array):
+        return _sparse_stats(array if rows is None else array[rows])
+    size = _num_rows(array) if rows is None else len(rows)
+    row_values = max(int(np.prod(array.shape[1:])), 1)
+    step = max(MEMMAP_CHUNK_BYTES // (row_values * 8), 1)
+    stats = None
+    for i in range(0, size, step):
+        chunk = _take(array, py_slice(i, i + step) if rows is None else rows[i:i + step])
+        stats = _merge_stats(stats, _chunk_stats(chunk))
+    return stats
+
+def _chunk_stats(chunk):
+    if chunk.size == 0:
+        return None
+    values = np.asarray(chunk, "float64")
+    mean = values.mean()
+    return {"n": values.size, "min": chunk.min(), "max": chunk.max(),
+            "mean": mean, "m2": ((values - mean) ** 2).sum()}
+
+def _sparse_stats(matrix):
+    """
+    The statistics of a sparse matrix, from its stored values; the
+    zeros are counted, but never densified.
+    """
+    n = matrix.shape[0] * matrix.shape[1]
+    if n == 0:
+        return None
+    values = np.asarray(matrix.data, "float64")
+    zeros = n - len(values)
+    mean = values.sum() / n
+    low = values.min() if len(values) else 0
+    high = values.max() if len(values) else 0
+    if zeros:
+        low, high = min(low, 0), max(high, 0)
+    return {"n": n, "min": low, "max": high, "mean": mean,
+            "m2": ((values - mean) ** 2).sum() + zeros * mean ** 2}
+
+def _merge_stats(a, b):
+    """
+    Combine the statistics of two sets of values (Chan et al.'s
+    parallel algorithm for the variance).
+    """
+    if a is None or b is None:
+        return a if b is None else b
+    n = a["n"] + b["n"]
+    delta = b["mean"] - a["mean"]
+    return {"n": n, "min": min(a["min"], b["min"]), "max": max(a["max"], b["max"]),
+            "mean": a["mean"] + delta * b["n"] / n,
+            "m2": a["m2"] + b["m2"] + delta ** 2 * a["n"] * b["n"] / n}
+
+## File extensions found by Dataset.load_images() in a directory:
+IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff"]
+
+def _row_bytes(chunks):
+    """
+    The bytes of each row, over a list of chunks (one per bank) with
+    the same number of rows, as one (rows, bytes) uint8 array.
+    """
+    return np.hstack([np.ascontiguousarray(chunk).reshape(len(chunk), -1).view(np.uint8)
+                      if chunk.size > 0 else np.zeros((len(chunk), 0), np.uint8)
+                      for chunk in chunks])
+
+def _row_hashes(chunks):
+    """
+    A 64-bit (FNV-1a style) hash of the bytes of each row, over a list
+    of chunks (one per bank) with the same number of rows. The rows
+    are hashed together, a column of 64-bit words at a time.
+    """
+    data = _row_bytes(chunks)
+    data = np.hstack([data, np.zeros((len(data), -data.shape[1] % 8), np.uint8)])
+    hashes = np.full(len(data), 0xcbf29ce484222325, np.uint64)
+    for column in np.ascontiguousarray(data).view(np.uint64).T:
+        hashes = (hashes ^ column) * np.uint64(0x100000001b3)
+    return hashes
+
+def _read_image(filename, size=None, mode=None):
+    """
+    Read an image file as a uint8 array of shape (height, width,
+    channels), optionally converted to PIL mode and resized to size,
+    (width, height).
+    """
+    with PIL.Image.open(filename) as image:
+        if mode is not None and image.mode != mode:
+            image = image.convert(mode)
+        if size is not None and image.size != tuple(size):
+            image = image.resize(tuple(size), PIL.Image.BILINEAR)
+        array = np.asarray(image, dtype="uint8")
+    if array.ndim == 2:
+        array = array[:, :, np.newaxis]
+    return array
+
+def _image_label(filename, label_from):
+    """
+    Get the label of an image file: "dir" uses the name of the
+    directory it is in; a function is given the filename; any other
+    string is a regular expression searched for in the file's name,
+    using the first group if there is one.
+    """
+    if label_from == "dir":
+        return os.path.basename(os.path.dirname(os.path.abspath(filename)))
+    elif callable(label_from):
+        return str(label_from(filename))
+    match = re.search(label_from, os.path.basename(filename))
+    if match is None:
+        raise Exception("label pattern %r does not match '%s'" % (label_from, filename))
+    return match.group(1) if match.groups() else match.group(0)
+
+def _image_axes(batch):
+    """
+    Get a view of a batch of images with the axes in (batch, height,
+    width, ...) order, and a function to put a result back in the
+    batch's own order.
+    """
+    import keras.backend as K
+    if batch.ndim == 3:
+        return batch, lambda result: result
+    elif batch.ndim == 4 and K.image_data_format() == 'channels_first':
+        return np.moveaxis(batch, 1, -1), lambda result: np.moveaxis(result, -1, 1)
+    elif batch.ndim == 4:
+        return batch, lambda result: result
+    raise Exception("augmentation needs a bank of images; got a batch of shape %s" % (batch.shape,))
+
+def _gather_pixels(images, ys, xs):
+    """
+    Gather images[n, ys[n, y, x], xs[n, y, x]] for each image n, with
+    zeros where the coordinates are outside the image.
+    """
+    n, height, width = images.shape[:3]
+    valid = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+    result = images[np.arange(n)[:, None, None],
+                    np.clip(ys, 0, height - 1), np.clip(xs, 0, width - 1)]
+    result[~valid] = 0
+    return result
+
+def _augment_flip(batch, direction="horizontal", probability=0.5):
+    """
+    Flip a random selection of the images, left-right ("horizontal")
+    or top-bottom ("vertical").
+    """
+    images, restore = _image_axes(batch)
+    axis = {"horizontal": 2, "vertical": 1}[direction]
+    flip = np.random.rand(len(images)) < probability
+    images = images.copy()
+    images[flip] = np.flip(images[flip], axis)
+    return restore(images)
+
+def _augment_shift(batch, fraction=0.1):
+    """
+    Shift each image by a random number of pixels, up to fraction of
+    its height and width, filling with zeros.
+    """
+    images, restore = _image_axes(batch)
+    n, height, width = images.shape[:3]
+    dy = np.random.randint(-int(fraction * height), int(fraction * height) + 1, n)
+    dx = np.random.randint(-int(fraction * width), int(fraction * width) + 1, n)
+    ys = np.arange(height)[None, :, None] - dy[:, None, None]
+    xs = np.arange(width)[None, None, :] - dx[:, None, None]
+    return restore(_gather_pixels(images, np.broadcast_to(ys, (n, height, width)),
+                                  np.broadcast_to(xs, (n, height, width))))
+
+def _augment_rotate(batch, degrees=15):
+    """
+    Rotate each image about its center by a random angle, up to
+    degrees either way (nearest pixel; corners are filled with zeros).
+    """
+    images, restore = _image_axes(batch)
+    n, height, width = images.shape[:3]
+    angles = np.radians(np.random.uniform(-degrees, degrees, n))[:, None, None]
+    cy, cx = (height - 1) / 2, (width - 1) / 2
+    y = np.arange(height)[None, :, None] - cy
+    x = np.arange(width)[None, None, :] - cx
+    ## for each output pixel, the source pixel (inverse rotation):
+    ys = np.round(cy + y * np.cos(angles) - x * np.sin(angles)).astype(int)
+    xs = np.round(cx + y * np.sin(angles) + x * np.cos(angles)).astype(int)
+    return restore(_gather_pixels(images, ys, xs))
+
+def _augment_crop(batch, fraction=0.1):
+    """
+    Crop a random box from each image, removing up to fraction of its
+    height and width, and stretch it back to the full size.
+    """
+    images, restore = _image_axes(batch)
+    n, height, width = images.shape[:3]
+    scale = 1 - np.random.uniform(0, fraction, n)[:, None, None]
+    top = np.random.uniform(0, 1, n)[:, None, None] * (1 - scale) * height
+    left = np.random.uniform(0, 1, n)[:, None, None] * (1 - scale) * width
+    ys = (top + np.arange(height)[None, :, None] * scale).astype(int)
+    xs = (left + np.arange(width)[None, None, :] * scale).astype(int)
+    return restore(_gather_pixels(images, np.broadcast_to(ys, (n, height, width)),
+                                  np.broadcast_to(xs, (n, height, width))))
+
+def _augment_noise(batch, stddev=0.05):
+    """
+    Add gaussian noise to every value.
+    """
+    return batch + np.random.normal(0, stddev, batch.shape).astype(batch.dtype)
+
+## Augmentations known by name to Dataset.augment():
+AUGMENTATIONS = {
+    "flip": _augment_flip,
+    "shift": _augment_shift,
+    "rotate": _augment_rotate,
+    "crop": _augment_crop,
+    "noise": _augment_noise,
+}
+
+def _memmap_bank_index(filename):
+    """
+    Get the bank index from a memmap filename, like "inputs_1.npy".
+    """
+    return int(os.path.basename(filename).rsplit("_", 1)[1][:-len(".npy")])
+
+def _is_full_memmap(array, filename):
+    """
+    Is array a memmap of the complete contents of filename, whose
+    changes (if any) are written to it (so, not copy-on-write)?
+    """
+    return (isinstance(array, np.memmap) and array.mode != "c" and
+            array.filename is not None and
+            os.path.abspath(array.filename) == os.path.abspath(filename) and
+            array.flags.c_contiguous and
+            array.shape == np.load(filename, mmap_mode="r").shape)
+
+def _apply_steps(steps, chunk):
+    """
+    Pass a chunk of rows through a chain of transform steps (see
+    Dataset.map()), in one pass.
+    """
+    for step in steps:
+        kind = step[0]
+        if kind == "scale":
+            chunk = np.asarray(chunk, "float32") * np.float32(step[1]) + np.float32(step[2])
+        elif kind == "map":
+            function, batched = step[1], step[2]
+            if batched:
+                chunk = np.asarray(function(chunk))
+            else:
+                chunk = np.array([function(row) for row in chunk])
+        elif kind == "rescale":
+            chunk = rescale_numpy_array(chunk, step[1], step[2], step[3])
+        elif kind == "reshape":
+            chunk = chunk.reshape((len(chunk),) + step[1])
+        elif kind == "cast":
+            chunk = chunk.astype(step[1])
+    return chunk
+
+def _pending(name):
+    """
+    A Dataset attribute that first applies any pending transforms
+    (see Dataset.map()) when it is read.
+    """
+    def getter(self):
+        if self._transforms:
+            self.apply_transforms()
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            raise AttributeError(name)
+    def setter(self, value):
+        self.__dict__[name] = value
+    return property(getter, setter)
+
 class DataVector():
     """
     Class to make internal Keras numpy arrays look like
@@ -187,6 +597,219 @@ class DataVector():
         raise Exception("setting value in a dataset is not permitted;" +
                         " you'll have to recreate the dataset and re-load")
 
+    def _get_range(self):
+        """
+        Get the (start, stop) rows of the internal banks that this
+        vector covers, taking the train/test split into account.
+        """
+        size, num_train, num_test = self.dataset._get_split_sizes()
+        if self.item.startswith("train_"):
+            return (0, num_train)
+        elif self.item.startswith("test_"):
+            return (size - num_test, size)
+        else:
+            return (0, size)
+
+    def _get_banks(self):
+        """
+        Get the internal list of numpy arrays (one per bank) behind
+        this vector.
+        """
+        if self.item.endswith("inputs"):
+            return self.dataset._inputs
+        elif self.item.endswith("targets"):
+            return self.dataset._targets
+        elif self.item.endswith("labels"):
+            return self.dataset._labels
+        else:
+            raise Exception("unknown vector: %s" % (self.item,))
+
+    def array(self, bank_index=0):
+        """
+        Get the numpy array of a bank, as a view into the dataset
+        (no copy is made, unless the dataset has been shuffled or
+        randomly split, in which case the rows are gathered, or the
+        bank is in compact storage, in which case it is converted).
+        A sparse bank gives a scipy.sparse matrix.
+
+        >>> ds = Dataset()
+        >>> ds.load([[[0, 0], [0]],
+        ...          [[0, 1], [1]],
+        ...          [[1, 0], [1]],
+        ...          [[1, 1], [0]]])
+        >>> ds.split(1)
+        >>> ds.inputs.array(0).shape
+        (4, 2)
+        >>> ds.train_inputs.array().shape
+        (3, 2)
+        >>> ds.test_targets.array()
+        array([[0.]], dtype=float32)
+        >>> ds.test_inputs.array().base is ds._inputs[0]
+        True
+        """
+        banks = self._get_banks()
+        if not 0 <= bank_index < len(banks):
+            raise Exception("%s bank_index is out of range" % (self.item,))
+        start, stop = self._get_range()
+        if self.dataset._index is not None: ## lazily shuffled; must gather
+            array = banks[bank_index][self.dataset._index[start:stop]]
+        else:
+            array = banks[bank_index][start:stop]
+        if self.item.endswith("inputs"): ## compact storage is converted
+            array = self.dataset._decode_inputs(bank_index, array)
+        elif self.item.endswith("labels"): ## integer codes are converted
+            array = self.dataset._label_vocab[bank_index][array]
+        return array
+
+    def _get_view(self, pos):
+        """
+        Get the numpy array(s) for pos, in the same format as the
+        human API: a single array if one bank, else a list of arrays.
+        Indices are within the vector (eg, just the training patterns).
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=[[i] for i in range(5)], targets=[[i] for i in range(5)])
+        >>> ds.split(2)
+        >>> ds.train_inputs.view[[0, -1]].tolist(), ds.test_inputs.view[[-1]].tolist()
+        ([[0.0], [2.0]], [[4.0]])
+        >>> ds.train_inputs.view[[3]]
+        Traceback (most recent call last):
+        ...
+        IndexError: train_inputs index is out of bounds: [3]
+        >>> ds.train_inputs.view[-1].tolist(), [row.tolist() for row in ds.test_inputs.view]
+        ([2.0], [[3.0], [4.0]])
+        >>> ds.test_inputs.view[2]
+        Traceback (most recent call last):
+        ...
+        IndexError: test_inputs index is out of bounds: 2
+        """
+        start, stop = self._get_range()
+        if isinstance(pos, slice):
+            first, last, step = pos.indices(stop - start)
+            pos = py_slice(start + first, start + last, step)
+        elif isinstance(pos, (list, tuple, np.ndarray)): ## fancy index, makes copy
+            pos = np.asarray(pos)
+            if pos.dtype == bool:
+                pos = np.flatnonzero(pos)
+            pos = pos.astype(int)
+            if len(pos) > 0 and not (-(stop - start) <= pos.min() and pos.max() < stop - start):
+                raise IndexError("%s index is out of bounds: %s" % (self.item, pos.tolist()))
+            pos = np.where(pos < 0, pos + (stop - start), pos) + start
+        elif isinstance(pos, numbers.Integral):
+            if not -(stop - start) <= pos < stop - start:
+                raise IndexError("%s index is out of bounds: %d" % (self.item, pos))
+            pos = (pos + (stop - start) if pos < 0 else pos) + start
+        else:
+            raise Exception("invalid index: %s" % (pos,))
+        if self.dataset._index is not None: ## lazily shuffled; must gather
+            pos = self.dataset._index[pos]
+        data = [_take(bank, pos) for bank in self._get_banks()]
+        if self.item.endswith("inputs"): ## compact storage is converted
+            data = [self.dataset._decode_inputs(b, data[b]) for b in range(len(data))]
+        elif self.item.endswith("labels"): ## integer codes are converted
+            data = [self.dataset._label_vocab[b][data[b]] for b in range(len(data))]
+        if len(data) == 1:
+            return data[0]
+        else:
+            return data
+
+    def _get_view_vector(self):
+        return DataVectorView(self)
+
+    view = property(_get_view_vector)
+
+    def batches(self, batch_size, bank_index=None):
+        """
+        Iterate over the vector in batches of numpy array views.
+
+        Each batch is an array if one bank (or a bank_index is given),
+        else a list of arrays, one per bank.
+
+        >>> ds = Dataset()
+        >>> ds.load([[[0, 0], [0]],
+        ...          [[0, 1], [1]],
+        ...          [[1, 0], [1]],
+        ...          [[1, 1], [0]]])
+        >>> [batch.shape for batch in ds.inputs.batches(3)]
+        [(3, 2), (1, 2)]
+        >>> ds.shuffle()
+        >>> ds.split(1)
+        >>> np.concatenate(list(ds.train_targets.batches(2, 0))).tolist() == ds.train_targets[:]
+        True
+        """
+        if not isinstance(batch_size, numbers.Integral) or batch_size <= 0:
+            raise Exception("batch_size must be a positive integer")
+        banks = self._get_banks()
+        if bank_index is not None and not 0 <= bank_index < len(banks):
+            raise Exception("%s bank_index is out of range" % (self.item,))
+        indices = range(len(banks)) if bank_index is None else [bank_index]
+        start, stop = self._get_range()
+        index = self.dataset._index
+        for i in range(start, stop, batch_size):
+            ## just the rows of this batch are gathered, and converted:
+            rows = (py_slice(i, min(i + batch_size, stop)) if index is None else
+                    index[i:min(i + batch_size, stop)])
+            data = [_take(banks[b], rows) for b in indices]
+            if self.item.endswith("inputs"): ## compact storage is converted
+                data = [self.dataset._decode_inputs(b, array) for (b, array) in zip(indices, data)]
+            elif self.item.endswith("labels"): ## integer codes are converted
+                data = [self.dataset._label_vocab[b][array] for (b, array) in zip(indices, data)]
+            yield data[0] if len(data) == 1 else data
+
+    def indices(self, label, bank_index=0):
+        """
+        Get the indices of the patterns with the given label, from a
+        prebuilt label index (no scan of the labels is needed).
+
+        >>> ds = Dataset()
+        >>> ds.load([[[0, 0], [0], "zero"],
+        ...          [[0, 1], [1], "one"],
+        ...          [[1, 0], [1], "one"],
+        ...          [[1, 1], [0], "zero"]])
+        >>> ds.labels.indices("one")
+        [1, 2]
+        >>> ds.split(2)
+        >>> ds.test_labels.indices("zero")
+        [1]
+        >>> ds.inputs.view[ds.labels.indices("zero")]
+        array([[0., 0.],
+               [1., 1.]], dtype=float32)
+        """
+        if not self.item.endswith("labels"):
+            raise Exception("indices() requires a labels vector: %s" % (self.item,))
+        positions = self.dataset._get_label_indices(label, bank_index)
+        start, stop = self._get_range()
+        if (start, stop) != (0, self.dataset._get_size()):
+            positions = positions[(positions >= start) & (positions < stop)] - start
+        return positions.tolist()
+
+    def counts(self, bank_index=0):
+        """
+        Get the number of patterns with each label, as a dictionary.
+
+        >>> ds = Dataset()
+        >>> ds.load([[[0, 0], [0], "zero"],
+        ...          [[0, 1], [1], "one"],
+        ...          [[1, 0], [1], "one"],
+        ...          [[1, 1], [0], "zero"]])
+        >>> sorted(ds.labels.counts().items())
+        [('one', 2), ('zero', 2)]
+        """
+        if not self.item.endswith("labels"):
+            raise Exception("counts() requires a labels vector: %s" % (self.item,))
+        if not 0 <= bank_index < len(self.dataset._labels):
+            raise Exception("labels bank_index is out of range")
+        vocab = self.dataset._label_vocab[bank_index]
+        start, stop = self._get_range()
+        if (start, stop) == (0, self.dataset._get_size()):
+            order, bounds = self.dataset._get_label_index(bank_index)
+            counts = np.diff(bounds)
+        else:
+            codes = self.dataset._labels[bank_index]
+            rows = self.dataset._get_index()[start:stop] if self.dataset._index is not None else py_slice(start, stop)
+            counts = np.bincount(codes[rows], minlength=len(vocab))
+        return {str(label): int(count) for (label, count) in zip(vocab, counts) if count > 0}
+
     def get_shape(self, bank_index=None):
         """
         Get the shape of the tensor at bank_index.
@@ -257,6 +880,11 @@ class DataVector():
         function() takes (i, dataset) and returns True or False
         filter will return all items that match the filter.
 
+        To select by label, dataset.labels.indices(label) is much
+        faster, as it uses a prebuilt index rather than a scan. See
+        also Dataset.select(), which selects with numpy operations,
+        and returns a Dataset.
+
         Examples:
             >>> ds = Dataset()
             >>> print("Downloading...");ds.get("mnist") # doctest: +ELLIPSIS
@@ -331,23 +959,15 @@ class DataVector():
             new_shape = tuple([new_shape])
         else:
             new_shape = tuple(new_shape)
-        if self.item == "targets":
-            if bank_index >= self.dataset._num_target_banks():
-                raise Exception("targets bank_index is out of range")
-            shape = self.dataset._targets[bank_index].shape
-            self.dataset._targets[bank_index] = self.dataset._targets[bank_index].reshape((shape[0],) + new_shape)
-        elif self.item == "inputs":
-            if bank_index >= self.dataset._num_target_banks():
-                raise Exception("inputs bank_index is out of range")
-            shape = self.dataset._inputs[bank_index].shape
-            self.dataset._inputs[bank_index] = self.dataset._inputs[0].reshape((shape[0],) + new_shape)
+        if self.item in ["inputs", "targets"]:
+            ## lazily, see Dataset.reshape():
+            self.dataset.reshape((self.item, bank_index), new_shape)
         elif self.item in ["test_targets", "train_targets"]:
             raise Exception("unable to reshape vector '%s';  call dataset.targets.reshape(), and re-split" % (self.item,))
         elif self.item in ["test_inputs", "train_inputs"]:
             raise Exception("unable to reshape vector '%s'; call dataset.inputs.rehsape(), and re-split" % (self.item,))
         else:
             raise Exception("unknown vector: %s" % (self.item,))
-        self.dataset._cache_values()
 
     def __len__(self):
         """
@@ -366,11 +986,11 @@ class DataVector():
         20
         """
         if self.item == "targets":
-            return 0 if len(self.dataset._targets) == 0 else len(self.dataset._targets[0])
+            return 0 if len(self.dataset._targets) == 0 else self.dataset._get_size()
         elif self.item == "labels":
-            return 0 if len(self.dataset._labels) == 0 else len(self.dataset._labels[0])
+            return 0 if len(self.dataset._labels) == 0 else self.dataset._get_size()
         elif self.item == "inputs":
-            return 0 if len(self.dataset._inputs) == 0 else len(self.dataset._inputs[0])
+            return 0 if len(self.dataset._inputs) == 0 else self.dataset._get_size()
         else:
             size, num_train, num_test = self.dataset._get_split_sizes()
             if self.item == "train_targets":
@@ -415,6 +1035,310 @@ class DataVector():
 
     shape = property(get_shape, reshape)
 
+class DataVectorView():
+    """
+    Class to index a DataVector, returning numpy arrays rather
+    than lists. Slices are views into the dataset (no copies),
+    unless the dataset has been shuffled or randomly split.
+
+    >>> ds = Dataset()
+    >>> ds.load([[[0, 0], [0]],
+    ...          [[0, 1], [1]],
+    ...          [[1, 0], [1]],
+    ...          [[1, 1], [0]]])
+    >>> ds.split(0.5)
+    >>> ds.test_inputs.view[:]
+    array([[1., 0.],
+           [1., 1.]], dtype=float32)
+    >>> ds.train_targets.view[1]
+    array([1.], dtype=float32)
+    >>> len(ds.train_inputs.view)
+    2
+    """
+    def __init__(self, vector):
+        self.vector = vector
+
+    def __getitem__(self, pos):
+        return self.vector._get_view(pos)
+
+    def __len__(self):
+        return len(self.vector)
+
+    def __repr__(self):
+        return "<DataVectorView '%s', length: %s>" % (self.vector.item, len(self))
+
+class SequenceSubset(Sequence):
+    """
+    A contiguous range of batches of a keras.utils.Sequence, used
+    to split a streaming dataset into training and validation parts.
+    """
+    def __init__(self, sequence, start, stop, propagate_epoch_end=True):
+        self.sequence = sequence
+        self.start = start
+        self.stop = stop
+        self.propagate_epoch_end = propagate_epoch_end
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError("batch index %d is out of range" % (index,))
+        return self.sequence[self.start + index]
+
+    def on_epoch_end(self):
+        if self.propagate_epoch_end:
+            self.sequence.on_epoch_end()
+
+class Sampler():
+    """
+    Draws the training patterns of each epoch by position, with
+    replacement, instead of shuffling them (see Dataset.sampler()):
+
+        * "uniform" - each pattern is equally likely
+        * "balanced" - each class is equally likely; the class of a
+          pattern is its label (or, without labels, its target when
+          that is a single class number, else the index of its
+          largest target value)
+        * "weighted" - pattern i is drawn in proportion to weights[i]
+
+    Nothing is copied; the probabilities are worked out from the
+    dataset as it is when each epoch starts.
+    """
+    def __init__(self, dataset, kind="uniform", weights=None, bank_index=0):
+        if kind not in ["uniform", "balanced", "weighted"]:
+            raise Exception("unknown sampler '%s': should be uniform, balanced, or weighted" % (kind,))
+        if (kind == "weighted") != (weights is not None):
+            raise Exception("a weighted sampler needs weights, and only it does")
+        self.dataset = dataset
+        self.kind = kind
+        self.weights = None if weights is None else np.asarray(weights, dtype=float)
+        self.bank_index = bank_index
+
+    def get_probabilities(self, count):
+        """
+        Get the probability of drawing each of the first count patterns
+        (in dataset order).
+        """
+        if self.kind == "uniform":
+            return np.full(count, 1.0 / count)
+        elif self.kind == "weighted":
+            if len(self.weights) < count:
+                raise Exception("sampler has %d weights, expecting %d" % (len(self.weights), count))
+            weights = self.weights[:count]
+        else:
+            rows = self.dataset._get_index()[:count]
+            if len(self.dataset._labels) > self.bank_index:
+                classes = self.dataset._labels[self.bank_index][rows]
+            else:
+                values = _take(self.dataset._targets[self.bank_index], rows).reshape(count, -1)
+                if values.shape[1] == 1 and np.all(values >= 0) and np.all(values == np.round(values)):
+                    ## sparse class targets, one class number per pattern:
+                    classes = values[:, 0].astype(int)
+                else:
+                    classes = np.argmax(values, axis=1)
+            counts = np.bincount(classes)
+            weights = 1.0 / counts[classes]
+        if weights.min() < 0 or weights.sum() <= 0:
+            raise Exception("sampler weights must be non-negative, and not all zero")
+        return weights / weights.sum()
+
+    def sample(self, count, size=None):
+        """
+        Draw size (default, count) positions from the first count
+        patterns.
+        """
+        return np.random.choice(count, count if size is None else size,
+                                p=self.get_probabilities(count))
+
+class DatasetSequence(Sequence):
+    """
+    A keras.utils.Sequence of (inputs, targets) batches, gathered
+    by row index from the banks of a dataset, as they are needed.
+    shuffle may be a Sampler, which draws the rows of each epoch.
+    """
+    def __init__(self, dataset, rows, batch_size=32, shuffle=False, sample_weight=None,
+                 augment=False):
+        self.dataset = dataset
+        self.rows = rows
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.sample_weight = sample_weight
+        self.augment = augment
+        self.order = np.arange(len(rows))
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(len(self.rows) / self.batch_size))
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError("batch index %d is out of range" % (index,))
+        positions = self.order[index * self.batch_size:(index + 1) * self.batch_size]
+        inputs, targets = self.dataset._get_batch(self.rows[positions])
+        if self.augment:
+            inputs = self.dataset._augment_batch(inputs)
+        if self.sample_weight is None:
+            return (inputs, targets)
+        else:
+            return (inputs, targets, self.sample_weight[positions])
+
+    def on_epoch_end(self):
+        if isinstance(self.shuffle, Sampler):
+            self.order = self.shuffle.sample(len(self.rows))
+        elif self.shuffle:
+            np.random.shuffle(self.order)
+
+class SimilarityIndex():
+    """
+    A k-nearest-neighbour index over a matrix of vectors, one row per
+    pattern (see Network.build_similarity_index()). Distances are
+    euclidean, and computed a block of rows at a time.
+
+    If function is given, queries are passed through it to get their
+    vectors (for example, the activations of a layer); queries are
+    then a list of num_banks input banks, if there is more than one.
+
+    >>> index = SimilarityIndex(np.array([[0, 0], [1, 0], [0, 2], [5, 5]]))
+    >>> index.nearest([0.9, 0.1], k=2)
+    [(1, 0.1414...), (0, 0.9055...)]
+    >>> positions, distances = index.query(np.array([[0, 0], [5, 4]]), k=1)
+    >>> positions.tolist()
+    [[0], [3]]
+    """
+    block_rows = 65536
+
+    def __init__(self, vectors, function=None, num_banks=1):
+        vectors = np.asarray(vectors, "float32")
+        self.vectors = vectors.reshape(len(vectors), -1)
+        self.function = function
+        self.num_banks = num_banks
+        self.norms = np.zeros(len(self.vectors), "float32")
+        for i in range(0, len(self.vectors), self.block_rows):
+            block = self.vectors[i:i + self.block_rows]
+            self.norms[i:i + len(block)] = np.einsum("ij,ij->i", block, block)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def query(self, patterns, k=5):
+        """
+        Find the k nearest patterns of each of a batch of patterns.
+        Returns (positions, distances), each of shape (len(patterns), k),
+        nearest first.
+        """
+        if self.function is not None:
+            patterns = self.function(patterns)
+        queries = np.asarray(patterns, "float32")
+        queries = queries.reshape(len(queries), -1)
+        k = min(k, len(self.vectors))
+        query_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+        best = np.zeros((len(queries), 0), np.intp)
+        best_distances = np.zeros((len(queries), 0), "float32")
+        for i in range(0, len(self.vectors), self.block_rows):
+            block = self.vectors[i:i + self.block_rows]
+            distances = (query_norms - 2 * queries.dot(block.T) +
+                         self.norms[i:i + len(block)])
+            ## keep the k best of this block and the best so far:
+            distances = np.concatenate([best_distances, distances], axis=1)
+            positions = np.concatenate([best, np.broadcast_to(np.arange(i, i + len(block)),
+                                                              (len(queries), len(block)))], axis=1)
+            if distances.shape[1] > k:
+                keep = np.argpartition(distances, k - 1, axis=1)[:, :k]
+                distances = np.take_along_axis(distances, keep, axis=1)
+                positions = np.take_along_axis(positions, keep, axis=1)
+            best, best_distances = positions, distances
+        order = np.argsort(best_distances, axis=1, kind="mergesort")
+        return (np.take_along_axis(best, order, axis=1),
+                np.sqrt(np.maximum(np.take_along_axis(best_distances, order, axis=1), 0)))
+
+    def nearest(self, pattern, k=5):
+        """
+        Find the k nearest patterns of one pattern, as a list of
+        (position, distance), nearest first.
+        """
+        if self.num_banks > 1:
+            pattern = [np.array([bank]) for bank in pattern]
+        else:
+            pattern = np.array([pattern])
+        positions, distances = self.query(pattern, k)
+        return [(int(p), float(d)) for (p, d) in zip(positions[0], distances[0])]
+
+class ConcatBank():
+    """
+    A bank made of other banks (numpy arrays, memmaps, or sparse
+    matrices), one after the other, without copying them (see
+    Dataset.concat()). Each part is a bank, or a (bank, rows) pair to
+    use just those rows, in that order. Indexing gathers the rows
+    from their parts, into a new numpy array.
+
+    >>> bank = ConcatBank([np.array([[0], [1]]), (np.array([[2], [3], [4]]), [2, 0])])
+    >>> len(bank), bank.shape, bank.dtype
+    (4, (4, 1), dtype('int64'))
+    >>> bank.locate([1, 2, 3])
+    (array([0, 1, 1]), array([1, 0, 1]))
+    >>> bank[[3, 0, 2]].tolist(), bank[1:].tolist(), bank[-1].tolist()
+    ([[2], [0], [4]], [[1], [4], [2]], [2])
+    """
+    def __init__(self, parts):
+        self.parts = []
+        for part in parts:
+            bank, rows = part if isinstance(part, tuple) else (part, None)
+            self.parts.append((bank, None if rows is None else np.asarray(rows, dtype=np.intp)))
+        if len(self.parts) == 0:
+            raise Exception("no banks to concatenate")
+        shapes = set(bank.shape[1:] for (bank, rows) in self.parts)
+        if len(shapes) > 1:
+            raise Exception("can't concatenate banks of different shapes: %s" % sorted(shapes))
+        sizes = [_num_rows(bank) if rows is None else len(rows) for (bank, rows) in self.parts]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.intp)
+        self.dtype = np.result_type(*[bank.dtype for (bank, rows) in self.parts])
+        self.shape = (int(self.offsets[-1]),) + shapes.pop()
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def extend(self, bank):
+        """
+        Return a new ConcatBank with bank added at the end.
+        """
+        return ConcatBank(self.parts + [bank])
+
+    def locate(self, rows):
+        """
+        Map rows of this bank to (parts, offsets): the part that each
+        row comes from, and its position in that part.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        parts = np.searchsorted(self.offsets, rows, side="right") - 1
+        return parts, rows - self.offsets[parts]
+
+    def __getitem__(self, rows):
+        if isinstance(rows, numbers.Integral):
+            return self[np.array([rows])][0]
+        elif isinstance(rows, slice):
+            rows = np.arange(*rows.indices(len(self)))
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        rows = np.where(rows < 0, rows + len(self), rows)
+        if len(rows) > 0 and not (0 <= rows.min() and rows.max() < len(self)):
+            raise IndexError("row index out of range for a bank of %d rows" % len(self))
+        parts, offsets = self.locate(rows)
+        retval = np.empty((len(rows),) + self.shape[1:], self.dtype)
+        for part in np.unique(parts):
+            mask = parts == part
+            bank, part_rows = self.parts[part]
+            retval[mask] = _take(bank, offsets[mask] if part_rows is None else part_rows[offsets[mask]])
+        return retval
+
+    def __array__(self, dtype=None, copy=None):
+        return self[:] if dtype is None else self[:].astype(dtype)
+
+    def __repr__(self):
+        return "<ConcatBank of %d parts, shape %s, dtype %s>" % (len(self.parts), self.shape, self.dtype)
+
 class Dataset():
     """
     Contains the dataset, and metadata about it.
@@ -422,6 +1346,14 @@ class Dataset():
     input_shapes = [shape, ...]
     target_shapes = [shape, ...]
     """
+    ## These apply any pending transforms before they are read:
+    _inputs = _pending("_inputs")
+    _targets = _pending("_targets")
+    _inputs_range = _pending("_inputs_range")
+    _targets_range = _pending("_targets_range")
+    _input_shapes = _pending("_input_shapes")
+    _target_shapes = _pending("_target_shapes")
+
     def __init__(self,
                  network=None,
                  name=None,
@@ -500,40 +1432,42 @@ class Dataset():
             len(self.network.output_bank_order) == 0):
             raise Exception("please connect network layers")
         diff = abs(frange[1] - frange[0])
-        ## inputs:
-        inputs = []
-        for i in range(count):
-            if self.network:
-                for layer_name in self.network.input_bank_order:
-                    shape = self.network[layer_name].shape
-                    inputs.append(np.random.rand(*shape) * diff + frange[0])
-            else:
-                for shape in self._input_shapes:
-                    inputs.append(np.random.rand(*shape) * diff + frange[0])
-        ## targets:
-        targets = []
-        for i in range(count):
-            if self.network:
-                for layer_name in self.network.output_bank_order:
-                    shape = self.network[layer_name].shape
-                    targets.append(np.random.rand(*shape) * diff + frange[0])
-            else:
-                for shape in self._target_shapes:
-                    targets.append(np.random.rand(*shape) * diff + frange[0])
-        self._load(list(zip(inputs, targets)), mode="append")
+        ## whole banks at a time:
+        inputs = [np.random.rand(count, *self.network[layer_name].shape) * diff + frange[0]
+                  for layer_name in self.network.input_bank_order]
+        targets = [np.random.rand(count, *self.network[layer_name].shape) * diff + frange[0]
+                   for layer_name in self.network.output_bank_order]
+        self._load_banks(inputs, targets, mode="append")
 
     def clear(self):
         """
         Remove all of the inputs/targets.
         """
+        self._transforms = {}
         self._warning_set = False
+        self._bank_views = {}
+        self._bank_stats = {}
+        self._decoded_inputs = {}
+        self._index = None
+        self._index_rows = 0
+        self._index_inverse = None
+        self._input_scales = {}
+        self._augmentations = []
         self._inputs = []
         self._targets = []
         self._labels = []
+        self._label_vocab = []
+        self._label_indices = {}
+        self._hash_indices = {}
         self._targets_range = []
         self._split = 0
         self._input_shapes = [(None,)]
         self._target_shapes = [(None,)]
+        self._stream = None
+        self._series = None
+        self._stream_steps = None
+        self._validation_stream = None
+        self._validation_steps = None
 
     def _add(self, inputs, targets):
         """
@@ -541,12 +1475,15 @@ class Dataset():
         """
         self._load(list(zip([inputs], [targets])), mode="append")
 
-    def append_by_function(self, width, frange, ifunction, tfunction):
+    def append_by_function(self, width, frange, ifunction, tfunction, vectorized=False):
         """
         width - length of an input vector
         frange - (start, stop) or (start, stop, step)
         ifunction - "onehot" or "binary" or callable(i, width)
         tfunction - a function given (i, input vector), return target vector
+        vectorized - if True, ifunction is given an array of all of the
+            i's, and returns a matrix of input vectors; tfunction is
+            given (i's, input matrix), and returns a matrix of targets
 
         To add an AND problem:
 
@@ -575,45 +1512,1125 @@ class Dataset():
         >>> net.dataset.append_by_function(10, (0, 10), lambda i, width: np.random.rand(width), lambda i,v: v)
         >>> len(net.dataset.inputs)
         10
+
+        With vectorized functions, the banks are built in one step:
+
+        >>> net = Network("Test 6", 8, 2, 3, 1)
+        >>> net.compile(error="mse", optimizer="adam")
+        >>> net.dataset.append_by_function(8, (0, 256), "binary",
+        ...     lambda i, m: m.sum(axis=1, keepdims=True) % 2, vectorized=True)
+        >>> net.dataset.inputs[3], net.dataset.targets[3]
+        ([0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0, 1.0], [0.0])
         """
         if len(frange) == 2:
             frange = frange + (1, )
+        values = np.arange(*frange)
         if ifunction == "onehot":
-            ifunction = onehot
+            inputs = _onehot_matrix(values, width)
         elif ifunction == "binary":
-            ifunction = binary
+            inputs = _binary_matrix(values, width)
+        elif callable(ifunction) and vectorized:
+            inputs = np.asarray(ifunction(values, width))
         elif callable(ifunction):
-            pass # ok
+            inputs = np.array([ifunction(current, width) for current in values])
+        else:
+            raise Exception("unknown vector construction function: " +
+                            "use 'onehot', or 'binary' or callable")
+        if vectorized:
+            targets = np.asarray(tfunction(values, inputs))
+        else:
+            targets = np.array([tfunction(current, v.tolist()) for (current, v) in zip(values, inputs)])
+        ## made-up patterns are float32, whatever the functions return:
+        self._load_banks([inputs.astype("float32")], [targets.astype("float32")], mode="append")
+
+    def load_direct(self, inputs=None, targets=None, labels=None, label_vocab=None):
+        """
+        Set the inputs/targets in the specific internal format:
+
+        [[input-layer-1-vectors, ...], [input-layer-2-vectors, ...], ...]
+
+        [[target-layer-1-vectors, ...], [target-layer-2-vectors, ...], ...]
+
+        Labels are a list of string arrays, one per bank. If label_vocab
+        is given, labels are instead integer codes into label_vocab
+        (one vocabulary array per bank), as kept internally.
+        """
+        ## inputs/targets are each [np.array(), ...], one np.array()
+        ## per bank
+        self._stream = self._validation_stream = None
+        self._index = None
+        if inputs is not None or targets is not None:
+            self._series = None
+        if inputs is not None:
+            self._inputs = inputs
+            self._input_scales = {}
+        if targets is not None:
+            self._targets = targets
+        if labels is not None and label_vocab is not None:
+            self._labels = labels
+            self._label_vocab = label_vocab
+        elif labels is not None:
+            self._set_labels(labels) # should be a list of np.arrays(dtype=str), one per bank
+        self._cache_values()
+
+    def _set_labels(self, labels):
+        """
+        Replace the label banks with these labels (a list of arrays,
+        one per bank), stored as integer codes and a vocabulary.
+        """
+        self._labels, self._label_vocab = [], []
+        for bank in labels:
+            codes, vocab = _encode_labels(bank)
+            self._labels.append(codes)
+            self._label_vocab.append(vocab)
+
+    def _append_labels(self, bank_index, labels):
+        """
+        Append labels to a label bank, adding any new labels to its
+        vocabulary.
+        """
+        labels = np.asarray(labels, dtype=str).reshape(-1)
+        if bank_index == len(self._labels):
+            codes, vocab = _encode_labels(labels)
+            self._labels.append(codes)
+            self._label_vocab.append(vocab)
+            return
+        vocab = self._label_vocab[bank_index]
+        new = np.setdiff1d(labels, vocab)
+        if len(new) > 0:
+            vocab = np.concatenate([vocab, new])
+            self._label_vocab[bank_index] = vocab
+        sorter = np.argsort(vocab)
+        codes = sorter[np.searchsorted(vocab, labels, sorter=sorter)].astype("int32")
+        self._append_rows("labels", bank_index, codes)
+
+    def _get_label_index(self, bank_index):
+        """
+        Get the inverted label index of a bank: (order, bounds), where
+        order[bounds[c]:bounds[c + 1]] are the positions (in dataset
+        order) of the patterns with label code c. Built once, and
+        rebuilt only when the labels or the dataset order change.
+        """
+        codes = self._labels[bank_index]
+        vocab = self._label_vocab[bank_index]
+        entry = self._label_indices.get(bank_index)
+        if (entry is None or entry[0]() is not codes or len(entry[3]) != len(vocab) + 1 or
+            (entry[1]() if entry[1] is not None else None) is not self._index):
+            if self._index is not None:
+                codes = codes[self._index]
+            order = np.argsort(codes, kind="mergesort")
+            bounds = np.searchsorted(codes[order], np.arange(len(vocab) + 1))
+            entry = (weakref.ref(self._labels[bank_index]),
+                     weakref.ref(self._index) if self._index is not None else None,
+                     order, bounds)
+            self._label_indices[bank_index] = entry
+        return entry[2], entry[3]
+
+    def _get_label_indices(self, label, bank_index=0):
+        """
+        Get the positions (in dataset order) of the patterns with label.
+        """
+        if not 0 <= bank_index < len(self._labels):
+            raise Exception("labels bank_index is out of range")
+        order, bounds = self._get_label_index(bank_index)
+        code = np.flatnonzero(self._label_vocab[bank_index] == str(label))
+        if len(code) == 0:
+            return order[:0]
+        return order[bounds[code[0]]:bounds[code[0] + 1]]
+
+    def load_series(self, series, window, stride=1, horizon=1):
+        """
+        Load sliding windows over a series (an array of time steps, each
+        a value or a vector of values) as the inputs: each input is
+        window steps, and its target is the step horizon steps after
+        the window ends. Windows start every stride steps.
+
+        The windows are numpy (stride tricks) views onto one copy of
+        the series (kept as float32, or as integers if it is an integer
+        array), so they take no more memory than the series itself;
+        training gathers each batch of windows by index. The statistics
+        of the banks are those of the series values they cover.
+
+        >>> ds = Dataset()
+        >>> ds.load_series(np.arange(10), window=3, stride=2)
+        >>> len(ds), ds.inputs.shape, ds.targets.shape
+        (4, [(3,)], [(1,)])
+        >>> ds.inputs[3], ds.targets[3], ds._inputs[0].dtype
+        ([6, 7, 8], [9], dtype('int32'))
+        >>> np.shares_memory(ds._inputs[0], ds._targets[0])
+        True
+        """
+        series = np.ascontiguousarray(series, self._get_bank_dtype("inputs", 0, np.asarray(series)))
+        if window < 1 or stride < 1 or horizon < 1:
+            raise Exception("window, stride, and horizon must be at least 1")
+        count = (len(series) - window - horizon) // stride + 1
+        if count < 1:
+            raise Exception("series of %d steps is too short for a window of %d and horizon of %d" %
+                            (len(series), window, horizon))
+        step = series.strides[0]
+        inputs = np.lib.stride_tricks.as_strided(
+            series, shape=(count, window) + series.shape[1:],
+            strides=(stride * step, step) + series.strides[1:], writeable=False)
+        targets = series[window + horizon - 1::stride][:count]
+        if targets.ndim == 1:
+            targets = targets[:, np.newaxis]
+        self.clear()
+        ## the series values covered by the windows, and by the targets:
+        self._bank_stats[("inputs", 0)] = (weakref.ref(inputs), None,
+                                           _bank_stats(series[:(count - 1) * stride + window]))
+        self._bank_stats[("targets", 0)] = (weakref.ref(targets), None, _bank_stats(targets))
+        self.load_direct([inputs], [targets])
+        self._series = series
+
+    def from_series(self, *args, **kwargs):
+        """
+        Make a new Dataset of sliding windows over a series. Takes the
+        same arguments as Dataset.load_series(). Can be called on the
+        Dataset class.
+
+        >>> ds = Dataset.from_series(np.arange(100).reshape(50, 2), 5, horizon=2)
+        >>> len(ds), ds.inputs.shape, ds.targets[0]
+        (44, [(5, 2)], [12, 13])
+        """
+        if _called_on_class(self):
+            args = (self,) + args
+        dataset = Dataset()
+        dataset.load_series(*args, **kwargs)
+        return dataset
+
+    def concat(self, datasets=None):
+        """
+        Make a new Dataset of the patterns of several datasets, one
+        after the other (each in its own dataset order). The patterns
+        are not copied: each input and target bank is a ConcatBank,
+        which maps a pattern to its (dataset, row), and gathers rows a
+        batch at a time when training. Shuffling and splitting only
+        change the order of the new dataset; Dataset.materialize() (or
+        to_memmap()) copies the patterns into ordinary banks.
+
+        The datasets must have the same banks, with the same shapes;
+        input banks in compact storage must have the same scale. Labels
+        are recoded into one vocabulary (a copy of the integer codes).
+        Can be called on the Dataset class; called on a dataset, the
+        datasets are added after it.
+
+        >>> ds1 = Dataset()
+        >>> ds1.load(inputs=[[0, 0], [0, 1]], targets=[[0], [1]], labels=["a", "b"])
+        >>> ds2 = Dataset()
+        >>> ds2.load(inputs=[[1, 0], [1, 1], [2, 2]], targets=[[1], [0], [1]],
+        ...          labels=["c", "a", "c"])
+        >>> ds = Dataset.concat([ds1, ds2])
+        >>> len(ds), ds.inputs[2], ds.labels[:]
+        (5, [1.0, 0.0], ['a', 'b', 'c', 'a', 'c'])
+        >>> ds._inputs[0].locate([1, 2])
+        (array([0, 1]), array([1, 0]))
+        >>> ds.shuffle()
+        >>> ds.split(0.4)
+        >>> ds.split(), sorted(ds.inputs[:]) == sorted(ds1.inputs[:] + ds2.inputs[:])
+        ((3, 2), True)
+        >>> ds.stats()["inputs"][0]["max"], ds._is_batched()
+        (2.0, True)
+        >>> order = ds.inputs[:]
+        >>> ds.materialize()
+        >>> type(ds._inputs[0]), ds.inputs[:] == order
+        (<class 'numpy.ndarray'>, True)
+        """
+        if _called_on_class(self):
+            self, datasets = None, self
+        datasets = ([] if self is None else [self]) + list(datasets or [])
+        if len(datasets) == 0:
+            raise Exception("no datasets to concatenate")
+        first = datasets[0]
+        for dataset in datasets:
+            if dataset._stream is not None:
+                raise Exception("can't concatenate streaming datasets")
+            if ([len(dataset._inputs), len(dataset._targets), len(dataset._labels)] !=
+                [len(first._inputs), len(first._targets), len(first._labels)]):
+                raise Exception("can't concatenate datasets with different numbers of banks")
+        for b in range(len(first._inputs)):
+            if len(set(dataset._input_scales.get(b) for dataset in datasets)) > 1:
+                raise Exception("input bank #%d has different compact storage scales" % b)
+        retval = Dataset(name=first.name, description=first.description)
+        for item in ["inputs", "targets"]:
+            banks = []
+            for b in range(len(getattr(first, "_" + item))):
+                bank = ConcatBank([(getattr(dataset, "_" + item)[b], dataset._index)
+                                   for dataset in datasets])
+                ## the statistics of the parts, rather than a rescan:
+                stats = None
+                for dataset in datasets:
+                    stats = _merge_stats(stats, dataset._get_bank_stats(item, b))
+                retval._bank_stats[(item, b)] = (weakref.ref(bank), None, stats)
+                banks.append(bank)
+            setattr(retval, "_" + item, banks)
+        for b in range(len(first._labels)):
+            vocab = np.unique(np.concatenate([dataset._label_vocab[b] for dataset in datasets]))
+            retval._labels.append(np.concatenate(
+                [np.searchsorted(vocab, dataset._label_vocab[b])[dataset._labels[b][dataset._get_index()]]
+                 for dataset in datasets]).astype("int32"))
+            retval._label_vocab.append(vocab)
+        retval._input_scales = dict(first._input_scales)
+        retval._cache_values()
+        return retval
+
+    def load_stream(self, stream, steps=None, validation=None, validation_steps=None):
+        """
+        Use a generator, or a keras.utils.Sequence, as the source of
+        the dataset. Nothing is held in memory; Network.train(),
+        Network.evaluate() and Network.test() pull batches from the
+        stream as they need them.
+
+        Each item from the stream is a batch, (inputs, targets), in the
+        Keras format: a numpy array for one bank, or a list of numpy
+        arrays, one per bank.
+
+        Arguments:
+            stream - a generator (which loops forever), or a Sequence
+            steps - number of batches per epoch; required for a
+                generator, defaults to len(stream) for a Sequence
+            validation - optional generator or Sequence of validation
+                batches. A Sequence stream can also be divided with
+                Dataset.split().
+            validation_steps - number of validation batches; required
+                for a validation generator
+
+        >>> class XOR(Sequence):
+        ...     def __len__(self):
+        ...         return 2
+        ...     def __getitem__(self, i):
+        ...         inputs = np.array([[0, 0], [0, 1], [1, 0], [1, 1]])
+        ...         targets = np.array([[0], [1], [1], [0]])
+        ...         return (inputs[i * 2:i * 2 + 2], targets[i * 2:i * 2 + 2])
+        >>> ds = Dataset()
+        >>> ds.load_stream(XOR())
+        >>> ds.inputs.shape
+        [(2,)]
+        >>> ds.split(0.5)
+        >>> ds.split()
+        (1, 1)
+        """
+        self.clear()
+        if not isinstance(stream, Sequence) and steps is None:
+            raise Exception("steps is required when streaming from a generator")
+        if (validation is not None and not isinstance(validation, Sequence)
+            and validation_steps is None):
+            raise Exception("validation_steps is required when validating from a generator")
+        self._stream = stream
+        self._stream_steps = steps
+        self._validation_stream = validation
+        self._validation_steps = validation_steps
+        if isinstance(stream, Sequence) and len(stream) > 0:
+            ## peek at the first batch to get the shapes:
+            batch = stream[0]
+            inputs = batch[0] if isinstance(batch[0], (list, tuple)) else [batch[0]]
+            targets = batch[1] if isinstance(batch[1], (list, tuple)) else [batch[1]]
+            self._input_shapes = [np.asarray(bank).shape[1:] for bank in inputs]
+            self._target_shapes = [np.asarray(bank).shape[1:] for bank in targets]
+
+    def _is_batched(self):
+        """
+        Does this dataset have to be given to Keras one batch at a time?
+        True for streams, for lazily shuffled/split memory-mapped banks
+        (which may not fit into memory), for sparse banks (densified a
+        batch at a time), for windows over a series, for concatenated
+        datasets, and for augmented datasets. Lazily shuffled/split
+        banks in memory, and compact (scaled) input banks, are gathered
+        or decoded once instead (see Dataset._get_keras_banks()).
+        """
+        return (self._stream is not None or self._series is not None or
+                (self._index is not None and self._is_memmap()) or
+                len(self._augmentations) > 0 or
+                self._is_concat() or
+                any(scipy.sparse.issparse(bank) for bank in self._inputs + self._targets))
+
+    def _is_memmap(self):
+        """
+        Are any of the banks memory-mapped (see Dataset.load_memmap())?
+        """
+        return any(isinstance(bank, np.memmap) for bank in self._inputs + self._targets + self._labels)
+
+    def _get_keras_banks(self):
+        """
+        Get the (inputs, targets) banks to give to Keras whole, for a
+        dataset that is not batched (see Dataset._is_batched()). Banks
+        that are lazily shuffled or split are first gathered into
+        dataset order, once (see Dataset.materialize()). Compact
+        (scaled) input banks are decoded into float32; the decoded
+        bank is kept for as long as the bank and its scale don't change.
+        """
+        if self._index is not None:
+            self.materialize()
+        inputs = []
+        for (b, bank) in enumerate(self._inputs):
+            if b in self._input_scales:
+                key = (self._input_scales[b], bank.shape)
+                entry = self._decoded_inputs.get(b)
+                if entry is None or entry[0]() is not bank or entry[1] != key:
+                    entry = (weakref.ref(bank), key, self._decode_inputs(b, bank[:]))
+                    self._decoded_inputs[b] = entry
+                bank = entry[2]
+            inputs.append(bank)
+        return inputs, self._targets
+
+    def _is_concat(self):
+        """
+        Are any of the banks ConcatBanks (see Dataset.concat())?
+        """
+        return any(isinstance(bank, ConcatBank) for bank in self._inputs + self._targets)
+
+    def _get_batch_split(self, batch_size=32, shuffle=False, sample_weight=None, augment=False):
+        """
+        Returns ((train_batches, train_steps), (validation_batches, validation_steps))
+        for a batched dataset, where batches are a generator or
+        Sequence. validation_batches is None if there is no validation
+        data. If augment is True, the training batches are augmented.
+        shuffle may be a Sampler (see Dataset.sampler()).
+        """
+        if self._stream is None:
+            size, num_train, num_test = self._get_split_sizes()
+            index = self._get_index()
+            if sample_weight is not None:
+                sample_weight = np.asarray(sample_weight)
+            augment = augment and len(self._augmentations) > 0
+            train = DatasetSequence(self, index[:num_train], batch_size, shuffle,
+                                    None if sample_weight is None else sample_weight[:num_train],
+                                    augment)
+            if self._split == 1.0 and (augment or isinstance(shuffle, Sampler)):
+                ## validate on the original patterns:
+                test = DatasetSequence(self, index, batch_size)
+                return (train, len(train)), (test, len(test))
+            elif self._split == 1.0:
+                return (train, len(train)), (train, len(train))
+            elif num_test > 0:
+                test = DatasetSequence(self, index[size - num_test:], batch_size)
+                return (train, len(train)), (test, len(test))
+            else:
+                return (train, len(train)), (None, 0)
+        stream = self._stream
+        steps = self._stream_steps
+        if steps is None:
+            steps = len(stream)
+        if self._validation_stream is not None:
+            validation_steps = self._validation_steps
+            if validation_steps is None:
+                validation_steps = len(self._validation_stream)
+            return (stream, steps), (self._validation_stream, validation_steps)
+        elif self._split == 1.0:
+            return (stream, steps), (stream, steps)
+        elif self._split > 0:
+            num_test = int(self._split * steps)
+            train = SequenceSubset(stream, 0, steps - num_test)
+            test = SequenceSubset(stream, steps - num_test, steps, propagate_epoch_end=False)
+            return (train, steps - num_test), (test, num_test)
+        else:
+            return (stream, steps), (None, 0)
+
+    def _get_batch(self, rows):
+        """
+        Gather the inputs and targets at (physical) rows, in Keras
+        format: ([input_bank, ...], [target_bank, ...]).
+        """
+        return ([self._decode_inputs(b, _take(self._inputs[b], rows)) for b in range(len(self._inputs))],
+                [_take(bank, rows) for bank in self._targets])
+
+    def augment(self, augmentation, bank_index=0, **options):
+        """
+        Add a step to the augmentation pipeline of an input bank. While
+        training, each batch of inputs passes through the pipeline, so
+        each epoch sees new variations; the dataset itself is unchanged.
+        The steps work on whole batches at a time, and run in the
+        background (see the workers option of Network.train()).
+
+        augmentation is the name of a built-in step, with options:
+
+            * "flip" - direction="horizontal" (or "vertical"), probability=0.5
+            * "shift" - fraction=0.1, of the height and width
+            * "rotate" - degrees=15, either way
+            * "crop" - fraction=0.1, of the height and width, stretched back
+            * "noise" - stddev=0.05, gaussian
+
+        or a function that takes a batch (a numpy array) and returns
+        the augmented batch. Images are assumed to be in the Keras
+        image data format. Validation data is never augmented.
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=np.ones((4, 8, 8, 1)), targets=np.zeros((4, 1)))
+        >>> ds.augment("flip")
+        >>> ds.augment("noise", stddev=0.1)
+        >>> ds.augment(lambda batch: np.clip(batch, 0, 1))
+        >>> len(ds._augmentations)
+        3
+        >>> inputs = ds._augment_batch([ds.inputs.array()])
+        >>> inputs[0].shape, inputs[0].min() >= 0, inputs[0].max() <= 1
+        ((4, 8, 8, 1), True, True)
+        >>> ds.clear_augmentations()
+        """
+        if isinstance(augmentation, str):
+            if augmentation not in AUGMENTATIONS:
+                raise Exception("unknown augmentation '%s': should be one of %s" %
+                                (augmentation, sorted(AUGMENTATIONS.keys())))
+            function = AUGMENTATIONS[augmentation]
+        elif callable(augmentation):
+            function = augmentation
+        else:
+            raise Exception("augmentation must be a name or a function: %s" % (augmentation,))
+        if not 0 <= bank_index < max(len(self._inputs), 1):
+            raise Exception("input bank_index is out of range")
+        self._augmentations.append((bank_index, function, options))
+
+    def sampler(self, kind="balanced", weights=None, bank_index=0):
+        """
+        Make a Sampler, to give to Network.train() as shuffle. Each
+        epoch then draws its training patterns by position, uniformly,
+        balanced across the classes of a labels bank, or with weights
+        (one per pattern, in dataset order). Rebalancing this way takes
+        no extra memory.
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=[[i] for i in range(8)], targets=[[0]] * 8,
+        ...         labels=["a"] * 6 + ["b"] * 2)
+        >>> ds.sampler().get_probabilities(8).tolist()
+        [0.083..., 0.083..., 0.083..., 0.083..., 0.083..., 0.083..., 0.25, 0.25]
+        >>> ds = Dataset()
+        >>> ds.load(inputs=[[i] for i in range(4)], targets=np.array([[0], [0], [0], [1]], "int32"))
+        >>> ds.sampler().get_probabilities(4).tolist()
+        [0.166..., 0.166..., 0.166..., 0.5]
+        >>> sorted(set(ds.sampler("weighted", weights=[1, 0, 0, 0, 0, 0, 0, 1]).sample(8, 100).tolist()))
+        [0, 7]
+        """
+        return Sampler(self, kind, weights, bank_index)
+
+    def clear_augmentations(self):
+        """
+        Remove all of the augmentation steps (see Dataset.augment()).
+        """
+        self._augmentations = []
+
+    def _augment_batch(self, inputs):
+        """
+        Pass a batch of inputs (a list of arrays, one per bank)
+        through the augmentation pipeline.
+        """
+        inputs = list(inputs)
+        for (bank_index, function, options) in self._augmentations:
+            inputs[bank_index] = function(inputs[bank_index], **options)
+        return inputs
+
+    def map(self, bank, function, batched=True):
+        """
+        Add a step to the transform pipeline of a bank. bank is "inputs"
+        or "targets" (for bank 0), or a tuple like ("inputs", 1). If
+        batched is True, function is given a numpy array of rows, and
+        returns the new rows; otherwise, it is given one row at a time.
+
+        Transforms are lazy: the steps of a bank are fused, and applied
+        in one pass over the data, chunk by chunk, the next time the
+        dataset is trained on, tested, or looked at (or when
+        Dataset.apply_transforms() is called). See also
+        Dataset.rescale(), Dataset.reshape(), and Dataset.cast().
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=[[i, i] for i in range(4)], targets=[[i % 2] for i in range(4)])
+        >>> ds.map("inputs", lambda rows: rows * 2)
+        >>> ds.rescale("inputs", (0, 6), (0, 1))
+        >>> ds.reshape("inputs", (2, 1))
+        >>> ds.map("targets", lambda row: [row[0], 1 - row[0]], batched=False)
+        >>> ds.cast("targets", "uint8")
+        >>> sorted(ds._transforms.keys())
+        [('inputs', 0), ('targets', 0)]
+        >>> ds.inputs[3]
+        [[1.0], [1.0]]
+        >>> ds.targets[1], ds._targets[0].dtype
+        ([1, 0], dtype('uint8'))
+        >>> ds._transforms
+        {}
+        """
+        self._add_transform(bank, ("map", function, batched))
+
+    def rescale(self, bank, old_range, new_range, dtype="float32"):
+        """
+        Add a step to the transform pipeline of a bank (see Dataset.map())
+        that rescales its values from old_range to new_range.
+        """
+        self._add_transform(bank, ("rescale", tuple(old_range), tuple(new_range), dtype))
+
+    def reshape(self, bank, shape):
+        """
+        Add a step to the transform pipeline of a bank (see Dataset.map())
+        that reshapes each of its rows.
+        """
+        if not isinstance(shape, (list, tuple)):
+            shape = (shape,)
+        self._add_transform(bank, ("reshape", tuple(shape)))
+
+    def cast(self, bank, dtype):
+        """
+        Add a step to the transform pipeline of a bank (see Dataset.map())
+        that converts its values to dtype.
+        """
+        self._add_transform(bank, ("cast", np.dtype(dtype)))
+
+    def _add_transform(self, bank, step):
+        """
+        Add a step to the pending transforms of bank. The first step of
+        a compact (scaled) input bank converts to the logical values.
+        """
+        if isinstance(bank, str):
+            bank = (bank, 0)
+        item, bank_index = bank
+        if item not in ["inputs", "targets"]:
+            raise Exception("can only transform inputs or targets: %s" % (item,))
+        if not 0 <= bank_index < len(self.__dict__["_" + item]):
+            raise Exception("%s bank_index is out of range" % (item,))
+        steps = self._transforms.get((item, bank_index), [])
+        if not steps and item == "inputs" and bank_index in self._input_scales:
+            steps = [("scale",) + tuple(self._input_scales.pop(bank_index))]
+        self._transforms[(item, bank_index)] = steps + [step]
+
+    def apply_transforms(self, workers=None, directory=None):
+        """
+        Apply the pending transforms (see Dataset.map()) now, in one
+        pass over each bank. If workers is given, the chunks are
+        transformed in a pool of that many processes; the functions
+        must then be picklable (so, not lambdas).
+
+        The transformed banks are kept in memory or, if directory is
+        given, written to .npy files there and used memory-mapped. The
+        files that memory-mapped banks were loaded from are left
+        untouched.
+        """
+        transforms, self._transforms = self._transforms, {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        for ((item, bank_index), steps) in sorted(transforms.items(), key=lambda t: t[0]):
+            banks = self.__dict__["_" + item]
+            filename = (None if directory is None else
+                        os.path.join(directory, "%s_%d.npy" % (item, bank_index)))
+            banks[bank_index] = self._transform_bank(banks[bank_index], item, bank_index,
+                                                     steps, workers, filename)
+        self._cache_values()
+
+    def _transform_bank(self, bank, item, bank_index, steps, workers=None, filename=None):
+        """
+        Pass a bank through a chain of transform steps, chunk by chunk,
+        into a new bank: in memory, or, if filename is given, in that
+        .npy file, memory-mapped.
+        """
+        size = _num_rows(bank)
+        if size == 0:
+            return bank
+        step = _chunk_rows(bank)
+        starts = range(0, size, step)
+        executor = None
+        if workers:
+            executor = concurrent.futures.ProcessPoolExecutor(workers)
+            chunks = executor.map(_apply_steps, [steps] * len(starts),
+                                  (np.asarray(_take(bank, py_slice(i, i + step))) for i in starts))
+        else:
+            chunks = (_apply_steps(steps, _take(bank, py_slice(i, i + step))) for i in starts)
+        try:
+            retval = None
+            for (i, chunk) in zip(starts, chunks):
+                if len(chunk) != min(step, size - i):
+                    raise Exception("transform changed the number of rows in %s bank %d" %
+                                    (item, bank_index))
+                if retval is None:
+                    shape = (size,) + chunk.shape[1:]
+                    if filename: ## a temp file, as bank may be a view of filename
+                        retval = np.lib.format.open_memmap(filename + ".tmp", mode="w+",
+                                                           dtype=chunk.dtype, shape=shape)
+                    else:
+                        retval = np.empty(shape, chunk.dtype)
+                retval[i:i + len(chunk)] = chunk
+            if filename:
+                retval.flush()
+                retval = None
+                os.replace(filename + ".tmp", filename)
+        except BaseException:
+            retval = None
+            if filename and os.path.exists(filename + ".tmp"):
+                os.remove(filename + ".tmp")
+            raise
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        if filename:
+            return np.load(filename, mmap_mode="r+")
+        return retval
+
+    def _decode_inputs(self, bank_index, array):
+        """
+        Convert stored input values into their logical values, for a
+        bank kept in compact storage (see Dataset.set_input_scale()).
+        """
+        if bank_index not in self._input_scales:
+            return array
+        scale, offset = self._input_scales[bank_index]
+        return np.asarray(array, "float32") * np.float32(scale) + np.float32(offset)
+
+    def _encode_inputs(self, bank_index, array, dtype=None):
+        """
+        Convert logical input values into the stored values of a bank
+        kept in compact storage.
+        """
+        if bank_index not in self._input_scales:
+            return array
+        scale, offset = self._input_scales[bank_index]
+        dtype = np.dtype(dtype) if dtype is not None else self._inputs[bank_index].dtype
+        array = (np.asarray(array, "float32") - offset) / scale
+        if dtype.kind in "iu":
+            info = np.iinfo(dtype)
+            array = np.clip(np.round(array), info.min, info.max)
+        return array.astype(dtype)
+
+    def set_input_scale(self, bank_index, scale, offset=0.0):
+        """
+        Declare that an input bank is stored in a compact form, such as
+        uint8 pixels. The logical value of each stored value is:
+
+            value * scale + offset
+
+        This is applied as data is given to Keras (to the whole bank,
+        once, or a batch at a time for a batched dataset), and in the
+        human API; the bank itself is not changed.
+
+        >>> ds = Dataset()
+        >>> ds.load_direct([np.array([[0, 255], [51, 102]], "uint8")],
+        ...                [np.array([[0], [1]], "float32")])
+        >>> ds.set_input_scale(0, 1/255)
+        >>> ds.inputs[0]
+        [0.0, 1.0]
+        >>> ds._inputs_range
+        [(0.0, 1.0)]
+        >>> ds.inputs.array().dtype
+        dtype('float32')
+        """
+        if not 0 <= bank_index < len(self._inputs):
+            raise Exception("input bank_index is out of range")
+        if scale == 0:
+            raise Exception("input scale can't be zero")
+        if scipy.sparse.issparse(self._inputs[bank_index]):
+            raise Exception("sparse input banks can't be scaled")
+        self._input_scales[bank_index] = (float(scale), float(offset))
+        self._cache_values()
+
+    def compress_inputs(self, bank_index=0, dtype="uint8"):
+        """
+        Store an input bank in a compact form, to save memory. With
+        "uint8", the logical range of the bank is quantized into 256
+        steps; with "float16", values are stored at half precision.
+        Values are converted back to float32 as they are given to Keras.
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=[[0.0, 0.5], [1.0, 0.25]], targets=[[0], [1]])
+        >>> ds.compress_inputs(0, "uint8")
+        >>> ds._inputs[0].dtype
+        dtype('uint8')
+        >>> [round(v, 2) for v in ds.inputs[0]]
+        [0.0, 0.5]
+        """
+        dtype = np.dtype(dtype)
+        if dtype not in [np.dtype("uint8"), np.dtype("float16")]:
+            raise Exception("compact storage must be uint8 or float16: %s" % (dtype,))
+        if not 0 <= bank_index < len(self._inputs):
+            raise Exception("input bank_index is out of range")
+        bank = self._decode_inputs(bank_index, _take(self._inputs[bank_index], py_slice(None)))
+        if dtype == np.dtype("uint8"):
+            low, high = float(bank.min()), float(bank.max())
+            scale = (high - low) / 255 if high > low else 1.0
+            offset = low
+        else:
+            scale, offset = 1.0, 0.0
+        self._input_scales[bank_index] = (scale, offset)
+        self._inputs[bank_index] = self._encode_inputs(bank_index, bank, dtype)
+        self._bank_views.pop(("inputs", bank_index), None)
+        self._cache_values()
+
+    def _save_input_scales(self, directory):
+        """
+        Write the input scales (if any) next to the banks in directory.
+        """
+        filename = os.path.join(directory, "input_scales.json")
+        if len(self._input_scales) > 0:
+            with open(filename, "w") as fp:
+                json.dump({str(b): self._input_scales[b] for b in self._input_scales}, fp)
+        elif os.path.exists(filename):
+            os.remove(filename)
+
+    def _save_label_vocab(self, directory):
+        """
+        Write the label vocabularies next to the label banks in directory.
+        """
+        for filename in glob.glob(os.path.join(directory, "vocabulary_*.npy")):
+            if _memmap_bank_index(filename) >= len(self._label_vocab):
+                os.remove(filename)
+        for i in range(len(self._label_vocab)):
+            np.save(os.path.join(directory, "vocabulary_%d.npy" % i), self._label_vocab[i])
+
+    def _save_bank_stats(self, directory):
+        """
+        Write the statistics of the input and target banks next to them
+        in directory, so that loading them again doesn't rescan them.
+        """
+        if self._index is not None: ## the statistics would be in another order
+            return
+        stats = {}
+        for item in ["inputs", "targets"]:
+            for b in range(len(getattr(self, "_" + item))):
+                entry = self._get_bank_stats(item, b)
+                stats["%s_%d" % (item, b)] = (None if entry is None else
+                                               {key: value.item() if isinstance(value, np.generic) else value
+                                                for (key, value) in entry.items()})
+        with open(os.path.join(directory, "bank_stats.json"), "w") as fp:
+            json.dump(stats, fp)
+
+    def _load_bank_stats(self, directory, banks):
+        """
+        Use the statistics written by Dataset._save_bank_stats() (if
+        any) for banks just loaded from directory.
+        """
+        filename = os.path.join(directory, "bank_stats.json")
+        if os.path.exists(filename):
+            with open(filename) as fp:
+                stats = json.load(fp)
+            for item in ["inputs", "targets"]:
+                for (b, bank) in enumerate(banks[item]):
+                    if "%s_%d" % (item, b) in stats:
+                        self._bank_stats[(item, b)] = (weakref.ref(bank), None, stats["%s_%d" % (item, b)])
+
+    def _load_input_scales(self, directory):
+        filename = os.path.join(directory, "input_scales.json")
+        if os.path.exists(filename):
+            with open(filename) as fp:
+                self._input_scales = {int(b): tuple(v) for (b, v) in json.load(fp).items()}
+            self._cache_values()
+
+    def _has_validation(self):
+        """
+        Is there validation data, from a split or a validation stream?
+        """
+        return self._split > 0 or self._validation_stream is not None
+
+    def to_memmap(self, directory):
+        """
+        Write the inputs/targets/labels to .npy files in directory, and
+        use them as memory-mapped banks from now on. The data is copied
+        in chunks, so it never needs to fit into memory all at once.
+
+        >>> import tempfile
+        >>> directory = tempfile.mkdtemp()
+        >>> ds = Dataset()
+        >>> ds.load([[[0, 0], [0]],
+        ...          [[0, 1], [1]],
+        ...          [[1, 0], [1]],
+        ...          [[1, 1], [0]]])
+        >>> ds.to_memmap(directory)
+        >>> sorted(os.listdir(directory))
+        ['inputs_0.npy', 'targets_0.npy']
+        >>> isinstance(ds._inputs[0], np.memmap)
+        True
+        >>> ds2 = Dataset.load_memmap(directory)
+        >>> ds2.inputs[3]
+        [1.0, 1.0]
+        """
+        if len(self.inputs) == 0:
+            raise Exception("no dataset loaded")
+        if any(scipy.sparse.issparse(bank) for bank in self._inputs + self._targets):
+            raise Exception("sparse banks can't be memory-mapped")
+        os.makedirs(directory, exist_ok=True)
+        ## gather the rows in dataset order straight into directory, so
+        ## that the files the banks are mapped from are left untouched:
+        rows = self._index
+        self._index = None
+        for (item, banks) in [("inputs", self._inputs),
+                              ("targets", self._targets),
+                              ("labels", self._labels)]:
+            for filename in glob.glob(os.path.join(directory, "%s_*.npy" % item)):
+                if _memmap_bank_index(filename) >= len(banks):
+                    os.remove(filename) ## left over from a previous dataset
+            for i in range(len(banks)):
+                filename = os.path.join(directory, "%s_%d.npy" % (item, i))
+                if rows is None and _is_full_memmap(banks[i], filename):
+                    banks[i].flush()
+                else:
+                    banks[i] = self._gather_bank(banks[i], rows, filename)
+        if os.path.exists(os.path.join(directory, "bank_stats.json")):
+            os.remove(os.path.join(directory, "bank_stats.json")) ## of the banks just rewritten
+        self._save_input_scales(directory)
+        self._save_label_vocab(directory)
+        self._cache_values()
+
+    def load_memmap(self, directory=None, mode="c"):
+        """
+        Load memory-mapped banks from the .npy files in directory,
+        as written by Dataset.to_memmap(). Data is read from disk as it
+        is needed, so the dataset can be larger than memory.
+
+        Can be called on the Dataset class. If it is, returns a new
+        Dataset instance.
+
+        Arguments:
+            directory - the directory containing the .npy files
+            mode - numpy mmap_mode: "c" (copy-on-write: changes are
+                kept in memory, and the files are never written),
+                "r" (read-only), or "r+" (changes are written to the
+                files)
+        """
+        return_it = _called_on_class(self)
+        if return_it:
+            directory, self = self, Dataset()
+        if mode not in ["r", "r+", "c"]:
+            raise Exception("invalid memmap mode: %s" % (mode,))
+        banks = {}
+        for item in ["inputs", "targets", "labels"]:
+            filenames = glob.glob(os.path.join(directory, "%s_*.npy" % item))
+            filenames.sort(key=_memmap_bank_index)
+            banks[item] = [np.load(filename, mmap_mode=mode) for filename in filenames]
+        if len(banks["inputs"]) == 0:
+            raise Exception("no memmap dataset found in '%s'" % (directory,))
+        self._split = 0
+        self._load_bank_stats(directory, banks)
+        vocab = [np.load(filename) for filename in
+                 sorted(glob.glob(os.path.join(directory, "vocabulary_*.npy")), key=_memmap_bank_index)]
+        if len(vocab) == len(banks["labels"]):
+            self.load_direct(banks["inputs"], banks["targets"], banks["labels"], vocab)
+        else: ## labels saved as strings
+            self.load_direct(banks["inputs"], banks["targets"], banks["labels"])
+        self._load_input_scales(directory)
+        if return_it:
+            return self
+
+    def load_images(self, pattern=None, label_from=None, size=None, mode=None,
+                    workers=None, dtype="uint8", directory=None):
+        """
+        Load a directory (or a glob pattern) of image files as the
+        inputs. The images are decoded by a pool of worker threads,
+        directly into a preallocated bank.
+
+        If label_from is given, the labels are taken from each filename,
+        and the targets are one-hot vectors of the labels. Otherwise,
+        the targets are the images themselves (eg, for an autoencoder),
+        as float32 values in [0, 1]: a lazy transform of the input bank
+        (see Dataset.map()), which is not copied until it is used.
+
+        Can be called on the Dataset class. If it is, returns a new
+        Dataset instance.
+
+        Arguments:
+            pattern - a directory, or a glob pattern like "images/*/*.png"
+            label_from - "dir" (the name of the directory the image is
+                in), a regular expression for the file's name (using
+                the first group, if any), or a function of the filename
+            size - (width, height) to resize each image to; by default,
+                all images must be the size of the first
+            mode - PIL image mode to convert to, like "L" or "RGB";
+                by default, the mode of the first image
+            workers - number of threads (default is the number of CPUs)
+            dtype - "uint8" keeps the pixels in compact storage (see
+                Dataset.set_input_scale()); "float32" stores them
+                scaled into [0, 1]
+            directory - if given, the banks are memmaps in this
+                directory, as with Dataset.to_memmap()
+
+        >>> import tempfile
+        >>> tmp = tempfile.mkdtemp()
+        >>> for (i, color) in enumerate(["red", "blue", "red", "blue"]):
+        ...     PIL.Image.new("RGB", (4, 3), color).save(os.path.join(tmp, "%s_%d.png" % (color, i)))
+        >>> ds = Dataset.load_images(tmp, label_from="([a-z]+)_", workers=2)
+        >>> len(ds), ds.inputs.shape, ds.labels[:]
+        (4, [(3, 4, 3)], ['blue', 'blue', 'red', 'red'])
+        >>> ds.inputs[0][0][0], ds.targets[0]
+        ([0.0, 0.0, 1.0], [1.0, 0.0])
+        >>> ds = Dataset.load_images(tmp, workers=2)
+        >>> len(ds.targets), ds.targets[0][0][0]
+        (4, [0.0, 0.0, 1.0])
+        >>> ds._targets[0].dtype
+        dtype('float32')
+        """
+        return_it = _called_on_class(self)
+        if return_it:
+            pattern, self = self, Dataset()
+        if os.path.isdir(pattern):
+            filenames = [filename for filename in glob.glob(os.path.join(pattern, "*"))
+                         if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS]
+        else:
+            filenames = glob.glob(pattern)
+        filenames.sort()
+        if len(filenames) == 0:
+            raise Exception("no images found in '%s'" % (pattern,))
+        dtype = np.dtype(dtype)
+        if dtype not in [np.dtype("uint8"), np.dtype("float32")]:
+            raise Exception("images must be loaded as uint8 or float32: %s" % (dtype,))
+        labels = None
+        if label_from is not None:
+            labels = np.array([_image_label(filename, label_from) for filename in filenames], dtype=str)
+        first = _read_image(filenames[0], size, mode)
+        if mode is None:
+            with PIL.Image.open(filenames[0]) as image:
+                mode = image.mode
+        import keras.backend as K
+        channels_first = K.image_data_format() == 'channels_first'
+        shape = (len(filenames),) + (first.shape[2:] + first.shape[:2] if channels_first else first.shape)
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            bank = np.lib.format.open_memmap(os.path.join(directory, "inputs_0.npy"),
+                                             mode="w+", dtype=dtype, shape=shape)
+        else:
+            bank = np.empty(shape, dtype)
+        def load(i):
+            image = _read_image(filenames[i], size if size is not None else first.shape[1::-1], mode)
+            if image.shape != first.shape:
+                raise Exception("image '%s' has shape %s, expecting %s; use size=(width, height)" %
+                                (filenames[i], image.shape, first.shape))
+            if channels_first:
+                image = image.transpose(2, 0, 1)
+            bank[i] = image if dtype == np.dtype("uint8") else image / 255
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(load, range(len(filenames))):
+                pass ## raise any exceptions
+        self.clear()
+        self._split = 0
+        if labels is not None:
+            codes, vocab = _encode_labels(labels)
+            targets = [to_categorical(codes, len(vocab))]
+            self.load_direct([bank], targets, [codes], [vocab])
+            if dtype == np.dtype("uint8"):
+                self.set_input_scale(0, 1/255)
         else:
-            raise Exception("unknown vector construction function: " +
-                            "use 'onehot', or 'binary' or callable")
-        inputs = []
-        targets = []
-        current = frange[0] # start
-        while current < frange[1]: # stop, inclusive
-            v = ifunction(current, width)
-            inputs.append(v)
-            targets.append(tfunction(current, v))
-            current += frange[2] # increment
-        self._load(list(zip(inputs, targets)), mode="append")
+            ## the targets are the bank (or memmap), converted when used:
+            self.load_direct([bank], [bank])
+            if dtype == np.dtype("uint8"):
+                self.set_input_scale(0, 1/255)
+                self._add_transform(("targets", 0), ("scale", 1/255, 0.0))
+        if directory is not None:
+            self.apply_transforms(directory=directory)
+            self.to_memmap(directory)
+        if return_it:
+            return self
 
-    def load_direct(self, inputs=None, targets=None, labels=None):
+    def save(self, filename, append=False):
         """
-        Set the inputs/targets in the specific internal format:
+        Save the dataset (inputs, targets, labels, split, name and
+        description) to an HDF5 file. Each bank is stored as a chunked,
+        compressed HDF5 dataset, written a chunk at a time.
 
-        [[input-layer-1-vectors, ...], [input-layer-2-vectors, ...], ...]
+        If append is True, the patterns are added to the end of an
+        existing file, which must have the same banks, shapes, dtypes
+        and compact storage scales; the rest of the file (including its
+        split, name and description) is not rewritten.
 
-        [[target-layer-1-vectors, ...], [target-layer-2-vectors, ...], ...]
+        >>> import tempfile
+        >>> filename = os.path.join(tempfile.mkdtemp(), "xor.h5")
+        >>> ds = Dataset(name="XOR")
+        >>> ds.load([[[0, 0], [0]],
+        ...          [[0, 1], [1]],
+        ...          [[1, 0], [1]],
+        ...          [[1, 1], [0]]])
+        >>> ds.save(filename)
+        >>> ds.save(filename, append=True)
+        >>> ds2 = Dataset.load_file(filename)
+        >>> ds2.name, len(ds2)
+        ('XOR', 8)
+        >>> ds2 = Dataset.load_file(filename, start=2, stop=4)
+        >>> ds2.inputs[:]
+        [[1.0, 0.0], [1.0, 1.0]]
+        >>> ds.set_input_scale(0, 0.5)
+        >>> ds.save(filename, append=True)
+        Traceback (most recent call last):
+        ...
+        Exception: can't append: the input scales do not match the file
         """
-        ## inputs/targets are each [np.array(), ...], one np.array()
-        ## per bank
-        if inputs is not None:
-            self._inputs = inputs
-        if targets is not None:
-            self._targets = targets
-        if labels is not None:
-            self._labels = labels # should be a list of np.arrays(dtype=str), one per bank
-        self._cache_values()
+        if len(self.inputs) == 0:
+            raise Exception("no dataset loaded")
+        if self._stream is not None:
+            raise Exception("can't save a streaming dataset")
+        items = [("inputs", self._inputs), ("targets", self._targets), ("labels", self._labels)]
+        rows = self._index
+        size = self._get_size()
+        input_scales = json.dumps({str(b): self._input_scales[b] for b in self._input_scales})
+        with h5py.File(filename, "a" if append else "w") as h5:
+            if append:
+                if h5.attrs.get("conx_dataset_version") is None:
+                    raise Exception("'%s' is not a conx dataset file" % (filename,))
+                for (item, banks) in items:
+                    group = h5[item]
+                    if (len(group) != len(banks) or
+                        any(group[str(i)].shape[1:] != banks[i].shape[1:] for i in range(len(banks)))):
+                        raise Exception("can't append: %s banks do not match the file" % (item,))
+                    if item != "labels" and any(group[str(i)].dtype != banks[i].dtype
+                                                for i in range(len(banks))):
+                        raise Exception("can't append: %s dtypes do not match the file" % (item,))
+                ## stored values are decoded with the file's scales:
+                if json.loads(h5.attrs.get("input_scales", "{}")) != json.loads(input_scales):
+                    raise Exception("can't append: the input scales do not match the file")
+            else:
+                h5.attrs["conx_dataset_version"] = HDF5_FORMAT_VERSION
+                for (item, banks) in items:
+                    group = h5.create_group(item)
+                    for i in range(len(banks)):
+                        _hdf5_create_bank(group, str(i), banks[i],
+                                          self._label_vocab[i].dtype if item == "labels" else None)
+                h5.attrs["split"] = self._split
+                h5.attrs["input_scales"] = input_scales
+                h5.attrs["name"] = self.name if self.name is not None else ""
+                h5.attrs["description"] = self.description if self.description is not None else ""
+            for (item, banks) in items:
+                for i in range(len(banks)):
+                    data = h5[item][str(i)]
+                    offset = data.shape[0]
+                    data.resize(offset + size, axis=0)
+                    step = _chunk_rows(banks[i])
+                    for j in range(0, size, step):
+                        chunk = _take(banks[i], py_slice(j, j + step) if rows is None else rows[j:j + step])
+                        if item == "labels": ## files keep the labels themselves
+                            chunk = self._label_vocab[i][chunk]
+                        data[offset + j:offset + j + len(chunk)] = chunk
+
+    def load_file(self, filename=None, start=None, stop=None, input_banks=None, target_banks=None):
+        """
+        Load a dataset saved with Dataset.save(). Only the requested
+        rows and banks are read from the file.
+
+        Can be called on the Dataset class. If it is, returns a new
+        Dataset instance.
+
+        Arguments:
+            filename - the HDF5 file
+            start, stop - the range of patterns to load (default all)
+            input_banks - list of input bank numbers to load (default all)
+            target_banks - list of target bank numbers to load (default
+                all); labels are loaded for the same banks
+        """
+        return_it = _called_on_class(self)
+        if return_it:
+            filename, self = self, Dataset()
+        with h5py.File(filename, "r") as h5:
+            if h5.attrs.get("conx_dataset_version") is None:
+                raise Exception("'%s' is not a conx dataset file" % (filename,))
+            if input_banks is None:
+                input_banks = range(len(h5["inputs"]))
+            banks = {}
+            for (item, subset) in [("inputs", input_banks),
+                                   ("targets", target_banks),
+                                   ("labels", target_banks)]:
+                group = h5[item]
+                if subset is None:
+                    subset = range(len(group))
+                elif item != "labels" and any(not 0 <= b < len(group) for b in subset):
+                    raise Exception("no such %s bank in '%s': %s" % (item, filename, list(subset)))
+                banks[item] = [_hdf5_read_bank(group[str(b)], start, stop)
+                               for b in subset if str(b) in group]
+            self.clear()
+            self.name = h5.attrs["name"] or self.name
+            self.description = h5.attrs["description"] or self.description
+            self.load_direct(banks["inputs"], banks["targets"], banks["labels"])
+            scales = json.loads(h5.attrs.get("input_scales", "{}"))
+            self._input_scales = {i: tuple(scales[str(b)]) for (i, b) in enumerate(input_banks)
+                                  if str(b) in scales}
+            self._split = float(h5.attrs["split"])
+            self._cache_values()
+        if return_it:
+            return self
 
     def load(self, pairs=None, inputs=None, targets=None, labels=None):
         """
@@ -623,7 +2640,18 @@ class Dataset():
 
         * dataset.load([[input, target], ...])
         * dataset.load(inputs=[input, ...], targets=[target, ...])
+        * dataset.load(inputs=np.array(...), targets=np.array(...)) -
+          integer arrays keep an integer dtype (see below)
+        * dataset.load(inputs=scipy.sparse.csr_matrix(...), targets=...) -
+          sparse banks stay sparse, and are densified a batch at a time
         * dataset.load(generator, count)
+        * dataset.load(generator) - loads until the generator is exhausted
+
+        Banks are kept as float32, except that integer numpy arrays keep
+        their integer type (int64 is narrowed to int32, if the values
+        fit), and an input bank is kept in the dtype its network input
+        layer declares, if any (like an EmbeddingLayer's int32). Each
+        bank keeps its dtype when shuffled, split, or sliced.
 
         >>> ds = Dataset()
         >>> ds.load([[[0, 0], [0]],
@@ -636,6 +2664,14 @@ class Dataset():
         ...         targets=[[0], [1], [1], [0]]) # targets
         >>> len(ds)
         4
+        >>> ds.load(inputs=np.array([[0, 0], [0, 1], [1, 0], [1, 1]]),
+        ...         targets=np.array([[0.], [1.], [1.], [0.]]))
+        >>> len(ds), ds._inputs[0].dtype, ds._targets[0].dtype
+        (4, dtype('int32'), dtype('float32'))
+        >>> ds.shuffle()
+        >>> ds.split(0.5)
+        >>> ds.train_inputs.array().dtype
+        dtype('int32')
         >>> def generator():
         ...     for data in [[[0, 0], [0]],
         ...                  [[0, 1], [1]],
@@ -645,6 +2681,15 @@ class Dataset():
         >>> ds.load(generator(), 4)
         >>> len(ds)
         4
+        >>> ds.load(generator())
+        >>> len(ds)
+        4
+        >>> ds.load(inputs=scipy.sparse.identity(1000, format="csr"),
+        ...         targets=np.arange(1000).reshape(1000, 1))
+        >>> ds.inputs.shape, ds._is_batched()
+        ([(1000,)], True)
+        >>> ds.inputs[2][:4]
+        [0.0, 0.0, 1.0, 0.0]
         """
         self._load(pairs, inputs, targets, labels, mode="load")
 
@@ -674,6 +2719,9 @@ class Dataset():
         ...            [[1, 1], [0]]])
         >>> len(ds)
         8
+        >>> ds.append(([[i, i], [i], "new"] for i in range(2)))
+        >>> len(ds), ds.inputs[8], ds.labels[9]
+        (10, [0.0, 0.0], 'new')
         """
         if inputs is None:
             self._load(pairs, mode="append")
@@ -691,14 +2739,44 @@ class Dataset():
 
         See also :any:`matrix_to_channels_last` and :any:`matrix_to_channels_first`.
         """
-        if isinstance(pairs, types.GeneratorType) and not isinstance(inputs, numbers.Integral):
-            raise Exception("load with a generator also requires integer number to load")
+        self._stream = self._validation_stream = None
+        if isinstance(pairs, types.GeneratorType) and inputs is None:
+            ## unknown length: grow the banks as the patterns arrive
+            append = mode == "append" and len(self._inputs) > 0
+            if not append:
+                self._index = None
+                self._series = None
+                self._input_scales = {}
+                self._inputs = []
+                self._targets = []
+                self._labels = []
+            size = self._get_size()
+            labels = []
+            for line in pairs:
+                ins = [line[0]] if self._num_input_banks() == 1 else line[0]
+                for i in range(len(ins)):
+                    self._append_rows("inputs", i, np.array([ins[i]], self._get_bank_dtype("inputs", i, ins[i])))
+                targs = [line[1]] if self._num_target_banks() == 1 else line[1]
+                for i in range(len(targs)):
+                    self._append_rows("targets", i, np.array([targs[i]], self._get_bank_dtype("targets", i, targs[i])))
+                labels.append(line[2] if len(line) == 3 else "")
+            if len(self._labels) > 0:
+                self._append_labels(0, labels)
+            else: ## earlier patterns, if any, are unlabeled
+                self._set_labels([np.array([""] * size + labels, dtype=str)])
+            self._cache_values()
+            return
+        elif isinstance(pairs, types.GeneratorType) and not isinstance(inputs, numbers.Integral):
+            raise Exception("load with a generator requires an integer number to load, or None")
         elif isinstance(pairs, types.GeneratorType) and isinstance(inputs, numbers.Integral):
             ## do it all here:
             ## create space
-            self._inputs = [np.zeros([inputs] + list(self.inputs.get_shape(i)), "float32")
+            self._index = None
+            self._series = None
+            self._input_scales = {}
+            self._inputs = [np.zeros([inputs] + list(self.inputs.get_shape(i)), self._get_bank_dtype("inputs", i))
                             for i in range(self._num_input_banks())]
-            self._targets = [np.zeros([inputs] + list(self.targets.get_shape(i)), "float32")
+            self._targets = [np.zeros([inputs] + list(self.targets.get_shape(i)), self._get_bank_dtype("targets", i))
                              for i in range(self._num_target_banks())]
             self._labels = ["" for i in range(inputs)] ## convert to numpy at end
             count = 0
@@ -719,7 +2797,7 @@ class Dataset():
                 count += 1
                 if count == inputs:
                     break
-            self._labels = [np.array(self._labels, dtype=str)]
+            self._set_labels([np.array(self._labels, dtype=str)])
             self._cache_values()
             return
         ## else, either pairs=[[[inputs...], [targets...]]...] or pairs=inputs, inputs=targets
@@ -727,6 +2805,18 @@ class Dataset():
             if targets is not None:
                 if pairs is not None:
                     raise Exception("Use pairs or inputs/targets but not both")
+                input_banks = self._as_banks(inputs, self._num_input_banks())
+                target_banks = self._as_banks(targets, self._num_target_banks())
+                ## sparse banks can't be zipped into pairs, so a plain
+                ## list on the other side is made into numpy banks:
+                if target_banks is None and _any_sparse(input_banks):
+                    target_banks = self._dense_banks(targets, self._num_target_banks())
+                elif input_banks is None and _any_sparse(target_banks):
+                    input_banks = self._dense_banks(inputs, self._num_input_banks())
+                if input_banks is not None and target_banks is not None:
+                    ## fast path: already in numpy arrays
+                    self._load_banks(input_banks, target_banks, labels, mode)
+                    return
                 if labels is not None:
                     pairs = list(zip(inputs, targets, labels))
                 else:
@@ -780,30 +2870,140 @@ class Dataset():
                 targets = [np.array([bank], "float32") for bank in targets[0]]
                 for i in range(len(targets[0])):
                     shape = targets[0][i].shape
-                    if prediction[0][i].shape != shape:
+                    if not self._target_matches(prediction[0][i].shape, shape):
                         raise Exception("Invalid output shape on bank #%d; got %s, expecting %s" % (i, shape, prediction[0][i].shape))
             else:
                 targets = [np.array(bank, "float32") for bank in targets[0]]
                 shape = targets[0].shape
-                if prediction[0].shape != shape:
+                if not self._target_matches(prediction[0].shape, shape):
                     raise Exception("Invalid output shape on bank #%d; got %s, expecting %s" % (0, shape, prediction[0].shape))
         if len(self._inputs) > 0 and mode == "load":
             self.clear()
         self.compile(pairs)
 
+    def _as_banks(self, data, num_banks):
+        """
+        If data is already in numpy form (an array for one bank, or
+        a list of arrays, one per bank), return it as a list of
+        arrays, one per bank. scipy.sparse matrices count as arrays.
+        Otherwise, return None.
+        """
+        if scipy.sparse.issparse(data) and num_banks == 1:
+            return [data]
+        elif isinstance(data, np.ndarray) and num_banks == 1 and data.dtype != object:
+            return [data]
+        elif (isinstance(data, (list, tuple)) and num_banks > 1 and
+              len(data) == num_banks and
+              all(scipy.sparse.issparse(bank) or
+                  (isinstance(bank, np.ndarray) and bank.dtype != object and bank.ndim > 0)
+                  for bank in data) and
+              all_same([_num_rows(bank) for bank in data])):
+            return list(data)
+        return None
+
+    def _dense_banks(self, data, num_banks):
+        """
+        Make data (nested lists, one bank, or a list of banks) into a
+        list of float32 arrays, one per bank.
+        """
+        if num_banks == 1:
+            return [np.asarray(data, dtype=np.float32)]
+        else:
+            return [np.asarray(bank, dtype=np.float32) for bank in data]
+
+    def _load_banks(self, inputs, targets, labels=None, mode=None):
+        """
+        Load or append numpy banks directly, checking the shape and
+        type of each bank once, rather than each pattern.
+        """
+        size = _num_rows(inputs[0])
+        if size == 0:
+            raise Exception("need more than zero pairs of inputs/targets")
+        for (item, banks) in [("input", inputs), ("target", targets)]:
+            for i in range(len(banks)):
+                if _num_rows(banks[i]) != size:
+                    raise Exception("Malformed %s bank #%d: length %d, expecting %d" %
+                                    (item, i, _num_rows(banks[i]), size))
+                if banks[i].dtype.kind not in "biuf":
+                    raise Exception("Malformed %s bank #%d: non-numeric type %s" %
+                                    (item, i, banks[i].dtype))
+        ## sparse banks stay sparse (in CSR form, for gathering rows); the
+        ## banks are copies, so that the caller's arrays are never changed:
+        inputs = [bank.tocsr().astype(self._get_bank_dtype("inputs", i, bank), copy=True)
+                  if scipy.sparse.issparse(bank)
+                  else np.array(bank, self._get_bank_dtype("inputs", i, bank), copy=True)
+                  for (i, bank) in enumerate(inputs)]
+        targets = [bank.tocsr().astype(self._get_bank_dtype("targets", i, bank), copy=True)
+                   if scipy.sparse.issparse(bank)
+                   else np.array(bank, self._get_bank_dtype("targets", i, bank), copy=True)
+                   for (i, bank) in enumerate(targets)]
+        if labels is not None:
+            labels = np.asarray(labels).astype(str)
+            if len(labels) != size:
+                raise Exception("Malformed labels: length %d, expecting %d" % (len(labels), size))
+            labels = [labels]
+        # Test the first input, see if outputs match:
+        if self.network and self.network.model:
+            try:
+                prediction = self.network.model.predict([_take(bank, py_slice(0, 1)) for bank in inputs],
+                                                        batch_size=1)
+            except:
+                raise Exception("Invalid input form: %s did not propagate through network" %
+                                ([_take(bank, py_slice(0, 1)) for bank in inputs],))
+            if self._num_target_banks() == 1:
+                prediction = [prediction]
+            for i in range(len(targets)):
+                if not self._target_matches(prediction[i].shape[1:], targets[i].shape[1:]):
+                    raise Exception("Invalid output shape on bank #%d; got %s, expecting %s" %
+                                    (i, targets[i].shape[1:], prediction[i].shape[1:]))
+        if mode == "load" or len(self._inputs) == 0:
+            if len(self._inputs) > 0:
+                self.clear()
+            self._inputs = inputs
+            self._targets = targets
+            self._set_labels(labels if labels is not None else [])
+        else:
+            current = [key for key in self._hash_indices if self._is_hash_index_current(key)]
+            for i in range(len(inputs)):
+                self._append_rows("inputs", i, inputs[i])
+            for i in range(len(targets)):
+                self._append_rows("targets", i, targets[i])
+            if labels is None and len(self._labels) > 0:
+                labels = [np.array([""] * size)]
+            elif labels is not None and len(self._labels) == 0:
+                self._set_labels([np.array([""] * (_num_rows(self._inputs[0]) - size))])
+            if labels is not None:
+                self._append_labels(0, labels[0])
+            for key in current: ## just hash the new rows
+                self._extend_hash_index(key, _num_rows(self._inputs[0]) - size)
+        self._cache_values()
+
+    def _get_bank_dtype(self, item, bank_index, values=None):
+        """
+        The dtype to keep a new bank in (see _bank_dtype()): an input
+        bank takes the dtype of its network input layer, if it declares
+        one (eg, an EmbeddingLayer's int32 inputs); values (a bank, or
+        one pattern) is used to infer it otherwise.
+        """
+        declared = None
+        if (item == "inputs" and self.network is not None and
+            bank_index < len(self.network.input_bank_order)):
+            declared = self.network[self.network.input_bank_order[bank_index]].params.get("dtype")
+        return _bank_dtype(values, declared)
+
     def compile(self, pairs):
         if self._num_input_banks() > 1: ## for incoming format
             inputs = []
             for i in range(len(pairs[0][0])):
-                inputs.append(np.array([x[0][i] for x in pairs], "float32"))
+                inputs.append(np.array([x[0][i] for x in pairs], self._get_bank_dtype("inputs", i, pairs[0][0][i])))
         else:
-            inputs = [np.array([x[0] for x in pairs], "float32")]
+            inputs = [np.array([x[0] for x in pairs], self._get_bank_dtype("inputs", 0, pairs[0][0]))]
         if self._num_target_banks() > 1: ## for incoming format
             targets = []
             for i in range(len(pairs[0][1])):
-                targets.append(np.array([y[1][i] for y in pairs], "float32"))
+                targets.append(np.array([y[1][i] for y in pairs], self._get_bank_dtype("targets", i, pairs[0][1][i])))
         else:
-            targets = [np.array([y[1] for y in pairs], "float32")]
+            targets = [np.array([y[1] for y in pairs], self._get_bank_dtype("targets", 0, pairs[0][1]))]
         labels = []
         if len(pairs[0]) == 3:
             if self._num_target_banks() > 1: ## for incoming format
@@ -816,21 +3016,107 @@ class Dataset():
             self._inputs = inputs
         else:
             for i in range(len(self._inputs)):
-                self._inputs[i] = np.append(self._inputs[i], inputs[i], 0)
+                self._append_rows("inputs", i, inputs[i])
         ## targets:
         if len(self._targets) == 0:
             self._targets = targets
         else:
             for i in range(len(self._targets)):
-                self._targets[i] = np.append(self._targets[i], targets[i], 0)
+                self._append_rows("targets", i, targets[i])
         ## labels:
         if len(self._labels) == 0:
-            self._labels = labels
+            self._set_labels(labels)
         else:
             for i in range(len(self._labels)):
-                self._labels[i] = np.append(self._labels[i], labels[i], 0)
+                self._append_labels(i, labels[i] if len(labels) > 0 else [""] * len(pairs))
         self._cache_values()
 
+    def _append_rows(self, item, bank_index, rows):
+        """
+        Append rows to the bank self._<item>[bank_index].
+
+        Each bank is a view onto the front of a larger buffer. The
+        buffer doubles in size when full, so appending is amortized
+        O(1) per row, rather than copying the whole bank each time.
+        An integer bank is promoted to hold the rows (eg, to float32).
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=np.array([[1, 2]]), targets=[[0]])
+        >>> ds.append([0.5, 0.75], [1])
+        >>> ds._inputs[0].dtype, ds.inputs[:]
+        (dtype('float32'), [[1.0, 2.0], [0.5, 0.75]])
+        """
+        banks = getattr(self, "_" + item)
+        if bank_index == len(banks):
+            banks.append(rows)
+            return
+        bank = banks[bank_index]
+        if item == "inputs": ## compact storage
+            rows = self._encode_inputs(bank_index, rows)
+        if bank.shape[1:] != rows.shape[1:]:
+            raise Exception("Malformed %s: shape %s does not match bank #%d shape %s" %
+                            (item, rows.shape[1:], bank_index, bank.shape[1:]))
+        if scipy.sparse.issparse(bank): ## sparse banks are restacked
+            banks[bank_index] = scipy.sparse.vstack([bank, rows], format="csr", dtype=bank.dtype)
+            return
+        elif isinstance(bank, ConcatBank): ## the rows are a new part
+            banks[bank_index] = bank.extend(rows)
+            entry = self._bank_stats.get((item, bank_index))
+            if entry is not None and entry[0]() is bank and entry[1] is None:
+                stats = _merge_stats(entry[2], _bank_stats(rows))
+                self._bank_stats[(item, bank_index)] = (weakref.ref(banks[bank_index]), None, stats)
+            return
+        elif scipy.sparse.issparse(rows):
+            rows = rows.toarray()
+        if bank.dtype.kind in "US": ## allow strings to get longer
+            dtype = np.promote_types(bank.dtype, rows.dtype)
+        elif bank.dtype.kind in "biu": ## don't truncate floats, or wider integers
+            dtype = np.result_type(bank.dtype, rows.dtype)
+            if dtype.kind == "f": ## float banks are float32
+                dtype = np.dtype("float32")
+        else:
+            dtype = bank.dtype
+        size = len(bank)
+        new_size = size + len(rows)
+        ref = self._bank_views.get((item, bank_index))
+        buffer = bank.base
+        if (ref is None or ref() is not bank or buffer is None or
+            buffer.dtype != dtype or len(buffer) < new_size):
+            ## not our buffer, or out of room: make a new, bigger buffer
+            buffer = np.empty((max(2 * new_size, 16),) + bank.shape[1:], dtype)
+            buffer[:size] = bank
+        buffer[size:new_size] = rows
+        banks[bank_index] = buffer[:new_size]
+        self._bank_views[(item, bank_index)] = weakref.ref(banks[bank_index])
+        ## update the running statistics, rather than rescanning the bank:
+        entry = self._bank_stats.get((item, bank_index))
+        if entry is not None and entry[0]() is bank and entry[1] is None:
+            stats = _merge_stats(entry[2], _bank_stats(rows))
+            self._bank_stats[(item, bank_index)] = (weakref.ref(banks[bank_index]), None, stats)
+
+    def compact(self):
+        """
+        Release the extra space reserved for appending to the
+        dataset. Only needed after many appends, if memory is tight.
+
+        >>> ds = Dataset()
+        >>> for i in range(10):
+        ...     ds.append([i, i], [i])
+        >>> len(ds._inputs[0].base)
+        16
+        >>> ds.compact()
+        >>> ds._inputs[0].base is None
+        True
+        >>> ds.inputs[9]
+        [9.0, 9.0]
+        """
+        for (item, bank_index) in list(self._bank_views.keys()):
+            bank = self._bank_views[(item, bank_index)]()
+            banks = getattr(self, "_" + item)
+            if bank is not None and bank_index < len(banks) and banks[bank_index] is bank:
+                banks[bank_index] = bank.copy()
+        self._bank_views = {}
+
     def datasets(self=None):
         """
         Returns the list of available datasets.
@@ -844,7 +3130,7 @@ class Dataset():
         >>> len(ds.datasets())
         9
         """
-        if self is None:
+        if _called_on_class(self):
             self = Dataset()
         return sorted(self.DATASETS.keys())
 
@@ -868,11 +3154,15 @@ class Dataset():
         [0.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0]
 
         >>> ds.clear()
+
+        The mnist, cifar10 and cifar100 datasets are cached, ready to
+        use, after the first get(); later calls memory-map the cached
+        copy. Use get(..., force_refresh=True) to rebuild the cache,
+        and Dataset.cache_info() to see how much space it takes.
         """
-        return_it = False
-        if isinstance(self, str):
+        return_it = _called_on_class(self)
+        if return_it:
             dataset_name, self = self, Dataset()
-            return_it = True
         else:
             self._split = 0
         if dataset_name.lower() in self.DATASETS:
@@ -884,6 +3174,30 @@ class Dataset():
                 ("unknown dataset name '%s': should be one of %s" %
                  (dataset_name, list(self.DATASETS.keys()))))
 
+    def cache_info(self=None):
+        """
+        Show the datasets in the cache of preprocessed datasets (see
+        Dataset.get()), and return the total size in bytes. Can be
+        called on the Dataset class.
+        """
+        entries = conx.datasets._cache.cache_info()
+        print("Dataset cache: %s" % conx.datasets._cache.get_cache_dir())
+        for (entry, loader, size) in entries:
+            print("   %-30s %10.1f MB" % (entry, size / 1024 ** 2))
+        total = sum(size for (entry, loader, size) in entries)
+        print("Total: %.1f MB" % (total / 1024 ** 2))
+        return total
+
+    def clear_cache(self=None, dataset_name=None):
+        """
+        Remove all datasets from the cache of preprocessed datasets,
+        or just those of dataset_name. Can be called on the Dataset
+        class, as in Dataset.clear_cache("mnist").
+        """
+        if _called_on_class(self) and dataset_name is None:
+            dataset_name = self
+        conx.datasets._cache.clear_cache(dataset_name.lower() if dataset_name else None)
+
     def copy(self, dataset):
         """
         Copy the inputs/targets from one dataset into
@@ -891,7 +3205,12 @@ class Dataset():
         """
         self.load_direct(inputs=dataset._inputs,
                          targets=dataset._targets,
-                         labels=dataset._labels)
+                         labels=dataset._labels,
+                         label_vocab=dataset._label_vocab)
+        self._input_scales = dict(dataset._input_scales)
+        self._cache_values()
+        if dataset._index is not None:
+            self._set_index(dataset._index.copy())
 
     def slice(self, start=None, stop=None):
         """
@@ -909,35 +3228,94 @@ class Dataset():
         else:
             if stop is None: # (None, None)
                 start = 0
-                stop = len(self._inputs[0])
+                stop = self._get_size()
             else: # (None, #)
                 start = 0
-        self._inputs = [np.array(row[start:stop]) for row in self._inputs]
-
-        self._targets = [np.array(row[start:stop]) for row in self._targets]
-        if len(self._labels) > 0:
-            self._labels = [np.array(row[start:stop]) for row in self._labels]
+        if self._index is not None:
+            self._set_index(self._index[start:stop])
+            ## memmap banks keep the index; others are gathered to free memory:
+            if not self._is_memmap():
+                self.materialize()
+        else:
+            ## memmap banks are kept as views; others are copied to free memory:
+            copy_bank = lambda row: row if isinstance(row, np.memmap) else np.array(row)
+            self._inputs = [copy_bank(row[start:stop]) for row in self._inputs]
+            self._targets = [copy_bank(row[start:stop]) for row in self._targets]
+            if len(self._labels) > 0:
+                self._labels = [copy_bank(row[start:stop]) for row in self._labels]
         if self._split > 0:
             print("WARNING: dataset split reset to 0", file=sys.stderr)
         self._split = 0
         self._cache_values()
 
+    def _get_bank_stats(self, item, bank_index):
+        """
+        Get the statistics of a bank, in dataset order. They are kept
+        for as long as the bank is unchanged, and are updated as rows
+        are appended; a bank that is replaced is scanned again.
+        """
+        bank = getattr(self, "_" + item)[bank_index]
+        ## a lazy subset of the bank (eg, after chop()):
+        rows = self._index if self._index is not None and len(self._index) != _num_rows(bank) else None
+        entry = self._bank_stats.get((item, bank_index))
+        if (entry is None or entry[0]() is not bank or
+            (entry[1]() if entry[1] is not None else None) is not rows):
+            stats = _bank_stats(bank, rows)
+            entry = (weakref.ref(bank), weakref.ref(rows) if rows is not None else None, stats)
+            self._bank_stats[(item, bank_index)] = entry
+        return entry[2]
+
+    def stats(self):
+        """
+        Get statistics of each input and target bank, over all values
+        in the bank: count (number of patterns), min, max, mean, and
+        var (variance). Banks in compact storage are described by their
+        logical values.
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=[[0, 1], [2, 3]], targets=[[0], [1]])
+        >>> ds.append([4, 5], [1])
+        >>> stats = ds.stats()
+        >>> stats["inputs"][0]["count"], stats["inputs"][0]["min"], stats["inputs"][0]["max"]
+        (3, 0.0, 5.0)
+        >>> stats["inputs"][0]["mean"], round(stats["inputs"][0]["var"], 4)
+        (2.5, 2.9167)
+        """
+        retval = {}
+        for item in ["inputs", "targets"]:
+            retval[item] = []
+            for b in range(len(getattr(self, "_" + item))):
+                stats = self._get_bank_stats(item, b)
+                if stats is None:
+                    retval[item].append({"count": 0, "min": None, "max": None,
+                                         "mean": None, "var": None})
+                    continue
+                low, high, mean, var = stats["min"], stats["max"], stats["mean"], stats["m2"] / stats["n"]
+                if item == "inputs" and b in self._input_scales:
+                    scale, offset = self._input_scales[b]
+                    low, high = sorted(self._decode_inputs(b, np.array([low, high])))
+                    mean, var = mean * scale + offset, var * scale ** 2
+                retval[item].append({"count": self._get_size(), "min": low, "max": high,
+                                     "mean": mean, "var": var})
+        return retval
+
     def _cache_values(self):
+        self._update_index()
+        if len(self.inputs) > 0 or len(self.targets) > 0:
+            stats = self.stats()
         if len(self.inputs) > 0:
-            self._inputs_range = list(zip([x.min() for x in self._inputs],
-                                          [x.max() for x in self._inputs]))
+            self._inputs_range = [(s["min"], s["max"]) for s in stats["inputs"]]
         else:
             self._inputs_range = []
         if len(self.targets) > 0:
-            self._targets_range = list(zip([x.min() for x in self._targets],
-                                           [x.max() for x in self._targets]))
+            self._targets_range = [(s["min"], s["max"]) for s in stats["targets"]]
         else:
             self._targets_range = []
         ## Set shape cache:
         if len(self._inputs) > 0:
-            self._input_shapes = [x[0].shape for x in self._inputs]
+            self._input_shapes = [x.shape[1:] for x in self._inputs]
         if len(self._targets) > 0:
-            self._target_shapes = [x[0].shape for x in self._targets]
+            self._target_shapes = [x.shape[1:] for x in self._targets]
         # Final checks:
         if len(self.inputs) != len(self.targets):
             print("WARNING: inputs/targets lengths do not match", file=sys.stderr)
@@ -976,7 +3354,9 @@ class Dataset():
     def set_targets_from_inputs(self, f=None, input_bank=0, target_bank=0):
         """
         Copy the inputs to targets. Optionally, apply a function f to
-        input copy.
+        input copy. f is a lazy transform step (see Dataset.map()): it
+        is applied, giving float32 targets, when the targets are next
+        read or trained on.
 
         >>> from conx import Network
         >>> net = Network("Sample", 2, 2, 1)
@@ -987,28 +3367,23 @@ class Dataset():
         >>> net.compile(error="mse", optimizer="adam")
         >>> net.dataset.load(ds)
         >>> net.dataset.set_targets_from_inputs(lambda iv: [iv[0]])
-        >>> net.dataset.targets[1]
-        [0.0]
+        >>> sorted(net.dataset._transforms.keys())
+        [('targets', 0)]
+        >>> net.dataset.targets[1], net.dataset._targets[0].dtype
+        ([0.0], dtype('float32'))
         """
         if f:
-            ## First, apply the function to human form:
-            ts = []
-            for i in range(len(self.inputs)):
-                if self._num_input_banks() == 1:
-                    if input_bank != 0:
-                        raise Exception("invalid input_bank: %d" % input_bank)
-                    ts.append(f(self.inputs[i]))
-                else:
-                    ts.append(f(self.inputs[i][0]))
-            self._targets[target_bank] = np.array(ts)
+            self._copy_bank_with_function(("inputs", input_bank), ("targets", target_bank), f)
         else: ## no function: just copy the inputs directly
-            self._targets = copy.copy(self._inputs)
-        self._cache_values()
+            self._targets = [self._decode_inputs(b, bank) for (b, bank) in enumerate(self._inputs)]
+            self._cache_values()
 
     def set_inputs_from_targets(self, f=None, input_bank=0, target_bank=0):
         """
         Copy the targets to inputs. Optionally, apply a function f to
-        target copy.
+        target copy. f is a lazy transform step (see Dataset.map()): it
+        is applied, giving float32 inputs, when the inputs are next
+        read or trained on.
 
         >>> from conx import Network
         >>> net = Network("Sample", 2, 2, 1)
@@ -1023,31 +3398,77 @@ class Dataset():
         [1.0, 1.0]
         """
         if f:
-            ## First, apply the function to human form:
-            ins = []
-            for i in range(len(self.targets)):
-                if self._num_target_banks() == 1:
-                    if target_bank != 0:
-                        raise Exception("invalid target_bank: %d" % target_bank)
-                    ins.append(f(self.targets[i]))
-                else:
-                    ins.append(f(self.targets[i][target_bank]))
-            self._inputs[input_bank] = np.array(ins)
+            self._copy_bank_with_function(("targets", target_bank), ("inputs", input_bank), f)
         else: ## no function: just copy the targets directly
             self._inputs = copy.copy(self._targets)
-        self._cache_values()
+            self._input_scales = {}
+            self._cache_values()
+
+    def _copy_bank_with_function(self, source, destination, f):
+        """
+        Make bank destination, like ("targets", 0), a copy of bank
+        source passed through f, one row (in human form, as a list) at
+        a time, as float32. The copy is a lazy transform (see
+        Dataset.map()) of the source bank, after any steps pending on
+        it. A destination just past the last bank is appended.
+        """
+        (item, bank_index) = source
+        banks = self.__dict__["_" + item] ## without applying pending steps
+        if not 0 <= bank_index < len(banks):
+            raise Exception("invalid %s bank: %d" % (item[:-1], bank_index))
+        steps = list(self._transforms.get(source, []))
+        if not steps and item == "inputs" and bank_index in self._input_scales:
+            steps = [("scale",) + tuple(self._input_scales[bank_index])]
+        bank = banks[bank_index]
+        (item, bank_index) = destination
+        banks = self.__dict__["_" + item]
+        if bank_index == len(banks):
+            banks.append(bank)
+        elif 0 <= bank_index < len(banks):
+            banks[bank_index] = bank
+        else:
+            raise Exception("invalid %s bank: %d" % (item[:-1], bank_index))
+        self._transforms.pop(destination, None)
+        if item == "inputs":
+            self._input_scales.pop(bank_index, None)
+        for step in steps + [("map", lambda row: f(row.tolist()), False),
+                             ("cast", np.dtype("float32"))]:
+            self._add_transform(destination, step)
 
-    def set_targets_from_labels(self, num_classes=None, bank_index=0):
+    def set_targets_from_labels(self, num_classes=None, bank_index=0, sparse=False):
         """
         Given net.labels are integers, set the net.targets to onehot() categories.
+
+        With sparse=True, the targets are the integer classes themselves,
+        one column wide, for a network compiled with
+        sparse_categorical_crossentropy.
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=[[0, 0], [0, 1], [1, 0]], targets=[[0], [0], [0]],
+        ...         labels=["0", "2", "1"])
+        >>> ds.set_targets_from_labels(3, sparse=True)
+        Generated 3 target vectors from 3 labels
+        >>> ds.targets[1], ds._targets[0].dtype
+        ([2], dtype('int16'))
+        >>> ds.set_targets_from_labels(3)
+        Generated 3 target vectors from 3 labels
+        >>> ds.targets[1]
+        [0, 0, 1]
         """
         if len(self.inputs) == 0:
             raise Exception("no dataset loaded")
+        codes = self._labels[bank_index]
         if num_classes is None:
-            num_classes = len(set(self._labels[bank_index]))
+            num_classes = len(np.unique(codes))
         if not isinstance(num_classes, numbers.Integral) or num_classes <= 0:
             raise Exception("number of classes must be a positive integer")
-        self._targets[bank_index] = to_categorical([int(v) for v in self._labels[bank_index]], num_classes).astype("uint8")
+        ## convert each label in the vocabulary once, then look them up:
+        values = np.array([int(v) for v in self._label_vocab[bank_index]], dtype=int)
+        if sparse:
+            dtype = "int16" if num_classes <= np.iinfo("int16").max else "int32"
+            self._targets[bank_index] = values[codes].astype(dtype).reshape(-1, 1)
+        else:
+            self._targets[bank_index] = to_categorical(values[codes], num_classes).astype("uint8")
         self._cache_values()
         print('Generated %d target vectors from %d labels' % (len(self.targets), num_classes))
 
@@ -1073,23 +3494,28 @@ class Dataset():
         retval += '**Information**:\n'
         retval += '   * name    : %s\n' % (self.name,)
         retval += '   * length  : %s\n' % (size,)
+        if self._stream is not None:
+            retval += '   * stream  : %s training batches, %s validation batches\n' % self.split()
         retval += '\n'
-        retval += '**Input Summary**:\n'
-        if size != 0:
-            if len(self.inputs.shape) == 1:
-                retval += '   * shape  : %s\n' % (self.inputs.shape[0],)
-                retval += '   * range  : %s\n\n' % (self._inputs_range[0],)
-            else:
-                retval += '   * shape  : %s\n' % (self.inputs.shape,)
-                retval += '   * range  : %s\n\n' % (self._inputs_range,)
-        retval += '**Target Summary**:\n'
         if size != 0:
-            if len(self.targets.shape) == 1:
-                retval += '   * shape  : %s\n' % (self.targets.shape[0],)
-                retval += '   * range  : %s\n\n' % (self._targets_range[0],)
-            else:
-                retval += '   * shape  : %s\n' % (self.targets.shape,)
-                retval += '   * range  : %s\n\n' % (self._targets_range,)
+            stats = self.stats()
+        for (item, title) in [("inputs", "Input"), ("targets", "Target")]:
+            retval += '**%s Summary**:\n' % (title,)
+            if size != 0:
+                vector = getattr(self, item)
+                means = ["%.4f" % s["mean"] for s in stats[item]]
+                stds = ["%.4f" % np.sqrt(s["var"]) for s in stats[item]]
+                ranges = getattr(self, "_%s_range" % item)
+                if len(vector.shape) == 1:
+                    retval += '   * shape  : %s\n' % (vector.shape[0],)
+                    retval += '   * range  : %s\n' % (ranges[0],)
+                    retval += '   * mean   : %s\n' % (means[0],)
+                    retval += '   * std    : %s\n\n' % (stds[0],)
+                else:
+                    retval += '   * shape  : %s\n' % (vector.shape,)
+                    retval += '   * range  : %s\n' % (ranges,)
+                    retval += '   * mean   : [%s]\n' % (", ".join(means),)
+                    retval += '   * std    : [%s]\n\n' % (", ".join(stds),)
         if self.network:
             self.network.test_dataset_ranges()
         return retval
@@ -1124,6 +3550,13 @@ class Dataset():
             else:
                 retval += template % ("targets", self.targets.shape, self._targets_range,)
         retval += ('=' * 65) + "\n"
+        if self._stream is not None:
+            retval += 'Streaming dataset\n'
+            retval += '   Training batches: %d\n' % (self.split()[0],)
+            retval += '   Testing batches: %d\n' % (self.split()[1],)
+            retval += ('_' * 65)
+            print(retval)
+            return
         retval += 'Total patterns: %d\n' % (size,)
         retval += '   Training patterns: %d\n' % (num_train,)
         retval += '   Testing patterns: %d\n' % (num_test,)
@@ -1134,34 +3567,387 @@ class Dataset():
 
     def rescale_inputs(self, bank_index, old_range, new_range, new_dtype):
         """
-        Rescale the inputs.
+        Rescale the inputs. The range is checked now, but the bank is
+        rescaled lazily (see Dataset.rescale()).
+
+        For a bank in compact storage (see Dataset.set_input_scale()),
+        rescaling to a float type just changes the scale and offset;
+        the stored values are not touched.
+
+        >>> ds = Dataset()
+        >>> ds.load_direct([np.array([[0, 255], [51, 102]], "uint8")],
+        ...                [np.array([[0], [1]], "float32")])
+        >>> ds.set_input_scale(0, 1/255)
+        >>> ds.rescale_inputs(0, (0, 1), (-1, 1), "float32")
+        >>> ds._inputs_range
+        [(-1.0, 1.0)]
+        >>> ds._inputs[0].dtype
+        dtype('uint8')
         """
         old_min, old_max = old_range
         new_min, new_max = new_range
-        if self._inputs[bank_index].min() < old_min or self._inputs[bank_index].max() > old_max:
+        low, high = self._inputs_range[bank_index]
+        if low < old_min or high > old_max:
             raise Exception('range %s is incompatible with inputs' % (old_range,))
         if old_min > old_max:
             raise Exception('range %s is out of order' % (old_range,))
         if new_min > new_max:
             raise Exception('range %s is out of order' % (new_range,))
-        self._inputs[bank_index] = rescale_numpy_array(self._inputs[bank_index], old_range, new_range, new_dtype)
-        self._cache_values()
+        if bank_index in self._input_scales and np.dtype(new_dtype).kind == "f":
+            scale, offset = self._input_scales[bank_index]
+            old_delta = old_max - old_min
+            new_delta = new_max - new_min
+            if old_delta == 0:
+                offset = offset - old_min + (new_min + new_max)/2
+            else:
+                scale, offset = (scale * new_delta/old_delta,
+                                 new_min + (offset - old_min) * new_delta/old_delta)
+            self._input_scales[bank_index] = (scale, offset)
+            self._cache_values()
+        else:
+            self.rescale(("inputs", bank_index), old_range, new_range, new_dtype)
 
     def shuffle(self):
         """
         Shuffle the inputs/targets.
+
+        Only the order of the dataset is shuffled; the banks themselves
+        are not rewritten. Batches are gathered in the new order when
+        training. See Dataset.materialize() to rewrite the banks.
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=[[i] for i in range(10)], targets=[[i] for i in range(10)])
+        >>> ds.shuffle()
+        >>> sorted(ds.inputs[:]) == [[float(i)] for i in range(10)]
+        True
+        >>> ds.inputs[:] == ds.targets[:]
+        True
         """
         if len(self.inputs) == 0:
             raise Exception("no dataset loaded")
         permutation = np.random.permutation(len(self.inputs))
-        self._inputs = [self._inputs[b][permutation] for b in range(self._num_input_banks())]
-        self._targets = [self._targets[b][permutation] for b in range(self._num_target_banks())]
-        if len(self._labels) != 0:
-            self._labels = [self._labels[b][permutation] for b in range(self._num_target_banks())]
+        self._set_index(self._get_index()[permutation])
         if 0 < self._split < 1:
             print("WARNING: reshuffling all data; test data has changed", file=sys.stderr)
 
-    def split(self, split=None):
+    def _set_index(self, index):
+        """
+        Set the (physical) bank rows, in dataset order.
+        """
+        self._index = np.asarray(index, dtype=np.intp)
+        self._index_rows = _num_rows(self._inputs[0]) if len(self._inputs) > 0 else 0
+
+    def _update_index(self):
+        """
+        Keep the index in step with the banks: rows appended to the
+        banks are added to the end of the dataset order. If the banks
+        have been replaced, the index no longer applies.
+        """
+        if self._index is None:
+            return
+        rows = _num_rows(self._inputs[0]) if len(self._inputs) > 0 else 0
+        if rows > self._index_rows:
+            self._index = np.concatenate([self._index, np.arange(self._index_rows, rows)])
+            self._index_rows = rows
+        elif rows < self._index_rows:
+            self._index = None
+
+    def select(self, mask):
+        """
+        Select patterns with a numpy boolean mask (or array of indices),
+        or with a predicate that is given whole arrays of patterns and
+        returns a boolean array:
+
+            predicate(inputs, targets, labels)
+
+        where each argument is a numpy array (or a list of arrays, one
+        per bank) in the human format; labels is None if there are no
+        labels. The predicate is called on chunks of the dataset.
+
+        Returns a new Dataset that shares its banks with this one; only
+        the selected indices are kept. It can be trained, tested, and
+        displayed like any other Dataset.
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=[[i] for i in range(10)], targets=[[i % 2] for i in range(10)],
+        ...         labels=[str(i % 3) for i in range(10)])
+        >>> odd = ds.select(lambda inputs, targets, labels: targets[:, 0] == 1)
+        >>> odd.inputs[:]
+        [[1.0], [3.0], [5.0], [7.0], [9.0]]
+        >>> odd._inputs[0] is ds._inputs[0]
+        True
+        >>> ds.select(ds.labels.array() == "0").labels[:]
+        ['0', '0', '0', '0']
+        >>> ds.select([9, 0]).inputs[:]
+        [[9.0], [0.0]]
+        """
+        if self._stream is not None:
+            raise Exception("can't select from a streaming dataset")
+        size = self._get_size()
+        if callable(mask):
+            positions = []
+            step = min([_chunk_rows(bank) for bank in self._inputs + self._targets] or [size or 1])
+            for i in range(0, size, step):
+                rows = py_slice(i, i + step) if self._index is None else self._index[i:i + step]
+                banks = []
+                for (item, count) in [("inputs", len(self._inputs)),
+                                      ("targets", len(self._targets)),
+                                      ("labels", len(self._labels))]:
+                    data = [self._get_bank_rows(item, b, rows) for b in range(count)]
+                    banks.append(None if count == 0 else data[0] if count == 1 else data)
+                positions.append(i + np.flatnonzero(np.asarray(mask(*banks), dtype=bool)))
+            positions = np.concatenate(positions) if positions else np.zeros(0, int)
+        else:
+            mask = np.asarray(mask)
+            if mask.dtype == bool:
+                if mask.shape != (size,):
+                    raise Exception("mask has shape %s, expecting (%d,)" % (mask.shape, size))
+                positions = np.flatnonzero(mask)
+            else:
+                positions = mask.astype(int)
+        return self._make_view(positions)
+
+    def _get_bank_rows(self, item, bank_index, rows):
+        """
+        Get (physical) rows of a bank, in the human format.
+        """
+        array = _take(getattr(self, "_" + item)[bank_index], rows)
+        if item == "inputs":
+            return self._decode_inputs(bank_index, array)
+        elif item == "labels":
+            return self._label_vocab[bank_index][array]
+        return array
+
+    def _make_view(self, positions):
+        """
+        Make a new Dataset of the patterns at positions (in dataset
+        order), sharing the banks of this one.
+        """
+        view = Dataset(name=self.name, description=self.description)
+        view._inputs = list(self._inputs)
+        view._targets = list(self._targets)
+        view._labels = list(self._labels)
+        view._label_vocab = list(self._label_vocab)
+        view._input_scales = dict(self._input_scales)
+        view._augmentations = list(self._augmentations)
+        view._set_index(self._get_index()[positions])
+        view._cache_values()
+        return view
+
+    def _get_hash_banks(self, targets=False):
+        """
+        The banks that make up the content of a pattern: the inputs,
+        and the targets too if targets is True.
+        """
+        return self._inputs + (self._targets if targets else [])
+
+    def _is_hash_index_current(self, targets):
+        entry = self._hash_indices.get(targets)
+        banks = self._get_hash_banks(targets)
+        return (entry is not None and len(entry[0]) == len(banks) and
+                all(ref() is bank for (ref, bank) in zip(entry[0], banks)))
+
+    def _get_hash_index(self, targets=False):
+        """
+        Get the content-hash index of the patterns: (rows, hashes), the
+        (physical) rows sorted by the hash of their content, and those
+        hashes, in the same order. The hashes are computed once, chunk
+        by chunk; rows appended later are hashed and added to them, and
+        they are recomputed only if the banks are replaced.
+        """
+        if not self._is_hash_index_current(targets):
+            self._hash_indices[targets] = ([], np.zeros(0, np.uint64), None)
+            self._extend_hash_index(targets, 0)
+        (refs, hashes, index) = self._hash_indices[targets]
+        if index is None:
+            order = np.argsort(hashes, kind="stable")
+            index = (order, hashes[order])
+            self._hash_indices[targets] = (refs, hashes, index)
+        return index
+
+    def _extend_hash_index(self, targets, start):
+        """
+        Hash the (physical) rows from start on, and add them to the
+        hash index.
+        """
+        banks = self._get_hash_banks(targets)
+        hashes = [self._hash_indices[targets][1][:start]]
+        step = min([_chunk_rows(bank) for bank in banks])
+        for i in range(start, _num_rows(banks[0]), step):
+            hashes.append(_row_hashes([_take(bank, py_slice(i, i + step)) for bank in banks]))
+        self._hash_indices[targets] = ([weakref.ref(bank) for bank in banks],
+                                       np.concatenate(hashes), None)
+
+    def _get_positions(self, rows):
+        """
+        Get the positions (in dataset order) of (physical) rows, sorted;
+        rows not in the dataset are dropped.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        if self._index is None:
+            return np.sort(rows)
+        if self._index_inverse is None or self._index_inverse[0]() is not self._index:
+            inverse = np.full(self._index_rows, -1, dtype=np.intp)
+            inverse[self._index] = np.arange(len(self._index))
+            self._index_inverse = (weakref.ref(self._index), inverse)
+        inverse = self._index_inverse[1]
+        positions = inverse[rows[rows < len(inverse)]]
+        return np.sort(positions[positions >= 0])
+
+    def find(self, inputs, targets=None):
+        """
+        Find the positions (in dataset order) of the patterns with the
+        given inputs (and targets, if given). inputs is a pattern (or a
+        list of patterns, one per bank) in the human format. Uses a hash
+        index of the patterns (see Dataset.duplicates()), so each lookup
+        takes constant time.
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=[[0, 1], [1, 1], [0, 1], [1, 0]], targets=[[1], [0], [0], [1]])
+        >>> ds.find([0, 1])
+        [0, 2]
+        >>> ds.find([0, 1], [0])
+        [2]
+        >>> ds.append([0, 1], [1])
+        >>> ds.find([0, 1])
+        [0, 2, 4]
+        >>> ds.find([5, 5])
+        []
+        >>> ds = Dataset()
+        >>> ds.load(inputs=np.array([[0, 1], [1, 1]], "int32"), targets=[[1], [0]])
+        >>> ds.find([0, 1]), ds.find([0.7, 1.2])
+        ([0], [])
+        """
+        patterns = [inputs] if len(self._inputs) == 1 else list(inputs)
+        if targets is not None:
+            patterns += [targets] if len(self._targets) == 1 else list(targets)
+        banks = self._get_hash_banks(targets is not None)
+        if len(banks) == 0 or len(patterns) != len(banks):
+            return []
+        rows = []
+        for (b, (pattern, bank)) in enumerate(zip(patterns, banks)):
+            pattern = np.asarray(pattern)
+            if pattern.size != int(np.prod(bank.shape[1:])):
+                return []
+            pattern = pattern.reshape((1,) + bank.shape[1:])
+            if b < len(self._inputs) and b in self._input_scales:
+                pattern = self._encode_inputs(b, pattern)
+            elif bank.dtype.kind in "biu":
+                ## an integer bank can't hold a fractional (or out of
+                ## range) pattern, rather than holding it truncated:
+                if not np.array_equal(pattern.astype(bank.dtype), pattern):
+                    return []
+            rows.append(pattern.astype(bank.dtype))
+        (order, hashes) = self._get_hash_index(targets is not None)
+        key = _row_hashes(rows)[0]
+        candidates = order[np.searchsorted(hashes, key, "left"):np.searchsorted(hashes, key, "right")]
+        matches = [row for row in candidates
+                   if all(np.array_equal(_take(bank, row), pattern[0]) for (bank, pattern) in zip(banks, rows))]
+        return self._get_positions(matches).tolist()
+
+    def duplicates(self, targets=False):
+        """
+        Report the duplicate patterns: a list of lists of positions (in
+        dataset order) of patterns with the same inputs (and targets,
+        if targets is True).
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=[[0, 1], [1, 1], [0, 1], [1, 0], [1, 1]], targets=[[1], [0], [0], [1], [0]])
+        >>> ds.duplicates()
+        [[0, 2], [1, 4]]
+        >>> ds.duplicates(targets=True)
+        [[1, 4]]
+        """
+        if self._stream is not None:
+            raise Exception("can't find duplicates in a streaming dataset")
+        if len(self._inputs) == 0:
+            return []
+        (order, hashes) = self._get_hash_index(targets)
+        ## runs of rows with the same hash, of two or more rows:
+        bounds = np.flatnonzero(np.concatenate([[True], hashes[1:] != hashes[:-1], [True]]))
+        runs = np.flatnonzero(np.diff(bounds) > 1)
+        banks = self._get_hash_banks(targets)
+        groups = []
+        for (start, stop) in zip(bounds[runs], bounds[runs + 1]):
+            rows = np.sort(order[start:stop])
+            ## split rows whose hashes collide, by their actual content:
+            content = _row_bytes([_take(bank, rows) for bank in banks])
+            (unique, inverse) = np.unique(content, axis=0, return_inverse=True)
+            for i in range(len(unique)):
+                groups.append(self._get_positions(rows[inverse.reshape(-1) == i]))
+        return sorted([group.tolist() for group in groups if len(group) > 1])
+
+    def dedupe(self, targets=False):
+        """
+        Remove the duplicate patterns (see Dataset.duplicates()), keeping
+        the first of each. Like shuffle(), this only changes the order
+        of the dataset; the banks are not rewritten.
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=[[0, 1], [1, 1], [0, 1], [1, 0], [1, 1]], targets=[[1], [0], [0], [1], [0]])
+        >>> ds.dedupe()
+        >>> ds.inputs[:]
+        [[0.0, 1.0], [1.0, 1.0], [1.0, 0.0]]
+        """
+        groups = self.duplicates(targets)
+        if len(groups) == 0:
+            return
+        keep = np.ones(self._get_size(), dtype=bool)
+        for group in groups:
+            keep[group[1:]] = False
+        self._set_index(self._get_index()[keep])
+        self._cache_values()
+
+    def materialize(self, directory=None):
+        """
+        Rewrite the banks so that they are in dataset order (applying
+        any shuffle or random split), copying the patterns of a
+        concatenated dataset into ordinary banks. The banks are
+        gathered into memory, or, if directory is given, into .npy
+        files there, chunk by chunk, which are then used as
+        memory-mapped banks. The files that memory-mapped banks were
+        loaded from are left untouched.
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=[[i] for i in range(10)], targets=[[i] for i in range(10)])
+        >>> ds.shuffle()
+        >>> order = ds.inputs[:]
+        >>> ds.materialize()
+        >>> ds._index is None
+        True
+        >>> ds.inputs[:] == order
+        True
+        """
+        if self._index is None and not self._is_concat():
+            return
+        rows = self._index
+        self._index = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        for item in ["inputs", "targets", "labels"]:
+            banks = []
+            for (i, bank) in enumerate(getattr(self, "_" + item)):
+                filename = (None if directory is None else
+                            os.path.join(directory, "%s_%d.npy" % (item, i)))
+                banks.append(self._gather_bank(bank, rows, filename))
+            setattr(self, "_" + item, banks)
+        self._cache_values()
+
+    def _gather_bank(self, bank, rows, filename=None):
+        """
+        Gather the rows of a bank, in order, into memory. If filename
+        is given, they are instead written to that .npy file in chunks,
+        and returned memory-mapped. The bank itself (and any file it
+        is mapped from) is never changed. rows of None means all of them.
+        """
+        if filename is None:
+            return bank[py_slice(None) if rows is None else rows]
+        ## write to temp file, as bank may be a view of filename:
+        _memmap_copy(bank, filename + ".tmp", rows)
+        os.replace(filename + ".tmp", filename)
+        return np.load(filename, mmap_mode="r+")
+
+    def split(self, split=None, random=False, stratify=False):
         """Splits the inputs/targets into training and validation sets.
         The split keyword parameter specifies what portion of the dataset
         to use for validation. It can be a fraction in the range
@@ -1171,7 +3957,28 @@ class Dataset():
         as 'all' or an int equal to the dataset size) is a special
         case in which the entire dataset is used for both training and
         validation.
+
+        If random is True, the validation patterns are picked at random,
+        rather than from the end; both sets keep their relative order.
+        If stratify is True, they are also picked so that each label
+        has its share of the validation set. No data is moved; only the
+        dataset order changes.
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=[[i] for i in range(10)], targets=[[i] for i in range(10)])
+        >>> ds.split(0.3, random=True)
+        >>> ds.split()
+        (7, 3)
+        >>> sorted(ds.train_inputs[:] + ds.test_inputs[:]) == [[float(i)] for i in range(10)]
+        True
+        >>> ds.load(inputs=[[i] for i in range(10)], targets=[[i] for i in range(10)],
+        ...         labels=["a"] * 8 + ["b"] * 2)
+        >>> ds.split(0.5, stratify=True)
+        >>> sorted(ds.test_labels.counts().items())
+        [('a', 4), ('b', 1)]
         """
+        if self._stream is not None:
+            return self._split_stream(split)
         if split is None:
             size, num_train, num_test = self._get_split_sizes()
             return (num_train, num_test)
@@ -1189,6 +3996,116 @@ class Dataset():
             self._split = split
         else:
             raise Exception("invalid split: %s" % split)
+        if stratify and 0 < self._split < 1:
+            size, num_train, num_test = self._get_split_sizes()
+            test = np.zeros(size, dtype=bool)
+            test[self._stratified_sample(num_test)] = True
+            index = self._get_index()
+            self._set_index(np.concatenate([index[~test], index[test]]))
+        elif random and 0 < self._split < 1:
+            size, num_train, num_test = self._get_split_sizes()
+            test = np.zeros(size, dtype=bool)
+            test[np.random.choice(size, num_test, replace=False)] = True
+            index = self._get_index()
+            self._set_index(np.concatenate([index[~test], index[test]]))
+
+    def _get_label_groups(self):
+        """
+        Get the positions of the patterns of each label (of the first
+        label bank), as a list of arrays.
+        """
+        if len(self._labels) == 0:
+            raise Exception("stratifying requires labels")
+        order, bounds = self._get_label_index(0)
+        return [order[bounds[c]:bounds[c + 1]] for c in range(len(bounds) - 1)]
+
+    def _stratified_sample(self, count):
+        """
+        Pick count random positions, with each label getting its share
+        (largest remainder rounding).
+        """
+        groups = self._get_label_groups()
+        sizes = np.array([len(group) for group in groups])
+        quotas = sizes * count / sizes.sum()
+        counts = np.floor(quotas).astype(int)
+        extra = count - counts.sum()
+        counts[np.argsort(counts - quotas, kind="mergesort")[:extra]] += 1
+        return np.concatenate([np.random.choice(group, n, replace=False)
+                               for (group, n) in zip(groups, counts)] + [np.zeros(0, int)])
+
+    def kfold(self, k, stratify=True, shuffle=True):
+        """
+        Make k train/test folds for cross-validation. Returns a list of
+        k Datasets; each shares the banks of this one (nothing is
+        copied), and is split so that its test patterns are one fold,
+        and its train patterns are the rest.
+
+        If stratify is True (and there are labels), each label has its
+        share of each fold. If shuffle is True, the folds are picked at
+        random; otherwise, in order.
+
+        >>> ds = Dataset()
+        >>> ds.load(inputs=[[i] for i in range(12)], targets=[[i] for i in range(12)],
+        ...         labels=["a"] * 9 + ["b"] * 3)
+        >>> folds = ds.kfold(3)
+        >>> [fold.split() for fold in folds]
+        [(8, 4), (8, 4), (8, 4)]
+        >>> [fold.test_labels.counts()["b"] for fold in folds]
+        [1, 1, 1]
+        >>> sorted(sum([fold.test_inputs[:] for fold in folds], [])) == ds.inputs[:]
+        True
+        >>> folds[0]._inputs[0] is ds._inputs[0]
+        True
+        """
+        size = self._get_size()
+        if not isinstance(k, numbers.Integral) or not 2 <= k <= size:
+            raise Exception("k must be an integer from 2 to the dataset size: %s" % (k,))
+        if stratify and len(self._labels) > 0:
+            groups = self._get_label_groups()
+        else:
+            groups = [np.arange(size)]
+        ## deal the patterns of each group out to the folds in turn:
+        folds = np.empty(size, int)
+        offset = 0
+        for group in groups:
+            if shuffle:
+                group = np.random.permutation(group)
+            folds[group] = (np.arange(len(group)) + offset) % k
+            offset += len(group)
+        if not shuffle and not (stratify and len(self._labels) > 0):
+            folds = np.arange(size) * k // size ## contiguous blocks
+        retval = []
+        for fold in range(k):
+            test = np.flatnonzero(folds == fold)
+            view = self._make_view(np.concatenate([np.flatnonzero(folds != fold), test]))
+            view._split = len(test) / size
+            retval.append(view)
+        return retval
+
+    def _split_stream(self, split=None):
+        """
+        Split a streaming dataset. Sizes are in batches, rather than
+        patterns, and only a Sequence can be split.
+        """
+        if split is None:
+            (train, num_train), (test, num_test) = self._get_batch_split()
+            return (num_train, num_test)
+        if self._validation_stream is not None:
+            raise Exception("dataset already has a validation stream")
+        if split != 0 and not isinstance(self._stream, Sequence):
+            raise Exception("only a Sequence stream can be split; use load_stream(..., validation=...)")
+        if split == 'all':
+            self._split = 1.0
+        elif isinstance(split, numbers.Integral):
+            if not 0 <= split <= len(self._stream):
+                raise Exception("split out of range: %d" % split)
+            self._split = split/len(self._stream)
+        elif isinstance(split, numbers.Real):
+            if not 0 <= split < 1:
+                raise Exception("split is not in the range [0,1): %s" % split)
+            self._split = split
+        else:
+            raise Exception("invalid split: %s" % split)
 
     def _get_split_sizes(self):
         # need a more elegant name for this method
@@ -1199,7 +4116,8 @@ class Dataset():
         if self._split == 1:
             train_set_size, test_set_size = dataset_size, dataset_size
         else:
-            test_set_size = int(self._split * dataset_size)
+            ## (allow for rounding, when split was a count of patterns)
+            test_set_size = int(self._split * dataset_size + 1e-9)
             train_set_size = dataset_size - test_set_size
         return (dataset_size, train_set_size, test_set_size)
 
@@ -1207,7 +4125,7 @@ class Dataset():
         size, num_train, num_test = self._get_split_sizes()
         # self._inputs and self._targets are lists of numpy arrays
         train_inputs, train_targets, test_inputs, test_targets = [], [], [], []
-        for inputs, targets in zip(self._inputs, self._targets):
+        for (inputs, targets) in zip(*self._get_keras_banks()):
             train_inputs.append(inputs[:num_train])
             train_targets.append(targets[:num_train])
             test_inputs.append(inputs[size - num_test:])
@@ -1247,10 +4165,13 @@ class Dataset():
         else:
             raise Exception("invalid value: %s" % (amount,))
         new_size = self._get_size() - amount
-        self._inputs = [self._inputs[b][:new_size] for b in range(self._num_input_banks())]
-        self._targets = [self._targets[b][:new_size] for b in range(self._num_target_banks())]
-        if len(self._labels) != 0:
-            self._labels = [self._labels[b][:new_size] for b in range(self._num_target_banks())]
+        if self._index is not None or self._is_concat(): ## narrow the order, rather than copy
+            self._set_index(self._get_index()[:new_size])
+        else:
+            self._inputs = [self._inputs[b][:new_size] for b in range(self._num_input_banks())]
+            self._targets = [self._targets[b][:new_size] for b in range(self._num_target_banks())]
+            if len(self._labels) != 0:
+                self._labels = [self._labels[b][:new_size] for b in range(self._num_target_banks())]
         if self._split > 0:
             print("WARNING: dataset split reset to 0", file=sys.stderr)
         self._split = 0
@@ -1264,7 +4185,7 @@ class Dataset():
         if not 0 <= i < size:
             raise Exception("input index %d is out of bounds" % (i,))
         else:
-            data = [self._tolist(self._inputs[b][i], "inputs", b) for b in range(self._num_input_banks())]
+            data = [self._tolist(self._decode_inputs(b, _take(self._inputs[b], self._row(i))), "inputs", b) for b in range(self._num_input_banks())]
         if self._num_input_banks() == 1:
             return data[0]
         else:
@@ -1310,7 +4231,7 @@ class Dataset():
         size = self._get_size()
         if not 0 <= i < size:
             raise Exception("target index %d is out of bounds" % (i,))
-        data = [self._tolist(self._targets[b][i], "targets", b) for b in range(self._num_target_banks())]
+        data = [self._tolist(_take(self._targets[b], self._row(i)), "targets", b) for b in range(self._num_target_banks())]
         if self._num_target_banks() == 1:
             return data[0]
         else:
@@ -1324,7 +4245,7 @@ class Dataset():
         size = self._get_size()
         if not 0 <= i < size:
             raise Exception("label index %d is out of bounds" % (i,))
-        data = [self._labels[b][i] for b in range(self._num_target_banks())]
+        data = [self._label_vocab[b][self._labels[b][self._row(i)]] for b in range(self._num_target_banks())]
         if self._num_target_banks() == 1:
             return data[0]
         else:
@@ -1338,7 +4259,7 @@ class Dataset():
         size, num_train, num_test = self._get_split_sizes()
         if not 0 <= i < num_train:
             raise Exception("training input index %d is out of bounds" % (i,))
-        data = [self._tolist(self._inputs[b][i], "train_inputs", b) for b in range(self._num_input_banks())]
+        data = [self._tolist(self._decode_inputs(b, _take(self._inputs[b], self._row(i))), "train_inputs", b) for b in range(self._num_input_banks())]
         if self._num_input_banks() == 1:
             return data[0]
         else:
@@ -1352,7 +4273,7 @@ class Dataset():
         size, num_train, num_test = self._get_split_sizes()
         if not 0 <= i < num_train:
             raise Exception("training target index %d is out of bounds" % (i,))
-        data = [self._tolist(self._targets[b][i], "train_targets", b) for b in range(self._num_target_banks())]
+        data = [self._tolist(_take(self._targets[b], self._row(i)), "train_targets", b) for b in range(self._num_target_banks())]
         if self._num_target_banks() == 1:
             return data[0]
         else:
@@ -1366,7 +4287,7 @@ class Dataset():
         size, num_train, num_test = self._get_split_sizes()
         if not 0 <= i < num_train:
             raise Exception("training label index %d is out of bounds" % (i,))
-        data = [self._labels[b][i] for b in range(self._num_target_banks())]
+        data = [self._label_vocab[b][self._labels[b][self._row(i)]] for b in range(self._num_target_banks())]
         if self._num_target_banks() == 1:
             return data[0]
         else:
@@ -1381,7 +4302,7 @@ class Dataset():
         if not 0 <= i < num_test:
             raise Exception("test input index %d is out of bounds" % (i,))
         j = size - num_test + i
-        data = [self._tolist(self._inputs[b][j], "test_inputs", b) for b in range(self._num_input_banks())]
+        data = [self._tolist(self._decode_inputs(b, _take(self._inputs[b], self._row(j))), "test_inputs", b) for b in range(self._num_input_banks())]
         if self._num_input_banks() == 1:
             return data[0]
         else:
@@ -1396,7 +4317,7 @@ class Dataset():
         if not 0 <= i < num_test:
             raise Exception("test target index %d is out of bounds" % (i,))
         j = size - num_test + i
-        data = [self._tolist(self._targets[b][j], "test_targets", b) for b in range(self._num_target_banks())]
+        data = [self._tolist(_take(self._targets[b], self._row(j)), "test_targets", b) for b in range(self._num_target_banks())]
         if self._num_target_banks() == 1:
             return data[0]
         else:
@@ -1411,7 +4332,7 @@ class Dataset():
         if not 0 <= i < num_test:
             raise Exception("test label index %d is out of bounds" % (i,))
         j = size - num_test + i
-        data = [self._labels[b][j] for b in range(self._num_target_banks())]
+        data = [self._label_vocab[b][self._labels[b][self._row(j)]] for b in range(self._num_target_banks())]
         if self._num_target_banks() == 1:
             return data[0]
         else:
@@ -1442,6 +4363,16 @@ class Dataset():
         else:
             return len(self._target_shapes)
 
+    def _target_matches(self, output_shape, target_shape):
+        """
+        Does a target of target_shape fit an output of output_shape? With
+        sparse_categorical_crossentropy, a target is a single class index.
+        """
+        if tuple(output_shape) == tuple(target_shape):
+            return True
+        return (self.network is not None and self.network._uses_sparse_targets() and
+                tuple(target_shape) in [(), (1,)])
+
     def _get_size(self):
         """
         Returns the total number of patterns/targets in the dataset
@@ -1450,7 +4381,29 @@ class Dataset():
         >>> ds._get_size()
         0
         """
-        if len(self._inputs) > 0:
-            return self._inputs[0].shape[0]
+        if self._index is not None:
+            return len(self._index)
+        elif len(self.__dict__["_inputs"]) > 0: ## pending transforms keep the size
+            return self.__dict__["_inputs"][0].shape[0]
         else:
             return 0
+
+    def _get_index(self):
+        """
+        Get the array of (physical) bank rows, in dataset order.
+        """
+        if self._index is not None:
+            return self._index
+        elif len(self._inputs) > 0:
+            return np.arange(_num_rows(self._inputs[0]))
+        else:
+            return np.arange(0)
+
+    def _row(self, i):
+        """
+        Get the (physical) bank row of pattern i.
+        """
+        if self._index is not None:
+            return self._index[i]
+        else:
+            return i
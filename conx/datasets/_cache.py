@@ -0,0 +1,125 @@
+# conx - a neural network library
+#
+# Copyright (c) 2016-2017 Douglas S. Blank <dblank@cs.brynmawr.edu>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA 02110-1301  USA
+
+import os
+import json
+import glob
+import shutil
+import hashlib
+import inspect
+import functools
+import numpy as np
+
+## Bump to invalidate all cached datasets (eg, when the format changes):
+CACHE_VERSION = 3
+
+def get_cache_dir():
+    """
+    Directory of the preprocessed dataset cache. Set the environment
+    variable CONX_CACHE_DIR to use a different one.
+    """
+    return os.environ.get("CONX_CACHE_DIR",
+                          os.path.join(os.path.expanduser("~"), ".conx", "datasets"))
+
+def _cache_key(function, version, dataset, args, kwargs):
+    """
+    The cache entry name of a call of a loader. The arguments are
+    matched to the loader's parameters (with their defaults), so that
+    the same call spelled differently gets the same entry.
+    """
+    import keras.backend as K
+    arguments = inspect.signature(function).bind(dataset, *args, **kwargs)
+    arguments.apply_defaults()
+    parameters = sorted(list(arguments.arguments.items())[1:]) ## all but the dataset
+    key = json.dumps([function.__name__, CACHE_VERSION, version, K.image_data_format(),
+                      repr(parameters)])
+    return "%s-%s" % (function.__name__, hashlib.sha1(key.encode("utf-8")).hexdigest()[:12])
+
+def cached(version=1):
+    """
+    Decorator for a dataset loader. The first call writes the finished
+    banks to .npy files in the cache; later calls with the same
+    arguments memory-map them instead of running the loader. Bump
+    version when the loader's output changes.
+
+    The decorated loader takes an extra keyword, force_refresh, to
+    run the loader and rewrite the cache.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def loader(dataset, *args, force_refresh=False, **kwargs):
+            directory = os.path.join(get_cache_dir(),
+                                     _cache_key(function, version, dataset, args, kwargs))
+            if force_refresh or not os.path.exists(os.path.join(directory, "meta.json")):
+                function(dataset, *args, **kwargs)
+                _write_cache(dataset, directory, function.__name__)
+            _read_cache(dataset, directory)
+        return loader
+    return decorator
+
+def _write_cache(dataset, directory, loader):
+    tmp = directory + ".tmp%d" % os.getpid()
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for (item, banks) in [("inputs", dataset._inputs),
+                          ("targets", dataset._targets),
+                          ("labels", dataset._labels)]:
+        for i in range(len(banks)):
+            np.save(os.path.join(tmp, "%s_%d.npy" % (item, i)), banks[i])
+    dataset._save_input_scales(tmp)
+    dataset._save_label_vocab(tmp)
+    ## so that reading the cache doesn't rescan the banks:
+    dataset._save_bank_stats(tmp)
+    with open(os.path.join(tmp, "meta.json"), "w") as fp:
+        json.dump({"loader": loader,
+                   "name": dataset.name,
+                   "description": dataset.description}, fp)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp, directory)
+
+def _read_cache(dataset, directory):
+    with open(os.path.join(directory, "meta.json")) as fp:
+        meta = json.load(fp)
+    ## copy-on-write, so that changes to the dataset never reach the cache:
+    dataset.load_memmap(directory, mode="c")
+    dataset.name = meta["name"]
+    dataset.description = meta["description"]
+
+def cache_info():
+    """
+    Return a list of (entry, loader, bytes), one for each dataset in
+    the cache.
+    """
+    entries = []
+    for meta in sorted(glob.glob(os.path.join(get_cache_dir(), "*", "meta.json"))):
+        directory = os.path.dirname(meta)
+        with open(meta) as fp:
+            loader = json.load(fp)["loader"]
+        size = sum(os.path.getsize(filename)
+                   for filename in glob.glob(os.path.join(directory, "*")))
+        entries.append((os.path.basename(directory), loader, size))
+    return entries
+
+def clear_cache(loader=None):
+    """
+    Remove all cached datasets, or just those of one loader.
+    """
+    for (entry, name, size) in cache_info():
+        if loader is None or name == loader:
+            shutil.rmtree(os.path.join(get_cache_dir(), entry), ignore_errors=True)
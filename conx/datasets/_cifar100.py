@@ -1,15 +1,24 @@
 import numpy as np
 from keras.utils import to_categorical
 
-def cifar100(dataset):
+from ._cache import cached
+
+@cached()
+def cifar100(dataset, sparse_targets=False):
+    """
+    Load the Keras CIFAR-100 dataset. With sparse_targets, the targets
+    are integer classes (for sparse_categorical_crossentropy), rather
+    than one-hot vectors.
+    """
     from keras.datasets import cifar100
     (x_train, y_train), (x_test, y_test) = cifar100.load_data()
     inputs = np.concatenate((x_train, x_test))
     labels = np.concatenate((y_train, y_test))
-    targets = to_categorical(labels, 100)
-    labels = np.array([str(label[0]) for label in labels], dtype=str)
-    inputs = inputs.astype('float32')
-    inputs /= 255
+    if sparse_targets:
+        targets = labels.astype("int16")
+    else:
+        targets = to_categorical(labels, 100)
+    labels = labels[:, 0].astype(str)
     dataset.name = "CIFAR-100"
     dataset.description = """
 Original source: https://www.cs.toronto.edu/~kriz/cifar.html
@@ -45,3 +54,4 @@ vehicles 2                     | lawn-mower, rocket, streetcar, tank, tractor
 
 """
     dataset.load_direct([inputs], [targets], [labels])
+    dataset.set_input_scale(0, 1/255)
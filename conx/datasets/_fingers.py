@@ -4,8 +4,8 @@ def fingers(dataset, path='fingers.npz'):
     inputs, labels = load_dataset_npz(
         path,
         "https://raw.githubusercontent.com/Calysto/conx/master/data/fingers.npz")
-    inputs = inputs.astype('float32')
-    inputs /= 255
+    if inputs.dtype != np.uint8: ## pixels are kept as uint8, in [0, 255]
+        inputs = np.clip(np.round(inputs), 0, 255).astype('uint8')
     make_target_vector = lambda label: [int(label == n) for n in range(6)]
     targets = np.array([make_target_vector(l) for l in labels]).astype('uint8')
     dataset.name = "Fingers"
@@ -21,6 +21,7 @@ categories "zero" through "five".  There are 2000 images for each category.
 Created by Shreeda Segan and Albert Yu at Sarah Lawrence College.
 """
     dataset.load_direct([inputs], [targets], [labels])
+    dataset.set_input_scale(0, 1/255)
 
 
 def load_dataset_npz(path, url):
@@ -1,9 +1,14 @@
 import numpy as np
 from keras.utils import to_categorical
 
-def mnist(dataset):
+from ._cache import cached
+
+@cached()
+def mnist(dataset, sparse_targets=False):
     """
-    Load the Keras MNIST dataset and format it as images.
+    Load the Keras MNIST dataset and format it as images. With
+    sparse_targets, the targets are integer classes (for
+    sparse_categorical_crossentropy), rather than one-hot vectors.
     """
     from keras.datasets import mnist
     import keras.backend as K
@@ -21,14 +26,13 @@ def mnist(dataset):
         x_train = x_train.reshape(x_train.shape[0], img_rows, img_cols, 1)
         x_test = x_test.reshape(x_test.shape[0], img_rows, img_cols, 1)
         input_shape = (img_rows, img_cols, 1)
-    x_train = x_train.astype('float32')
-    x_test = x_test.astype('float32')
-    x_train /= 255
-    x_test /= 255
     inputs = np.concatenate((x_train,x_test))
     labels = np.concatenate((y_train,y_test))
-    targets = to_categorical(labels)
-    labels = np.array([str(label) for label in labels], dtype=str)
+    if sparse_targets:
+        targets = labels.astype("int16").reshape(-1, 1)
+    else:
+        targets = to_categorical(labels)
+    labels = labels.astype(str)
     dataset.name = "MNIST"
     dataset.description = """
 Original source: http://yann.lecun.com/exdb/mnist/
@@ -44,3 +48,5 @@ nine.  Some example MNIST images are shown below:
 ![MNIST Images](https://github.com/Calysto/conx/raw/master/data/mnist_images.png)
 """
     dataset.load_direct([inputs], [targets], [labels])
+    ## pixels are kept as uint8, and scaled to [0, 1] for Keras:
+    dataset.set_input_scale(0, 1/255)
@@ -41,6 +41,7 @@ from typing import Any
 
 import PIL
 import numpy as np
+import scipy.sparse
 import matplotlib.pyplot as plt
 import keras
 from keras.callbacks import Callback, History
@@ -48,7 +49,7 @@ import keras.backend as K
 
 from .utils import *
 from .layers import Layer
-from .dataset import Dataset
+from .dataset import Dataset, SimilarityIndex, Sampler
 
 try:
     from IPython import get_ipython
@@ -788,30 +789,43 @@ class Network():
         Test a dataset.
         """
         tolerance = tolerance if tolerance is not None else self.tolerance
+        if self.dataset._is_batched():
+            return self._test_batches(batch_size, show, tolerance, force, show_inputs,
+                                      show_outputs, filter, interactive)
         if len(self.dataset.inputs) == 0:
             raise Exception("nothing to test")
         length = len(self.dataset.train_targets)
-        if self.dataset._split == 1.0: ## special case; use entire set
-            inputs = self.dataset._inputs
-            targets = self.dataset._targets
-        else:
+        inputs, targets = self.dataset._get_keras_banks()
+        if self.dataset._split != 1.0: ## 1.0 is a special case; use entire set
             ## need to split; check format based on output banks:
-            targets = [column[:length] for column in self.dataset._targets]
-            inputs = [column[:length] for column in self.dataset._inputs]
+            targets = [column[:length] for column in targets]
+            inputs = [column[:length] for column in inputs]
         if interactive:
             self._test(inputs, targets, "validation dataset", batch_size, show,
                        tolerance, force, show_inputs, show_outputs, filter, interactive)
         else:
             results = self._test(inputs, targets, "validation dataset", batch_size, show,
                                  tolerance, force, show_inputs, show_outputs, filter, interactive)
-            categories = {}
-            for i in range(length):
-                label = "%s (%s)" % (self.dataset.labels[i],
-                                     "correct" if results[i] else "wrong")
-                if not label in categories:
-                    categories[label] = []
-                categories[label].append(self.dataset.inputs[i])
-            return sorted(categories.items())
+            return self._get_categories(results)
+
+    def _get_categories(self, results, inputs=None):
+        """
+        Group the tested patterns by "label (correct)" or "label (wrong)",
+        as a sorted list of (category, [input, ...]). inputs defaults to
+        the dataset's inputs; without labels, the category is just
+        "correct" or "wrong".
+        """
+        categories = {}
+        for i in range(len(results)):
+            result = "correct" if results[i] else "wrong"
+            if len(self.dataset._labels) > 0:
+                label = "%s (%s)" % (self.dataset.labels[i], result)
+            else:
+                label = result
+            if not label in categories:
+                categories[label] = []
+            categories[label].append(self.dataset.inputs[i] if inputs is None else inputs[i])
+        return sorted(categories.items())
 
     def _test(self, inputs, targets, dataset, batch_size=32, show=False,
               tolerance=None, force=False,
@@ -861,56 +875,100 @@ class Network():
             ## keras returns outputs as a single column
             ## conx targets are always multi-column
             correct = self.compute_correct([outputs], targets, tolerance)
-        count = len(correct)
         if show:
-            if show_inputs:
-                in_formatted = self.pf_matrix(inputs, force)
-                count = len(in_formatted)
-            if show_outputs:
-                targ_formatted = self.pf_matrix(targets, force)
-                out_formatted = self.pf_matrix(outputs, force)
-                count = len(out_formatted)
-            header = "# | "
-            if show_inputs:
-                header += "inputs | "
-            if show_outputs:
-                header += "targets | outputs | "
-            header += "result"
-            print(header)
-            print("---------------------------------------")
-            for i in range(count):
-                show_it = ((filter == "all") or
-                           (filter == "correct" and correct[i]) or
-                           (filter == "incorrect" and not correct[i]))
-                if show_it:
-                    line = "%d | " % i
-                    if show_inputs:
-                        line += "%s | " % in_formatted[i]
-                    if show_outputs:
-                        line += "%s | %s | " % (targ_formatted[i], out_formatted[i])
-                    line += "correct" if correct[i] else "X"
-                    print(line)
+            self._show_test_results(inputs, targets, outputs, correct, force,
+                                    show_inputs, show_outputs, filter)
         if interactive:
-            print("Total count:", len(correct))
-            print("      correct:", len([c for c in correct if c]))
-            print("      incorrect:", len([c for c in correct if not c]))
-            print("Total percentage correct:", list(correct).count(True)/len(correct))
+            self._show_test_summary(correct)
         else:
             return list(correct)
 
+    def _show_test_results(self, inputs, targets, outputs, correct, force=False,
+                           show_inputs=True, show_outputs=True, filter="all"):
+        """
+        Print the table of tested patterns, one row per pattern.
+        """
+        count = len(correct)
+        if show_inputs:
+            in_formatted = self.pf_matrix(inputs, force)
+            count = len(in_formatted)
+        if show_outputs:
+            targ_formatted = self.pf_matrix(targets, force)
+            out_formatted = self.pf_matrix(outputs, force)
+            count = len(out_formatted)
+        header = "# | "
+        if show_inputs:
+            header += "inputs | "
+        if show_outputs:
+            header += "targets | outputs | "
+        header += "result"
+        print(header)
+        print("---------------------------------------")
+        for i in range(count):
+            show_it = ((filter == "all") or
+                       (filter == "correct" and correct[i]) or
+                       (filter == "incorrect" and not correct[i]))
+            if show_it:
+                line = "%d | " % i
+                if show_inputs:
+                    line += "%s | " % in_formatted[i]
+                if show_outputs:
+                    line += "%s | %s | " % (targ_formatted[i], out_formatted[i])
+                line += "correct" if correct[i] else "X"
+                print(line)
+
+    def _show_test_summary(self, correct):
+        """
+        Print the counts of correct and incorrect tested patterns.
+        """
+        print("Total count:", len(correct))
+        print("      correct:", len([c for c in correct if c]))
+        print("      incorrect:", len([c for c in correct if not c]))
+        print("Total percentage correct:", list(correct).count(True)/len(correct))
+
     def compute_correct(self, outputs, targets, tolerance=None):
         """
         Both are np.arrays. Return [True, ...].
+
+        An integer class target (a single column, against a wider
+        output) is correct when it is the output's largest unit.
+
+        >>> net = Network("Correct", 2, 3)
+        >>> net.compute_correct([np.array([[0.1, 0.7, 0.2], [0.6, 0.3, 0.1]])],
+        ...                     [np.array([[1], [2]])])
+        [True, False]
         """
         tolerance = tolerance if tolerance is not None else self.tolerance
         correct = []
         for r in range(len(outputs[0])):
             row = []
             for c in range(len(outputs)):
-                row.extend(list(map(lambda v: v <= tolerance, np.abs(outputs[c][r] - targets[c][r]))))
+                if np.size(targets[c][r]) == 1 and np.size(outputs[c][r]) > 1: ## class index
+                    row.append(np.argmax(outputs[c][r]) == np.ravel(targets[c][r])[0])
+                else:
+                    row.extend(list(map(lambda v: v <= tolerance, np.abs(outputs[c][r] - targets[c][r]))))
             correct.append(all(row))
         return correct
 
+    def _uses_sparse_targets(self):
+        """
+        Is the network compiled for integer class targets (see
+        sparse_categorical_crossentropy)?
+        """
+        return self.compile_options.get("loss") == "sparse_categorical_crossentropy"
+
+    def _get_target_vector(self, bank_index, target):
+        """
+        A target in the shape of its output layer: integer class targets
+        become one-hot vectors.
+        """
+        layer = self[self.output_bank_order[bank_index]]
+        if np.size(target) == 1 and layer.size not in [None, 1] and self._uses_sparse_targets():
+            vector = np.zeros(layer.size)
+            vector[int(np.ravel(target)[0])] = 1
+            return vector
+        return np.array(target)
+
     def train_one(self, inputs, targets, batch_size=32, update_pictures=False):
         """
         Train on one input/target pair.
@@ -994,11 +1052,11 @@ class Network():
                 targets = targets[0]
         pairs = [(inputs, targets)]
         if self.num_input_layers == 1:
-            ins = np.array([pair[0] for pair in pairs], "float32")
+            ins = np.array([pair[0] for pair in pairs], self._get_input_dtype(0))
         else:
             ins = []
             for i in range(len(pairs[0][0])):
-                ins.append(np.array([pair[0][i] for pair in pairs], "float32"))
+                ins.append(np.array([pair[0][i] for pair in pairs], self._get_input_dtype(i)))
         if self.num_target_layers == 1:
             targs = np.array([pair[1] for pair in pairs], "float32")
         else:
@@ -1030,6 +1088,14 @@ class Network():
                     self.display_component(errors, "errors", minmax=(-1, 1))
         return (outputs, errors)
 
+    def _get_input_dtype(self, bank_index):
+        """
+        The dtype that the Keras input layer of an input bank takes:
+        float32, unless the layer declares one (eg, int32 for an
+        EmbeddingLayer).
+        """
+        return self[self.input_bank_order[bank_index]].params.get("dtype", "float32")
+
     def retrain(self, **overrides):
         """
         Call network.train() again with same options as last call, unless overrides.
@@ -1066,6 +1132,8 @@ class Network():
             >>> net.evaluate()           # doctest: +ELLIPSIS
             {'loss': ..., 'acc': ...}
         """
+        if self.dataset._is_batched():
+            return self._evaluate_batches(batch_size)
         if len(self.dataset.inputs) == 0:
             raise Exception("no dataset loaded")
         if self.model is None:
@@ -1078,12 +1146,86 @@ class Network():
             results.update({"val_"+k: v for k, v in zip(self.model.metrics_names, test_metrics)})
         return results
 
+    def _evaluate_batches(self, batch_size=32, workers=1, max_queue_size=10):
+        """
+        Evaluate the network on the train and validation batches of a
+        batched dataset (see `Dataset._is_batched`), returning a dict
+        of results.
+        """
+        if self.model is None:
+            raise Exception("need to compile network")
+        ((train_stream, train_steps),
+         (validation_stream, validation_steps)) = self.dataset._get_batch_split(batch_size)
+        train_metrics = self.model.evaluate_generator(train_stream, train_steps,
+                                                      workers=workers,
+                                                      max_queue_size=max_queue_size)
+        if not isinstance(train_metrics, list):
+            train_metrics = [train_metrics]
+        results = {k:v for k, v in zip(self.model.metrics_names, train_metrics)}
+        if validation_stream is not None:
+            test_metrics = self.model.evaluate_generator(validation_stream, validation_steps,
+                                                         workers=workers,
+                                                         max_queue_size=max_queue_size)
+            if not isinstance(test_metrics, list):
+                test_metrics = [test_metrics]
+            results.update({"val_"+k: v for k, v in zip(self.model.metrics_names, test_metrics)})
+        return results
+
+    def _test_batches(self, batch_size=32, show=False, tolerance=None, force=False,
+                      show_inputs=True, show_outputs=True, filter="all", interactive=True):
+        """
+        Test the training patterns of a batched dataset (see
+        `Dataset._is_batched`), batch by batch, and report on them all.
+        """
+        ((train_stream, train_steps),
+         (validation_stream, validation_steps)) = self.dataset._get_batch_split(batch_size)
+        if isinstance(train_stream, keras.utils.Sequence):
+            batches = (train_stream[i] for i in range(train_steps))
+        else:
+            batches = (next(train_stream) for i in range(train_steps))
+        all_inputs, all_targets, all_outputs, correct = [], [], [], []
+        for batch in batches:
+            inputs, targets = batch[0], batch[1]
+            if not isinstance(inputs, (list, tuple)): ## a stream's single input bank
+                inputs = [inputs]
+            if not isinstance(targets, (list, tuple)): ## a stream's single target bank
+                targets = [targets]
+            outputs = self.model.predict(inputs, batch_size=batch_size)
+            if self.num_target_layers == 1:
+                outputs = [outputs]
+            correct.extend(self.compute_correct(outputs, targets, tolerance))
+            all_inputs.append(inputs)
+            all_targets.append(targets)
+            all_outputs.append(outputs)
+        if len(correct) == 0:
+            raise Exception("nothing to test")
+        ## join the batches, bank by bank:
+        inputs, targets, outputs = [[np.concatenate(banks) for banks in zip(*batches)]
+                                    for batches in [all_inputs, all_targets, all_outputs]]
+        if interactive:
+            print("=" * 56)
+            print("Testing training dataset with tolerance %.6s..." % (tolerance,))
+        if show:
+            self._show_test_results(inputs, targets,
+                                    outputs if self.num_target_layers > 1 else outputs[0],
+                                    correct, force, show_inputs, show_outputs, filter)
+        if interactive:
+            self._show_test_summary(correct)
+        elif self.dataset._stream is not None:
+            stream_inputs = (np.asarray(inputs[0]).tolist() if len(inputs) == 1 else
+                             [list(row) for row in zip(*[bank.tolist() for bank in inputs])])
+            return self._get_categories(correct, stream_inputs)
+        else:
+            return self._get_categories(correct)
+
     def test_dataset_ranges(self):
         """
         Test the dataset ranges to see if in range of activation functions.
         """
         if len(self.dataset.targets) == 0:
             return # nothing to test
+        if self._uses_sparse_targets():
+            return # targets are class indices
         for index in range(len(self.dataset._targets)):
             if len(self.dataset._targets[index].shape) > 2:
                 print("WARNING: network '%s' target bank #%s has a multi-dimensional shape, which is not allowed" %
@@ -1105,7 +1247,8 @@ class Network():
     def train(self, epochs=1, accuracy=None, error=None, batch_size=32,
               report_rate=1, verbose=1, kverbose=0, shuffle=True, tolerance=None,
               class_weight=None, sample_weight=None, use_validation_to_stop=False,
-              plot=True, record=0, callbacks=None, save=False):
+              plot=True, record=0, callbacks=None, save=False,
+              workers=1, max_queue_size=10):
         """
         Train the network.
 
@@ -1126,8 +1269,10 @@ class Network():
             verbose (int): Level of feedback on training. verbose=0 gives no
                 feedback, but returns (epoch_count, result)
             kverbose (int): Level of feedback from Keras.
-            shuffle (bool or str): Should the training data be shuffled?
-                'batch' shuffles in batch-sized chunks.
+            shuffle (bool, str, or Sampler): Should the training data be shuffled?
+                'batch' shuffles in batch-sized chunks. A Sampler (see
+                `Dataset.sampler`) draws each epoch's patterns, for example
+                balanced across the classes.
             tolerance (float): The maximum difference between target and output
                 that should be considered correct.
             class_weight (float):
@@ -1143,6 +1288,11 @@ class Network():
                 parameters, depending on str.
             save (bool): If `True`, then the network is saved at end, whether
                 interrupted or not.
+            workers (int): Number of threads producing batches, when the
+                dataset is batched (streaming, see `Dataset.load_stream`,
+                or lazily shuffled/split).
+            max_queue_size (int): Maximum number of batches prepared ahead
+                of training, when the dataset is batched.
 
         Returns:
             tuple: (epoch_count, result) if verbose == 0
@@ -1174,6 +1324,8 @@ class Network():
             "record": record,
             "callbacks": callbacks,
             "save": save,
+            "workers": workers,
+            "max_queue_size": max_queue_size,
             }
         if plot:
             import matplotlib
@@ -1189,11 +1341,17 @@ class Network():
         ## Test for targets in range of activation function:
         self.test_dataset_ranges()
         if epochs == 0: return
-        if len(self.dataset.inputs) == 0:
+        batched = self.dataset._is_batched() or isinstance(shuffle, Sampler)
+        if len(self.dataset.inputs) == 0 and not batched:
             print("No training data available")
             return
+        if self.dataset._stream is not None and isinstance(shuffle, Sampler):
+            raise Exception("a Sampler is not available when streaming")
+        if self.dataset._stream is not None and sample_weight is not None:
+            raise Exception("sample_weight is not available when streaming; " +
+                            "yield (inputs, targets, sample_weights) batches instead")
         if use_validation_to_stop:
-            if (self.dataset._split == 0):
+            if not self.dataset._has_validation():
                 print("Attempting to use validation to stop, but Network.dataset.split() is 0")
                 return
             elif ((accuracy is None) and (error is None)):
@@ -1205,26 +1363,51 @@ class Network():
                 raise Exception("tolerance given but unknown accuracy")
             K.set_value(self._tolerance, tolerance)
         ## Going to need evaluation on training set in any event:
-        if self.dataset._split == 1.0: ## special case; use entire set
-            inputs = self.dataset._inputs
-            targets = self.dataset._targets
+        if batched:
+            ((train_stream, train_steps),
+             (validation_stream, validation_steps)) = self.dataset._get_batch_split(
+                 batch_size, shuffle if isinstance(shuffle, Sampler) else shuffle is True,
+                 sample_weight, augment=True)
         else:
-            ## need to split; check format based on output banks:
-            length = len(self.dataset.train_targets)
-            targets = [column[:length] for column in self.dataset._targets]
-            inputs = [column[:length] for column in self.dataset._inputs]
+            dataset_inputs, dataset_targets = self.dataset._get_keras_banks()
+            if self.dataset._split == 1.0: ## special case; use entire set
+                inputs = dataset_inputs
+                targets = dataset_targets
+            else:
+                ## need to split; check format based on output banks:
+                length = len(self.dataset.train_targets)
+                targets = [column[:length] for column in dataset_targets]
+                inputs = [column[:length] for column in dataset_inputs]
         if len(self.history) > 0:
             results = self.history[-1]
         else:
             if verbose > 0:
                 print("Evaluating initial training metrics...")
-            values = self.model.evaluate(inputs, targets, batch_size=batch_size, verbose=0)
+            if batched:
+                values = self.model.evaluate_generator(train_stream, train_steps,
+                                                       workers=workers,
+                                                       max_queue_size=max_queue_size)
+            else:
+                values = self.model.evaluate(inputs, targets, batch_size=batch_size, verbose=0)
             if not isinstance(values, list): # if metrics is just a single value
                 values = [values]
             results = {metric: value for metric,value in zip(self.model.metrics_names, values)}
         results_acc = self._compute_result_acc(results)
         ## look at split, use validation subset:
-        if self.dataset._split == 0.0: ## None
+        if batched and validation_stream is None:
+            val_results = {}
+        elif batched and validation_stream is train_stream:
+            val_results = {"val_%s" % key: results[key] for key in results}
+        elif batched:
+            if verbose > 0:
+                print("Evaluating initial validation metrics...")
+            val_values = self.model.evaluate_generator(validation_stream, validation_steps,
+                                                       workers=workers,
+                                                       max_queue_size=max_queue_size)
+            if not isinstance(val_values, list):
+                val_values = [val_values]
+            val_results = {"val_%s" % metric: value for metric,value in zip(self.model.metrics_names, val_values)}
+        elif self.dataset._split == 0.0: ## None
             val_results = {}
         elif self.dataset._split == 1.0: ## special case; use entire set; already done!
             val_results = {"val_%s" % key: results[key] for key in results}
@@ -1233,14 +1416,14 @@ class Network():
                 print("Evaluating initial validation metrics...")
             ## need to split; check format based on output banks:
             length = len(self.dataset.test_targets)
-            targets = [column[-length:] for column in self.dataset._targets]
-            inputs = [column[-length:] for column in self.dataset._inputs]
+            targets = [column[-length:] for column in dataset_targets]
+            inputs = [column[-length:] for column in dataset_inputs]
             val_values = self.model.evaluate(inputs, targets, batch_size=batch_size, verbose=0)
             val_results = {"val_%s" % metric: value for metric,value in zip(self.model.metrics_names, val_values)}
         if val_results:
             val_results_acc = self._compute_result_acc(val_results)
         if use_validation_to_stop:
-            if ((self.dataset._split > 0) and
+            if (self.dataset._has_validation() and
                 ((accuracy is not None) or (error is not None))):
                 need_to_train = True
                 if ((accuracy is not None) and (val_results_acc >= accuracy)):
@@ -1292,21 +1475,34 @@ class Network():
             for (on_method, function) in callbacks:
                 kcallbacks.append(FunctionCallback(self, on_method, function))
         with _InterruptHandler(self) as handler:
-            if self.dataset._split == 1:
-                result = self.model.fit(self.dataset._inputs,
-                                        self.dataset._targets,
+            if batched:
+                result = self.model.fit_generator(train_stream,
+                                                  steps_per_epoch=train_steps,
+                                                  epochs=epochs,
+                                                  validation_data=validation_stream,
+                                                  validation_steps=validation_steps,
+                                                  callbacks=kcallbacks,
+                                                  class_weight=class_weight,
+                                                  max_queue_size=max_queue_size,
+                                                  workers=workers,
+                                                  use_multiprocessing=False,
+                                                  shuffle=bool(shuffle),
+                                                  verbose=kverbose)
+            elif self.dataset._split == 1:
+                result = self.model.fit(dataset_inputs,
+                                        dataset_targets,
                                         batch_size=batch_size,
                                         epochs=epochs,
-                                        validation_data=(self.dataset._inputs,
-                                                         self.dataset._targets),
+                                        validation_data=(dataset_inputs,
+                                                         dataset_targets),
                                         callbacks=kcallbacks,
                                         shuffle=shuffle,
                                         class_weight=class_weight,
                                         sample_weight=sample_weight,
                                         verbose=kverbose)
             else:
-                result = self.model.fit(self.dataset._inputs,
-                                        self.dataset._targets,
+                result = self.model.fit(dataset_inputs,
+                                        dataset_targets,
                                         batch_size=batch_size,
                                         epochs=epochs,
                                         validation_split=self.dataset._split,
@@ -1555,6 +1751,8 @@ class Network():
                 input = input[0]
         elif isinstance(input, PIL.Image.Image):
             input = image_to_array(input)
+        elif scipy.sparse.issparse(input): ## a row (or, if raw, rows) of a sparse bank
+            input = input.toarray() if raw else input.toarray()[0]
         ## End of input setup
         if not is_array_like(input):
             raise Exception("inputs should be an array")
@@ -1563,7 +1761,7 @@ class Network():
         elif self.num_input_layers == 1:
             outputs = self.model.predict(np.array([input]), batch_size=batch_size)
         else:
-            inputs = [np.array([x], "float32") for x in input]
+            inputs = [np.array([x], self._get_input_dtype(i)) for (i, x) in enumerate(input)]
             outputs = self.model.predict(inputs, batch_size=batch_size)
         ## Shape the outputs:
         if raw:
@@ -1793,6 +1991,78 @@ class Network():
             outputs = outputs[0].tolist()
         return outputs
 
+    def _propagate_batch_to(self, layer_name, inputs, batch_size=32):
+        """
+        Computes the activations at a layer of a batch of inputs (a
+        list of input banks, in input_bank_order, or a single bank),
+        as a numpy array.
+        """
+        if self.num_input_layers == 1:
+            vector = inputs
+        else:
+            vector = [inputs[self.input_bank_order.index(name)] for name in
+                      self._get_sorted_input_names(self[layer_name].input_names)]
+        return self[layer_name].model.predict(vector, batch_size=batch_size)
+
+    def build_similarity_index(self, layer_name, batch_size=32, filename=None):
+        """
+        Build a k-nearest-neighbour index (see SimilarityIndex) of the
+        dataset's patterns, in the space of a layer's activations. Use
+        an input layer to compare the inputs themselves.
+
+        The activations are computed a chunk of the dataset at a time,
+        and kept as a float32 matrix; if filename is given, the matrix
+        is memory-mapped from that .npy file. Query positions are
+        positions in the dataset.
+
+        Arguments:
+            layer_name (str) - name of layer
+            batch_size (int) - size of batch
+            filename (str) - optional .npy file for the matrix
+
+        >>> net = Network("Similar", 2, 3, 1)
+        >>> net.compile(error="mse", optimizer="adam")
+        >>> net.dataset.load([[[0, 0], [0]], [[0, 1], [1]], [[1, 0], [1]], [[1, 1], [0]]])
+        >>> index = net.build_similarity_index("input")
+        >>> index.nearest([0.9, 0.8], k=2)[0][0]
+        3
+        >>> index = net.build_similarity_index("hidden")
+        >>> len(index)
+        4
+        """
+        if layer_name not in self.layer_dict:
+            raise Exception('unknown layer: %s' % (layer_name,))
+        if self.model is None:
+            raise Exception("need to compile network")
+        dataset = self.dataset
+        size = len(dataset)
+        if size == 0:
+            raise Exception("no dataset loaded")
+        index = dataset._get_index()
+        step = batch_size * 32
+        vectors = None
+        for i in range(0, size, step):
+            inputs, targets = dataset._get_batch(index[i:i + step])
+            outputs = self._propagate_batch_to(layer_name,
+                                               inputs[0] if len(inputs) == 1 else inputs,
+                                               batch_size)
+            outputs = np.asarray(outputs, "float32").reshape(len(outputs), -1)
+            if vectors is None:
+                shape = (size, outputs.shape[1])
+                if filename is not None:
+                    vectors = np.lib.format.open_memmap(filename, mode="w+", dtype="float32",
+                                                        shape=shape)
+                else:
+                    vectors = np.empty(shape, "float32")
+            vectors[i:i + len(outputs)] = outputs
+        if filename is not None:
+            vectors.flush()
+            del vectors
+            vectors = np.load(filename, mmap_mode="r")
+        return SimilarityIndex(vectors,
+                               lambda inputs: self._propagate_batch_to(layer_name, inputs, batch_size),
+                               self.num_input_layers)
+
     def _layer_has_features(self, layer_name):
         output_shape = self[layer_name].get_output_shape()
         return (isinstance(output_shape, tuple) and len(output_shape) == 4)
@@ -2389,6 +2659,9 @@ class Network():
             * 'msle' - mean_squared_logarithmic_error
             * 'kld' - kullback_leibler_divergence
             * 'cosine' - cosine_proximity
+            * 'sparse_categorical_crossentropy' - for integer class
+              targets (one column, see Dataset.set_targets_from_labels(sparse=True)),
+              with a softmax output layer
 
         Possible optimizers are:
             * 'sgd'
@@ -2410,8 +2683,6 @@ class Network():
         if "error" in kwargs: # synonym
             kwargs["loss"] = kwargs["error"]
             del kwargs["error"]
-        if kwargs["loss"] == 'sparse_categorical_crossentropy':
-            raise Exception("'sparse_categorical_crossentropy' is not a valid error metric in conx; use 'categorical_crossentropy' with proper targets")
         if "optimizer" not in kwargs or "loss" not in kwargs:
             raise Exception("both optimizer and error/loss are required to compile a network")
         if isinstance(kwargs["optimizer"], str) and kwargs["optimizer"].lower() not in self.OPTIMIZERS:
@@ -2455,6 +2726,9 @@ class Network():
         self.model = keras.models.Model(inputs=input_k_layers, outputs=output_k_layers)
         if "metrics" in kwargs and kwargs["metrics"] is not None:
             pass ## ok allow override
+        elif kwargs["loss"] == "sparse_categorical_crossentropy":
+            ## Keras picks the matching sparse_categorical_accuracy for "acc":
+            kwargs['metrics'] = ["acc"]
         elif using_softmax: ## let's use Keras' default acc function
             kwargs['metrics'] = ["acc"] ## Keras' default
             if "tolerance" in kwargs:
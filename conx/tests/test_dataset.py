@@ -0,0 +1,612 @@
+from conx import *
+import numpy as np
+
+def test_append_mixed_dtypes():
+    """
+    Appending floats to an integer bank promotes it, rather than
+    truncating the floats; integer rows keep an integer bank.
+    """
+    ds = Dataset()
+    ds.load(inputs=np.array([[1, 2], [3, 4]], "int32"), targets=[[0], [1]])
+    ds.append([[np.array([5, 6], "int32"), [1]]])
+    assert ds._inputs[0].dtype.kind == "i"
+    ds.append([0.5, 0.7], [0])
+    assert ds._inputs[0].dtype == np.float32
+    ds.append([[np.array([1.5, 2.5]), [1]]]) ## float64 rows
+    assert ds._inputs[0].dtype == np.float32
+    uint8 = Dataset()
+    uint8.load(inputs=np.array([[0, 255]], "uint8"), targets=[[0]])
+    uint8.append([0.5, 300], [1])
+    assert uint8._inputs[0].dtype == np.float32
+    assert uint8.inputs[:] == [[0.0, 255.0], [0.5, 300.0]]
+    assert np.allclose(ds.inputs.array(), [[1, 2], [3, 4], [5, 6], [0.5, 0.7], [1.5, 2.5]])
+
+def test_load_copies_arrays():
+    """
+    Loading numpy arrays copies them: appending, transforming, or
+    shuffling and materializing the dataset leaves the caller's arrays
+    unchanged.
+    """
+    inputs = np.arange(8, dtype="float32").reshape(4, 2)
+    targets = np.array([[0], [1], [1], [0]], "float32")
+    ds = Dataset()
+    ds.load(inputs=inputs, targets=targets)
+    assert ds._inputs[0] is not inputs and not np.shares_memory(ds._inputs[0], inputs)
+    ds.append([9, 9], [1])
+    ds.compact()
+    ds.map("inputs", lambda rows: rows * 0)
+    ds.shuffle()
+    ds.materialize()
+    assert ds.inputs[:] == [[0.0, 0.0]] * 5
+    assert inputs.tolist() == [[0, 1], [2, 3], [4, 5], [6, 7]]
+    assert targets.tolist() == [[0], [1], [1], [0]]
+
+def test_hdf5_append():
+    """
+    Appending to an HDF5 file adds rows in dataset order, and refuses
+    banks that would be stored or decoded differently.
+    """
+    import os, tempfile
+    filename = os.path.join(tempfile.mkdtemp(), "append.h5")
+    ds = Dataset(name="first")
+    ds.load(inputs=[[0, 0], [0, 1]], targets=[[0], [1]], labels=["a", "b"])
+    ds.save(filename)
+    more = Dataset(name="second")
+    more.load(inputs=[[1, 0], [1, 1], [2, 2]], targets=[[1], [0], [1]], labels=["c", "a", "c"])
+    more.shuffle()
+    more.save(filename, append=True)
+    loaded = Dataset.load_file(filename)
+    assert loaded.name == "first"
+    assert loaded.inputs[:] == ds.inputs[:] + more.inputs[:]
+    assert loaded.labels[:] == ds.labels[:] + more.labels[:]
+    scaled = Dataset()
+    scaled.load_direct([np.array([[0, 255]], "uint8")], [np.array([[1]], "float32")])
+    scaled.set_input_scale(0, 1/255)
+    integers = Dataset()
+    integers.load(inputs=np.array([[3, 3]]), targets=[[0]])
+    for other in [scaled, integers]:
+        try:
+            other.save(filename, append=True)
+            assert False, "appended mismatched banks"
+        except Exception as exc:
+            assert "can't append" in str(exc)
+    assert len(Dataset.load_file(filename)) == 5
+
+def test_copy_banks_with_function():
+    """
+    Copying inputs to targets (and back) through a function is a lazy
+    step; the cached ranges and shapes come from its float32 output.
+    """
+    ds = Dataset()
+    ds.load(inputs=[[0, 1], [2, 3]], targets=[[0], [1]])
+    ds.set_targets_from_inputs(lambda row: [row[0] * 10, row[1] * 10, 1])
+    assert list(ds._transforms.keys()) == [("targets", 0)]
+    assert ds._targets_range == [(0.0, 30.0)]
+    assert ds._target_shapes == [(3,)]
+    assert ds._targets[0].dtype == np.float32
+    ds.set_inputs_from_targets(lambda row: [row[0]])
+    assert list(ds._transforms.keys()) == [("inputs", 0)]
+    assert ds._inputs_range == [(0.0, 20.0)]
+    assert ds._inputs[0].dtype == np.float32
+    assert ds.inputs[:] == [[0.0], [20.0]]
+    ## steps pending on the source bank come first:
+    ds.map("inputs", lambda rows: rows + 1)
+    ds.set_targets_from_inputs(lambda row: [row[0] * 2])
+    assert ds.targets[:] == [[2.0], [42.0]]
+    assert ds.inputs[:] == [[1.0], [21.0]]
+    ## and a dataset without targets gets a new target bank:
+    unlabeled = Dataset()
+    unlabeled.load_direct([np.array([[1, 2], [3, 4]], "uint8")])
+    unlabeled.set_input_scale(0, 0.5)
+    unlabeled.set_targets_from_inputs(lambda row: [sum(row)])
+    assert unlabeled.targets[:] == [[1.5], [3.5]]
+
+def test_compact_uint8_storage():
+    """
+    A uint8 bank with a scale stays uint8, and is seen (and batched)
+    as its logical float32 values.
+    """
+    pixels = np.array([[0, 51], [255, 102]], "uint8")
+    ds = Dataset()
+    ds.load_direct([pixels], [np.array([[0], [1]], "float32")])
+    ds.set_input_scale(0, 1/255)
+    assert ds._inputs[0] is pixels
+    assert np.allclose(ds.inputs[1], [1.0, 0.4])
+    assert ds.inputs.array().dtype == np.float32
+    assert np.allclose(ds._inputs_range, [(0.0, 1.0)])
+    assert not ds._is_batched()
+    (inputs, targets) = ds._get_keras_banks()
+    assert inputs[0].dtype == np.float32 and ds._inputs[0] is pixels
+    assert ds._get_keras_banks()[0][0] is inputs[0] ## decoded once
+    (inputs, targets) = ds._get_batch(np.array([1, 0]))
+    assert inputs[0].dtype == np.float32
+    assert np.allclose(inputs[0], [[1.0, 0.4], [0.0, 0.2]])
+    ## appended logical values are stored in the compact form:
+    ds.append([0.2, 0.6], [1])
+    assert ds._inputs[0].dtype == np.uint8
+    assert ds._inputs[0][2].tolist() == [51, 153]
+    ## and compressing a float bank quantizes its range:
+    floats = Dataset()
+    floats.load(inputs=[[-1.0, 0.0], [1.0, 0.5]], targets=[[0], [1]])
+    floats.compress_inputs(0, "uint8")
+    assert floats._inputs[0].dtype == np.uint8
+    assert np.allclose(floats.inputs[:], [[-1.0, 0.0], [1.0, 0.5]], atol=1/255)
+
+def test_content_hash_dedupe():
+    """
+    Duplicates are found by content, in dataset order, and dedupe()
+    keeps the first of each; rows appended later are indexed too.
+    """
+    ds = Dataset()
+    ds.load(inputs=[[0, 1], [1, 1], [0, 1], [1, 0], [1, 1], [0, 1]],
+            targets=[[1], [0], [0], [1], [0], [1]])
+    assert ds.duplicates() == [[0, 2, 5], [1, 4]]
+    assert ds.duplicates(targets=True) == [[0, 5], [1, 4]]
+    assert ds.find([0, 1], [1]) == [0, 5]
+    ds.append([1, 0], [1])
+    assert ds.find([1, 0]) == [3, 6]
+    ## positions follow the dataset order:
+    ds = ds.select(list(range(7))[::-1])
+    assert ds.find([1, 0]) == [0, 3]
+    ds.dedupe(targets=True)
+    assert len(ds) == 4
+    assert ds.inputs[:] == [[1.0, 0.0], [0.0, 1.0], [1.0, 1.0], [0.0, 1.0]]
+    assert ds.targets[:] == [[1.0], [1.0], [0.0], [0.0]]
+    assert ds.duplicates(targets=True) == []
+    assert ds.duplicates() == [[1, 3]]
+    ## the banks themselves are not rewritten:
+    assert len(ds._inputs[0]) == 7
+
+def test_hash_index_after_append():
+    """
+    Appending rows hashes just the new rows, and find() sees them;
+    rows whose hashes collide are still told apart by their content.
+    """
+    import conx.dataset
+    ds = Dataset()
+    ds.load(inputs=[[i, i] for i in range(100)], targets=[[i % 2] for i in range(100)])
+    assert ds.find([7, 7]) == [7]
+    hashed = []
+    original = conx.dataset._row_hashes
+    def counting_row_hashes(chunks):
+        hashed.append(len(chunks[0]))
+        return original(chunks)
+    conx.dataset._row_hashes = counting_row_hashes
+    try:
+        ds.append([[[7, 7], [1]], [[100, 100], [0]]])
+        assert ds.find([7, 7]) == [7, 100]
+        assert ds.find([100, 100]) == [101]
+        assert ds.find([7, 7], [1]) == [7, 100]
+    finally:
+        conx.dataset._row_hashes = original
+    assert hashed[0] == 2 ## the appended rows, then the patterns found
+    ## every row in one bucket:
+    conx.dataset._row_hashes = lambda chunks: np.zeros(len(chunks[0]), np.uint64)
+    try:
+        ds = Dataset()
+        ds.load(inputs=[[0, 1], [1, 1], [0, 1], [1, 0]], targets=[[1], [0], [0], [1]])
+        assert ds.duplicates() == [[0, 2]]
+        assert ds.find([1, 0]) == [3]
+    finally:
+        conx.dataset._row_hashes = original
+
+def test_incremental_stats_merge():
+    """
+    The statistics kept while appending match a scan of all the values,
+    without rescanning the bank.
+    """
+    import conx.dataset
+    rng = np.random.RandomState(0)
+    values = rng.normal(3.0, 2.0, size=(50, 3)).astype("float32")
+    ds = Dataset()
+    ds.load(inputs=values[:10], targets=values[:10, :1])
+    scans = []
+    original = conx.dataset._bank_stats
+    def counting_bank_stats(array, rows=None):
+        scans.append(len(array) if rows is None else len(rows))
+        return original(array, rows)
+    conx.dataset._bank_stats = counting_bank_stats
+    try:
+        for i in range(10, 50, 8):
+            ds.append([[row, row[:1]] for row in values[i:i + 8].tolist()])
+    finally:
+        conx.dataset._bank_stats = original
+    assert max(scans) <= 8 ## only the appended rows were scanned
+    stats = ds.stats()["inputs"][0]
+    assert stats["count"] == 50
+    assert np.isclose(stats["min"], values.min()) and np.isclose(stats["max"], values.max())
+    assert np.isclose(stats["mean"], values.astype("float64").mean())
+    assert np.isclose(stats["var"], values.astype("float64").var())
+    assert np.isclose(ds.stats()["targets"][0]["var"], values[:, :1].astype("float64").var())
+    ## a lazy subset has the statistics of its own rows:
+    ds.chop(25)
+    assert np.isclose(ds.stats()["inputs"][0]["mean"], values[:25].astype("float64").mean())
+
+def test_csr_banks():
+    """
+    A scipy.sparse CSR bank stays sparse; rows are densified only as
+    they are read or batched.
+    """
+    import scipy.sparse
+    dense = np.array([[0, 0, 2], [1, 0, 0], [0, 0, 0], [0, 3, 0]], "float32")
+    ds = Dataset()
+    ds.load(inputs=scipy.sparse.csr_matrix(dense), targets=np.array([[1], [0], [0], [1]]))
+    assert scipy.sparse.isspmatrix_csr(ds._inputs[0])
+    assert ds.inputs.shape == [(3,)]
+    assert ds.inputs[3] == [0.0, 3.0, 0.0]
+    assert ds._is_batched()
+    (inputs, targets) = ds._get_batch(np.array([3, 0]))
+    assert isinstance(inputs[0], np.ndarray)
+    assert inputs[0].tolist() == [[0, 3, 0], [0, 0, 2]]
+    stats = ds.stats()["inputs"][0]
+    assert (stats["min"], stats["max"]) == (0, 3)
+    assert np.isclose(stats["mean"], dense.mean()) and np.isclose(stats["var"], dense.var())
+    ds.append([[[5, 0, 0], [0]]])
+    assert scipy.sparse.isspmatrix_csr(ds._inputs[0])
+    assert ds._inputs[0].shape == (5, 3) and ds.inputs[4] == [5.0, 0.0, 0.0]
+    ds.shuffle()
+    assert sorted(ds.inputs[:]) == sorted(dense.tolist() + [[5.0, 0.0, 0.0]])
+    ## plain lists on the other side are fine, too:
+    listed = Dataset()
+    listed.load(inputs=scipy.sparse.csr_matrix(dense), targets=[[1], [0], [0], [1]])
+    assert scipy.sparse.isspmatrix_csr(listed._inputs[0])
+    assert listed.targets[:] == [[1.0], [0.0], [0.0], [1.0]]
+    try:
+        listed.load(inputs=scipy.sparse.csr_matrix(dense), targets=[[1], [0]])
+        assert False, "loaded mismatched lengths"
+    except Exception as exc:
+        assert "Malformed target bank" in str(exc)
+
+def test_load_series_windows():
+    """
+    Windows over a series are views onto one copy of it, with the
+    step horizon steps after each window as its target.
+    """
+    series = np.arange(40, dtype="float32").reshape(20, 2)
+    ds = Dataset.from_series(series, window=4, stride=3, horizon=2)
+    ## windows start at 0, 3, ..., 12: the last target is step 12 + 4 + 1 = 17
+    assert len(ds) == 5
+    assert ds.inputs.shape == [(4, 2)] and ds.targets.shape == [(2,)]
+    for i in range(5):
+        assert ds.inputs[i] == series[3 * i:3 * i + 4].tolist()
+        assert ds.targets[i] == series[3 * i + 5].tolist()
+    assert np.shares_memory(ds._inputs[0], ds._targets[0])
+    assert not ds._inputs[0].flags.writeable
+    ## statistics are those of the series values that the windows cover:
+    stats = ds.stats()["inputs"][0]
+    assert (stats["min"], stats["max"]) == (0, 31)
+    assert np.isclose(stats["mean"], series[:16].mean())
+    ## batches are gathered by window:
+    ds.split(0.4)
+    ((train, steps), (validation, validation_steps)) = ds._get_batch_split(2)
+    assert (len(train), len(validation)) == (2, 1)
+    assert validation[0][1][0].tolist() == [series[14].tolist(), series[17].tolist()]
+    ## replacing the banks ends the series:
+    for replace in [lambda ds: ds.load(inputs=[[0, 1]], targets=[[1]]),
+                    lambda ds: ds.load_direct([np.zeros((2, 2))], [np.zeros((2, 1))]),
+                    lambda ds: ds.clear()]:
+        windows = Dataset.from_series(series, window=4)
+        replace(windows)
+        assert windows._series is None
+    try:
+        Dataset.from_series(series, window=19, horizon=2)
+        assert False, "window too long for the series"
+    except Exception as exc:
+        assert "too short" in str(exc)
+
+def test_clear_cache_by_name():
+    """
+    Clearing one dataset's cache entries (called on the class) leaves
+    the other entries alone.
+    """
+    import os, json, tempfile
+    directory = tempfile.mkdtemp()
+    previous = os.environ.get("CONX_CACHE_DIR")
+    os.environ["CONX_CACHE_DIR"] = directory
+    try:
+        for (entry, loader) in [("mnist-1", "mnist"), ("cifar10-1", "cifar10"), ("mnist-2", "mnist")]:
+            os.makedirs(os.path.join(directory, entry))
+            with open(os.path.join(directory, entry, "meta.json"), "w") as fp:
+                json.dump({"loader": loader}, fp)
+        Dataset.clear_cache("MNIST")
+        assert sorted(os.listdir(directory)) == ["cifar10-1"]
+        Dataset().clear_cache("cifar10")
+        assert os.listdir(directory) == []
+    finally:
+        if previous is None:
+            del os.environ["CONX_CACHE_DIR"]
+        else:
+            os.environ["CONX_CACHE_DIR"] = previous
+
+def test_load_images_unlabeled_targets():
+    """
+    Without labels, the targets of loaded images are the images as
+    float32 values: a lazy transform of the input bank, written as an
+    ordinary bank to a memmap directory, so that it loads back.
+    """
+    import os, tempfile, PIL.Image
+    images = tempfile.mkdtemp()
+    for (i, gray) in enumerate([0, 51, 255]):
+        PIL.Image.new("L", (2, 2), gray).save(os.path.join(images, "%d.png" % i))
+    lazy = Dataset.load_images(images, workers=2)
+    assert list(lazy._transforms.keys()) == [("targets", 0)]
+    assert lazy._targets[0].dtype == np.float32
+    assert lazy._inputs[0].dtype == np.uint8
+    directory = tempfile.mkdtemp()
+    ds = Dataset.load_images(images, workers=2, directory=directory)
+    assert isinstance(ds._inputs[0], np.memmap) and ds._inputs[0].dtype == np.uint8
+    assert isinstance(ds._targets[0], np.memmap) and ds._targets[0].dtype == np.float32
+    assert sorted(os.listdir(directory)) == ["input_scales.json", "inputs_0.npy", "targets_0.npy"]
+    loaded = Dataset.load_memmap(directory)
+    assert np.allclose(loaded.targets.array(), ds.targets.array())
+    assert np.allclose(loaded.targets.array(), lazy.targets.array())
+    assert np.allclose(loaded.targets[1], 0.2) and loaded.targets[2] == ds.inputs[2]
+    floats = Dataset.load_images(images, workers=2, dtype="float32")
+    assert floats._targets[0] is floats._inputs[0]
+
+def test_cached_bank_stats():
+    """
+    A cached loader keeps the statistics of its banks with them, so
+    reading the cache doesn't rescan the banks.
+    """
+    import os, tempfile
+    import conx.dataset
+    from conx.datasets._cache import cached
+    @cached()
+    def squares(dataset, count=10):
+        values = np.arange(count, dtype="float32")[:, np.newaxis]
+        dataset.load_direct([values], [values ** 2])
+    previous = os.environ.get("CONX_CACHE_DIR")
+    os.environ["CONX_CACHE_DIR"] = tempfile.mkdtemp()
+    scans = []
+    original = conx.dataset._bank_stats
+    def counting_bank_stats(array, rows=None):
+        scans.append(len(array))
+        return original(array, rows)
+    try:
+        squares(Dataset()) ## writes the cache
+        conx.dataset._bank_stats = counting_bank_stats
+        ds = Dataset()
+        squares(ds)
+    finally:
+        conx.dataset._bank_stats = original
+        if previous is None:
+            del os.environ["CONX_CACHE_DIR"]
+        else:
+            os.environ["CONX_CACHE_DIR"] = previous
+    assert scans == []
+    assert isinstance(ds._inputs[0], np.memmap)
+    assert ds._targets_range == [(0.0, 81.0)]
+    assert np.isclose(ds.stats()["inputs"][0]["mean"], 4.5)
+
+def test_memmap_source_unchanged():
+    """
+    Shuffling, slicing, materializing a view, or copying a memory-mapped
+    dataset elsewhere leaves the files it was loaded from untouched.
+    """
+    import os, tempfile
+    source = tempfile.mkdtemp()
+    ds = Dataset()
+    ds.load(inputs=[[i, i] for i in range(10)], targets=[[i] for i in range(10)])
+    ds.to_memmap(source)
+    original = Dataset.load_memmap(source)
+    expected = (original.inputs[:], original.targets[:])
+    ds = Dataset.load_memmap(source)
+    ds.shuffle()
+    order = ds.inputs[:5]
+    ds.slice(5)
+    assert ds.inputs[:] == order
+    assert isinstance(ds._inputs[0], np.memmap) and len(ds._inputs[0]) == 10
+    assert ds._inputs[0].mode == "c"
+    assert (Dataset.load_memmap(source).inputs[:],
+            Dataset.load_memmap(source).targets[:]) == expected
+    parent = Dataset.load_memmap(source)
+    view = parent.select([7, 2, 4])
+    view.materialize()
+    assert view.inputs[:] == [[7.0, 7.0], [2.0, 2.0], [4.0, 4.0]]
+    assert parent.inputs[:] == expected[0]
+    assert Dataset.load_memmap(source).inputs[:] == expected[0]
+    copy = tempfile.mkdtemp()
+    view = parent.select([3, 1])
+    view.to_memmap(copy)
+    assert Dataset.load_memmap(copy).targets[:] == [[3.0], [1.0]]
+    assert Dataset.load_memmap(source).targets[:] == expected[1]
+    view = parent.select([5, 0])
+    view.materialize(copy)
+    assert os.path.dirname(view._inputs[0].filename) == os.path.abspath(copy)
+    assert view.inputs[:] == [[5.0, 5.0], [0.0, 0.0]]
+    assert Dataset.load_memmap(source).inputs[:] == expected[0]
+
+def test_transform_memmap_source_unchanged():
+    """
+    Transforming a memory-mapped dataset leaves the files it was loaded
+    from untouched, and a failing transform leaves no temp file behind.
+    """
+    import os, tempfile
+    source = tempfile.mkdtemp()
+    ds = Dataset()
+    ds.load(inputs=[[i, i] for i in range(4)], targets=[[i] for i in range(4)])
+    ds.to_memmap(source)
+    ds = Dataset.load_memmap(source)
+    ds.map("inputs", lambda rows: rows * 2)
+    assert ds.inputs[3] == [6.0, 6.0]
+    assert Dataset.load_memmap(source).inputs[3] == [3.0, 3.0]
+    output = tempfile.mkdtemp()
+    ds.map("targets", lambda rows: rows + 1)
+    ds.apply_transforms(directory=output)
+    assert isinstance(ds._targets[0], np.memmap)
+    assert Dataset.load_memmap(source).targets[:] == [[0.0], [1.0], [2.0], [3.0]]
+    assert ds.targets[:] == [[1.0], [2.0], [3.0], [4.0]]
+    ds.map("inputs", lambda rows: rows[:2])
+    try:
+        ds.apply_transforms(directory=output)
+    except Exception:
+        pass
+    else:
+        assert False, "changing the number of rows should fail"
+    assert sorted(os.listdir(output)) == ["targets_0.npy"]
+
+def test_view_negative_indices():
+    """
+    Negative view indices count back from the end of the vector, even
+    through a shuffled index or a sparse bank; past the start, they
+    raise IndexError rather than wrapping around again.
+    """
+    import scipy.sparse
+    shuffled = Dataset()
+    shuffled.load(inputs=[[i] for i in range(6)], targets=[[i] for i in range(6)])
+    shuffled.shuffle()
+    order = shuffled.inputs[:]
+    assert shuffled.inputs.view[-1].tolist() == order[-1]
+    assert shuffled.inputs.view[[-6, -2]].tolist() == [order[0], order[4]]
+    shuffled.split(2)
+    assert shuffled.test_inputs.view[-2].tolist() == order[4]
+    sparse = Dataset()
+    sparse.load(inputs=scipy.sparse.csr_matrix(np.eye(4, dtype="float32")),
+                targets=[[0], [1], [2], [3]])
+    assert sparse.inputs.view[-4].tolist() == [1.0, 0.0, 0.0, 0.0]
+    for (vector, pos) in [(shuffled.inputs, -7), (shuffled.test_inputs, -3),
+                          (shuffled.train_inputs, [0, -5]), (sparse.inputs, -5),
+                          (sparse.inputs, [-5])]:
+        try:
+            vector.view[pos]
+        except IndexError:
+            pass
+        else:
+            assert False, "%s.view[%s] should be out of range" % (vector.item, pos)
+
+def test_label_codes_and_index():
+    """
+    Labels are kept as integer codes into a vocabulary; the label
+    index follows appends (including new labels) and reordering.
+    """
+    ds = Dataset()
+    ds.load(inputs=[[i] for i in range(6)], targets=[[0]] * 6,
+            labels=["cat", "dog", "cat", "bird", "dog", "cat"])
+    assert ds._labels[0].dtype.kind == "i"
+    assert ds._label_vocab[0][ds._labels[0]].tolist() == ds.labels[:]
+    assert ds.labels.indices("cat") == [0, 2, 5]
+    assert ds.labels.indices("fish") == []
+    ds.append([[[6], [0], "fish"], [[7], [0], "dog"]])
+    assert ds.labels.indices("fish") == [6]
+    assert ds.labels.indices("dog") == [1, 4, 7]
+    assert ds.labels.counts() == {"bird": 1, "cat": 3, "dog": 3, "fish": 1}
+    ds.shuffle()
+    for label in ["bird", "cat", "dog", "fish"]:
+        positions = ds.labels.indices(label)
+        assert positions == sorted(positions)
+        assert set(ds.labels.view[positions].tolist()) == {label}
+    ds.split(0.5)
+    assert sum(ds.test_labels.counts().values()) == 4
+    assert ds.test_labels.view[ds.test_labels.indices("cat")].tolist() == \
+        ["cat"] * ds.test_labels.counts().get("cat", 0)
+
+def test_select_views():
+    """
+    Dataset.select() calls its predicate on whole arrays, and returns
+    a view in this dataset's order that shares its banks; shuffling
+    the parent afterwards does not move the view's patterns.
+    """
+    ds = Dataset()
+    ds.load(inputs=[[i, -i] for i in range(10)], targets=[[i % 2] for i in range(10)])
+    calls = []
+    def big_and_even(inputs, targets, labels):
+        calls.append((inputs.shape, targets.shape, labels))
+        return (inputs[:, 0] >= 4) & (targets[:, 0] == 0)
+    view = ds.select(big_and_even)
+    assert calls == [((10, 2), (10, 1), None)]
+    assert view.inputs[:] == [[4.0, -4.0], [6.0, -6.0], [8.0, -8.0]]
+    assert view._inputs[0] is ds._inputs[0] and view._targets[0] is ds._targets[0]
+    ds.shuffle()
+    assert view.inputs[:] == [[4.0, -4.0], [6.0, -6.0], [8.0, -8.0]]
+    order = ds.inputs[:]
+    chosen = ds.select(lambda inputs, targets, labels: inputs[:, 0] % 3 == 0)
+    assert chosen.inputs[:] == [row for row in order if row[0] % 3 == 0]
+    assert view.select([2, 0]).inputs[:] == [[8.0, -8.0], [4.0, -4.0]]
+    assert len(view.select(np.zeros(3, bool))) == 0
+    try:
+        view.select(np.ones(10, bool))
+    except Exception as exc:
+        assert "expecting (3,)" in str(exc)
+    else:
+        assert False, "a mask of the wrong length should fail"
+
+def test_augmented_batches():
+    """
+    Training batches pass through the augmentation pipeline, and differ
+    from the stored patterns; the banks, and the validation batches,
+    are left as they were.
+    """
+    images = np.random.rand(6, 4, 4, 1).astype("float32")
+    ds = Dataset()
+    ds.load(inputs=images, targets=[[i] for i in range(6)])
+    ds.augment("flip", probability=1.0)
+    ds.augment(lambda batch: batch + 10)
+    ds.split("all")
+    (train, train_steps), (test, test_steps) = ds._get_batch_split(batch_size=4, augment=True)
+    assert (train_steps, test_steps) == (2, 2)
+    inputs, targets = train[0]
+    assert np.allclose(inputs[0], np.flip(images[:4], 2) + 10)
+    assert targets[0].tolist() == [[0], [1], [2], [3]]
+    assert np.allclose(test[0][0][0], images[:4])
+    assert np.allclose(ds._inputs[0], images)
+    assert np.allclose(ds.inputs.array(), images)
+    (plain, steps), _ = ds._get_batch_split(batch_size=4)
+    assert np.allclose(plain[1][0][0], images[4:])
+
+def test_stratified_split_and_kfold():
+    """
+    A stratified split, and each k-fold, only reorder the index: the
+    banks are shared, each label gets its share of the test patterns,
+    and across the folds every pattern is tested exactly once.
+    """
+    labels = ["a"] * 12 + ["b"] * 6 + ["c"] * 3
+    ds = Dataset()
+    ds.load(inputs=[[i] for i in range(21)], targets=[[i] for i in range(21)], labels=labels)
+    banks = (ds._inputs[0], ds._targets[0], ds._labels[0])
+    ds.split(1/3, stratify=True)
+    assert all(a is b for (a, b) in zip((ds._inputs[0], ds._targets[0], ds._labels[0]), banks))
+    assert ds.test_labels.counts() == {"a": 4, "b": 2, "c": 1}
+    assert sorted(ds.inputs[:]) == [[float(i)] for i in range(21)]
+    assert [target[0] for target in ds.targets[:]] == [row[0] for row in ds.inputs[:]]
+    folds = ds.kfold(3)
+    tested = []
+    for fold in folds:
+        assert all(a is b for (a, b) in zip((fold._inputs[0], fold._targets[0], fold._labels[0]), banks))
+        assert fold.split() == (14, 7)
+        assert fold.test_labels.counts() == {"a": 4, "b": 2, "c": 1}
+        assert sorted(fold.train_inputs[:] + fold.test_inputs[:]) == sorted(ds.inputs[:])
+        tested.extend(row[0] for row in fold.test_inputs[:])
+    assert sorted(tested) == list(range(21))
+    blocks = ds.kfold(3, stratify=False, shuffle=False)
+    assert [row[0] for row in blocks[0].test_inputs[:]] == [row[0] for row in ds.inputs[:7]]
+
+def test_vectorized_append_functions():
+    """
+    append_by_function(vectorized=True) builds the same patterns as
+    calling the functions one pattern at a time, and both append to
+    the dataset; append_random fills whole banks within frange.
+    """
+    looped = Dataset()
+    looped.append_by_function(4, (0, 16), lambda i, width: [(i >> b) & 1 for b in range(width)],
+                              lambda i, v: [sum(v) % 2])
+    vectorized = Dataset()
+    vectorized.append_by_function(4, (0, 16),
+                                  lambda i, width: (i[:, None] >> np.arange(width)) & 1,
+                                  lambda i, m: m.sum(axis=1, keepdims=True) % 2,
+                                  vectorized=True)
+    assert vectorized.inputs[:] == looped.inputs[:]
+    assert vectorized.targets[:] == looped.targets[:]
+    assert vectorized._inputs[0].dtype == vectorized._targets[0].dtype == np.float32
+    vectorized.append_by_function(4, (0, 4), "onehot", lambda i, m: m[:, :1], vectorized=True)
+    assert len(vectorized) == 20
+    assert vectorized.inputs[18] == [0.0, 0.0, 1.0, 0.0]
+    assert vectorized.targets[16:] == [[1.0], [0.0], [0.0], [0.0]]
+    net = Network("Random", 3, 2)
+    net.dataset.append_random(50, frange=(2, 4))
+    net.dataset.append_random(10)
+    inputs, targets = net.dataset.inputs.array(), net.dataset.targets.array()
+    assert inputs.shape == (60, 3) and targets.shape == (60, 2)
+    assert inputs.dtype == np.float32
+    assert inputs[:50].min() >= 2 and inputs[:50].max() <= 4
+    assert targets[50:].min() >= -1 and targets[50:].max() <= 1
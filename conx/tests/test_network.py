@@ -73,6 +73,197 @@ def test_xor2():
     svg = net.to_svg()
     assert net is not None
 
+XOR_INPUTS = [[0, 0], [0, 1], [1, 0], [1, 1]]
+XOR_TARGETS = [[0], [1], [1], [0]]
+
+def make_xor_network(name, outputs=1, activation="sigmoid",
+                     error="binary_crossentropy", optimizer="adam"):
+    """
+    A 2-5-outputs network for the XOR tests below, with a sigmoid
+    hidden layer.
+    """
+    net = Network(name)
+    net.add(Layer("input", 2))
+    net.add(Layer("hidden", 5, activation="sigmoid"))
+    net.add(Layer("output", outputs, activation=activation))
+    net.connect("input", "hidden")
+    net.connect("hidden", "output")
+    net.compile(error=error, optimizer=optimizer)
+    return net
+
+def test_xor_shuffle_test():
+    """
+    XOR, tested after a lazy shuffle: an in-memory dataset is gathered
+    into the shuffled order once, and given to Keras whole.
+    """
+    net = make_xor_network("XOR Shuffle")
+    net.dataset.load(inputs=XOR_INPUTS, targets=XOR_TARGETS, labels=["0", "1", "1", "0"])
+    net.dataset.shuffle()
+    order = net.dataset.inputs[:]
+    assert not net.dataset._is_batched()
+    net.test()
+    assert net.dataset._index is None
+    assert net.dataset.inputs[:] == order
+    categories = net.test(interactive=False)
+    assert sum(len(inputs) for (label, inputs) in categories) == 4
+    for (label, inputs) in categories:
+        for pattern in inputs:
+            assert label.startswith(str(int(pattern[0]) ^ int(pattern[1])))
+
+def test_xor_batched_test_report(capsys):
+    """
+    Testing a batched (here, sparse) dataset prints one report over
+    all of the batches, numbering the patterns in dataset order.
+    """
+    import numpy as np, scipy.sparse
+    net = make_xor_network("XOR Batched")
+    net.dataset.load(inputs=scipy.sparse.csr_matrix(np.array(XOR_INPUTS, "float32")),
+                     targets=XOR_TARGETS)
+    assert net.dataset._is_batched()
+    capsys.readouterr()
+    net.test(batch_size=3, show=True)
+    out = capsys.readouterr().out
+    assert out.count("Testing training dataset") == 1
+    assert out.count("# | inputs | targets | outputs | result") == 1
+    rows = [line.split(" | ")[0] for line in out.splitlines() if line.endswith(("correct", "X"))]
+    assert rows == ["0", "1", "2", "3"]
+    assert "Total count: 4" in out
+
+def test_xor_stream():
+    """
+    XOR, streaming one pattern per batch from a keras Sequence; the
+    last batch is held out for validation.
+    """
+    from keras.utils import Sequence
+    import numpy as np
+
+    class XORSequence(Sequence):
+        def __init__(self):
+            self.requested = []
+        def __len__(self):
+            return 4
+        def __getitem__(self, index):
+            self.requested.append(index)
+            return (np.array([XOR_INPUTS[index]]), np.array([XOR_TARGETS[index]]))
+
+    stream = XORSequence()
+    net = make_xor_network("XOR Stream")
+    net.dataset.load_stream(stream)
+    net.dataset.split(0.25)
+    assert net.dataset.split() == (3, 1)
+    net.train(epochs=5, report_rate=5, plot=False, workers=2, max_queue_size=4)
+    assert net.epoch_count == 5
+    assert set(stream.requested) == {0, 1, 2, 3}
+    results = net.evaluate()
+    assert "loss" in results and "val_loss" in results
+    ## testing reads the training batches once, in order:
+    stream.requested = []
+    categories = net.test(interactive=False)
+    assert stream.requested == [0, 1, 2]
+    assert sorted(pattern for (label, inputs) in categories for pattern in inputs) == XOR_INPUTS[:3]
+
+def test_xor_sampler():
+    """
+    XOR, drawing each epoch with a class-balanced sampler: the classes
+    are drawn equally often, although "1" has twice as many patterns.
+    A weighted sampler draws patterns in proportion to their weights.
+    """
+    import numpy as np
+    net = make_xor_network("XOR Sampler")
+    net.dataset.load(inputs=XOR_INPUTS + [[0, 1], [1, 0]],
+                     targets=XOR_TARGETS + [[1], [1]],
+                     labels=["0", "1", "1", "0", "1", "1"])
+    sampler = net.dataset.sampler("balanced")
+    assert np.allclose(sampler.get_probabilities(6), [1/4, 1/8, 1/8, 1/4, 1/8, 1/8])
+    ((train, steps), validation) = net.dataset._get_batch_split(6, sampler)
+    drawn = []
+    for epoch in range(500):
+        train.on_epoch_end()
+        drawn.extend(train[0][1][0][:, 0])
+    assert len(drawn) == 3000
+    assert abs(np.mean(drawn) - 0.5) < 0.05 ## uniform shuffling gives 2/3
+    weighted = net.dataset.sampler("weighted", weights=[0, 0, 0, 0, 1, 3])
+    counts = np.bincount(weighted.sample(6, 4000), minlength=6)
+    assert counts[:4].sum() == 0 and 2.5 < counts[5] / counts[4] < 3.5
+    net.train(epochs=5, report_rate=5, plot=False, shuffle=sampler)
+    assert net.epoch_count == 5
+    assert net.dataset.targets[:] == XOR_TARGETS + [[1], [1]] ## nothing was reordered
+
+def test_xor_sparse_targets():
+    """
+    XOR as two classes, with integer class targets: they stay integers,
+    and a pattern is correct when its class has the largest output.
+    """
+    net = make_xor_network("XOR Sparse", 2, "softmax", "sparse_categorical_crossentropy",
+                           Adam(lr=0.05))
+    net.dataset.load(inputs=XOR_INPUTS, targets=XOR_TARGETS, labels=["0", "1", "1", "0"])
+    net.dataset.set_targets_from_labels(2, sparse=True)
+    assert net.dataset._targets[0].dtype.kind == "i"
+    assert net.dataset.targets[:] == XOR_TARGETS
+    net.train(epochs=2000, accuracy=1, report_rate=100, plot=False)
+    assert net.history[-1]["acc"] == 1.0
+    outputs = net.model.predict(net.dataset._inputs)
+    assert net.compute_correct([outputs], net.dataset._targets) == [True] * 4
+    categories = net.test(interactive=False)
+    assert all(label.endswith("(correct)") for (label, inputs) in categories)
+
+def test_xor_concat():
+    """
+    XOR, trained on two datasets concatenated without copying; the
+    patterns keep their sources' order until shuffled, and materialize
+    in the shuffled order.
+    """
+    net = make_xor_network("XOR Concat")
+    first = Dataset()
+    first.load(inputs=XOR_INPUTS[:2], targets=XOR_TARGETS[:2], labels=["a", "b"])
+    second = Dataset()
+    second.load(inputs=XOR_INPUTS[2:], targets=XOR_TARGETS[2:], labels=["c", "d"])
+    net.set_dataset(Dataset.concat([first, second]))
+    assert net.dataset.inputs[:] == XOR_INPUTS
+    assert net.dataset.labels[:] == ["a", "b", "c", "d"]
+    assert [list(a) for a in net.dataset._inputs[0].locate([0, 1, 2, 3])] == [[0, 0, 1, 1], [0, 1, 0, 1]]
+    net.dataset.shuffle()
+    net.dataset.split(0.25)
+    order = net.dataset.inputs[:]
+    assert sorted(order) == XOR_INPUTS
+    assert net.dataset.train_inputs[:] == order[:3]
+    for i in range(4): ## each label still goes with its pattern
+        assert net.dataset.labels[i] == "abcd"[XOR_INPUTS.index(order[i])]
+    net.train(epochs=5, report_rate=5, plot=False)
+    assert net.epoch_count == 5
+    categories = net.test(interactive=False)
+    assert sorted(pattern for (label, inputs) in categories for pattern in inputs) == sorted(order[:3])
+    net.dataset.materialize()
+    assert net.dataset.inputs[:] == order
+    assert first.inputs[:] == XOR_INPUTS[:2] ## the sources are untouched
+
+def test_similarity_index():
+    """
+    Nearest neighbours, in dataset order, match a brute-force search,
+    when the distances are computed a few rows at a time; a file-backed
+    index gives the same answers.
+    """
+    import numpy as np, os, tempfile
+    net = Network("Similar", 3, 4, 2)
+    net.compile(error="mse", optimizer="adam")
+    net.dataset.load(inputs=np.random.rand(50, 3), targets=np.zeros((50, 2)))
+    net.dataset.shuffle()
+    points = net.dataset.inputs.array()
+    queries = np.random.rand(6, 3).astype("float32")
+    index = net.build_similarity_index("input", batch_size=4)
+    index.block_rows = 7
+    positions, distances = index.query(queries, k=5)
+    brute = np.sqrt(((queries[:, None, :] - points[None, :, :]) ** 2).sum(axis=2))
+    assert positions.tolist() == np.argsort(brute, axis=1)[:, :5].tolist()
+    assert np.allclose(distances, np.sort(brute, axis=1)[:, :5], atol=1e-3)
+    assert index.nearest(points[17], k=1)[0][0] == 17
+    filename = os.path.join(tempfile.mkdtemp(), "hidden.npy")
+    on_disk = net.build_similarity_index("hidden", filename=filename)
+    in_memory = net.build_similarity_index("hidden")
+    assert isinstance(on_disk.vectors, np.memmap)
+    assert np.allclose(on_disk.vectors, in_memory.vectors)
+    assert on_disk.query(queries, k=3)[0].tolist() == in_memory.query(queries, k=3)[0].tolist()
+
 def test_dataset():
     """
     Load MNIST dataset after network creation.
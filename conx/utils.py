@@ -1482,17 +1482,18 @@ class PCA():
         True
         """
         categories = {}
+        ## (physical) bank rows, in dataset order, as read by dataset.inputs[i]:
+        rows = network.dataset._get_index()
         if test:
             tolerance = tolerance if tolerance is not None else network.tolerance
             if len(network.dataset.inputs) == 0:
                 raise Exception("nothing to test")
-            inputs = network.dataset._inputs
-            targets = network.dataset._targets
+            inputs, targets = network.dataset._get_batch(rows)
             results = network._test(inputs, targets, "train dataset", tolerance=tolerance,
                                     show_inputs=False, show_outputs=False, filter="all",
                                     interactive=False)
         for i in range(len(network.dataset.inputs)):
-            label = network.dataset._labels[label_index][i]
+            label = network.dataset._label_vocab[label_index][network.dataset._labels[label_index][rows[i]]]
             input_vector = network.dataset.inputs[i]
             if test:
                 category = "%s (%s)" % (label, "correct" if results[i] else "wrong")
@@ -349,7 +349,7 @@ class Dashboard(VBox):
                                                    minmax=(-1, 1))
                 if self.net.config["show_errors"]: ## minmax is error
                     if len(self.net.output_bank_order) == 1:
-                        errors = np.array(output) - np.array(self.net.dataset.train_targets[self.control_slider.value])
+                        errors = np.array(output) - self.net._get_target_vector(0, self.net.dataset.train_targets[self.control_slider.value])
                         self.net.display_component([errors.tolist()],
                                                    "errors",
                                                    class_id=self.class_id,
@@ -357,7 +357,7 @@ class Dashboard(VBox):
                     else:
                         errors = []
                         for bank in range(len(self.net.output_bank_order)):
-                            errors.append( np.array(output[bank]) - np.array(self.net.dataset.train_targets[self.control_slider.value][bank]))
+                            errors.append( np.array(output[bank]) - self.net._get_target_vector(bank, self.net.dataset.train_targets[self.control_slider.value][bank]))
                         self.net.display_component(errors, "errors",  class_id=self.class_id, minmax=(-1, 1))
             elif self.control_select.value == "Test" and len(self.net.dataset.test_targets) > 0:
                 self.total_text.value = "of %s" % len(self.net.dataset.test_inputs)
@@ -375,7 +375,7 @@ class Dashboard(VBox):
                                                minmax=(-1, 1))
                 if self.net.config["show_errors"]: ## minmax is error
                     if len(self.net.output_bank_order) == 1:
-                        errors = np.array(output) - np.array(self.net.dataset.test_targets[self.control_slider.value])
+                        errors = np.array(output) - self.net._get_target_vector(0, self.net.dataset.test_targets[self.control_slider.value])
                         self.net.display_component([errors.tolist()],
                                                    "errors",
                                                    class_id=self.class_id,
@@ -383,7 +383,7 @@ class Dashboard(VBox):
                     else:
                         errors = []
                         for bank in range(len(self.net.output_bank_order)):
-                            errors.append( np.array(output[bank]) - np.array(self.net.dataset.test_targets[self.control_slider.value][bank]))
+                            errors.append( np.array(output[bank]) - self.net._get_target_vector(bank, self.net.dataset.test_targets[self.control_slider.value][bank]))
                         self.net.display_component(errors, "errors", class_id=self.class_id, minmax=(-1, 1))
 
     def toggle_play(self, button):
@@ -30,7 +30,7 @@ setup(name='conx',
       author_email='doug.blank@gmail.com',
       url='https://github.com/Calysto/conx',
       install_requires=['numpy', 'keras>=2.1.3', 'matplotlib', 'ipywidgets>=7.0',
-                        'Pillow', 'IPython', 'h5py', "svgwrite", "sklearn",
+                        'Pillow', 'IPython', 'h5py', 'scipy', "svgwrite", "sklearn",
                         "tqdm", "requests", "pydot", "cairosvg"],
       packages=find_packages(include=['conx', 'conx.*']),
       include_data_files = True,